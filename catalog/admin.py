@@ -1,7 +1,19 @@
-from django.contrib import admin
+import datetime
+import uuid
+
+from django.contrib import admin, messages
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.db.models import Q
+from django.forms.models import BaseInlineFormSet
 
 # Register your models here.
-from .models import Book, BookInstance, Author, Language, Genre
+from .models import Book, BookInstance, Author, Language, Genre, Hold, LoanEvent
+from .forms import RenewBookForm
+from .widgets import AutocompleteSelect, AutocompleteSelectMultiple
+from .pagination import EstimatedCountPaginator
+from . import circulation, search
 
 # Call admin.site.register to register each model.
 
@@ -16,8 +28,136 @@ admin.site.register(Genre)
 # => Define a ModelAdmin class and register it with the model.
 # ========================================================
 
-class BookInline(admin.TabularInline):
-    model = Book
+class AutocompleteAdminMixin(object):
+    """
+    Renders the ForeignKey/ManyToManyField fields listed in 'autocomplete_widgets' with the
+    autocomplete widgets (see catalog/widgets.py), instead of a <select> of the whole related table.
+    NOTE: The related model has to be one of the kinds in catalog/autocomplete.py.
+    """
+    autocomplete_widgets = ()
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name in self.autocomplete_widgets:
+            kwargs['widget'] = AutocompleteSelect(db_field.related_model._meta.model_name)
+        return super(AutocompleteAdminMixin, self).formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def formfield_for_manytomany(self, db_field, request, **kwargs):
+        if db_field.name in self.autocomplete_widgets:
+            kwargs['widget'] = AutocompleteSelectMultiple(db_field.related_model._meta.model_name)
+        return super(AutocompleteAdminMixin, self).formfield_for_manytomany(db_field, request, **kwargs)
+
+
+class LargeTableAdminMixin(object):
+    """
+    Changelist settings for tables with millions of rows:
+    -- No COUNT(*) over the whole table (EstimatedCountPaginator, show_full_result_count).
+    -- Searching uses indexes only (see search_indexed()), never LIKE '%...%' over every row.
+    NOTE: A subclass without a search_indexed() method searches its search_fields as usual.
+    """
+    paginator              = EstimatedCountPaginator
+    show_full_result_count = False
+
+    # Maximum number of full-text matches a search returns.
+    search_limit = 1000
+
+    def get_search_results(self, request, queryset, search_term):
+        search_indexed = getattr(self, 'search_indexed', None)
+        if search_indexed is None:
+            return super(LargeTableAdminMixin, self).get_search_results(request, queryset, search_term)
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        return search_indexed(queryset, search_term), False
+
+    def matching_book_ids(self, search_term):
+        # The full-text index (title, summary, ISBN, author) of catalog/search.py.
+        return [result.object.pk for result in search.search(search_term, self.search_limit, kinds=(search.BOOK,))]
+
+
+class PaginatedInlineFormSet(BaseInlineFormSet):
+    """
+    Inline formset with one page of the related objects (instead of all of them).
+
+    The page is selected with the GET parameter '<prefix>-page' of the change page
+    (e.g. ?bookinstance_set-page=3). When the change page is saved, the formset
+    contains exactly the objects whose forms were submitted.
+    """
+    per_page    = 20
+    page_params = None  # The GET parameters of the change page (set by PaginatedInlineMixin).
+
+    @property
+    def page_param(self):
+        return '%s-page' % self.prefix
+
+    def get_queryset(self):
+        if not hasattr(self, '_page_queryset'):
+            queryset = super(PaginatedInlineFormSet, self).get_queryset()
+            self.paginator = Paginator(queryset, self.per_page)
+            if self.is_bound:
+                self._page_queryset = queryset.filter(pk__in=self.submitted_pks())
+            else:
+                self.page = self.get_page()
+                self._page_queryset = self.page.object_list
+        return self._page_queryset
+
+    def _construct_form(self, i, **kwargs):
+        form = super(PaginatedInlineFormSet, self)._construct_form(i, **kwargs)
+        # The parent object (e.g. for BookInstance.__str__()), instead of loading it again for every row.
+        setattr(form.instance, self.fk.name, self.instance)
+        return form
+
+    def get_page(self):
+        try:
+            return self.paginator.page(self.page_params.get(self.page_param, 1))
+        except PageNotAnInteger:
+            return self.paginator.page(1)
+        except EmptyPage:
+            return self.paginator.page(self.paginator.num_pages)
+
+    def submitted_pks(self):
+        pk_field = self.model._meta.pk
+        pks = []
+        for form_num in range(self.initial_form_count()):
+            try:
+                pks.append(pk_field.to_python(self.data.get('%s-%s' % (self.add_prefix(form_num), pk_field.name))))
+            except ValidationError:
+                pass
+        return pks
+
+    def page_query(self, number):
+        params = self.page_params.copy()
+        params[self.page_param] = number
+        return params.urlencode()
+
+    # For the pager in admin/edit_inline/paginated_tabular.html.
+    def previous_page_query(self):
+        return self.page_query(self.page.previous_page_number())
+
+    def next_page_query(self):
+        return self.page_query(self.page.next_page_number())
+
+
+class PaginatedInlineMixin(object):
+    """
+    Inline that shows one page (per_page rows) of the related objects, with a pager,
+    so the change page stays small however many related objects there are.
+    NOTE: Set 'ordering' (ending with a unique field), so the pages are stable.
+    """
+    formset  = PaginatedInlineFormSet
+    template = 'admin/edit_inline/paginated_tabular.html'
+    per_page = 20
+    extra    = 1
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super(PaginatedInlineMixin, self).get_formset(request, obj, **kwargs)
+        return type(formset.__name__, (formset,), {'per_page': self.per_page, 'page_params': request.GET})
+
+
+class BookInline(PaginatedInlineMixin, AutocompleteAdminMixin, admin.TabularInline):
+    model    = Book
+    ordering = ('title', 'id')
+
+    autocomplete_widgets = ('genre',)
 
 # Define the admin class
 class AuthorAdmin(admin.ModelAdmin):
@@ -40,17 +180,34 @@ admin.site.register(Author, AuthorAdmin)
 # -- TabularInline (horizonal layout) or 
 # -- StackedInline (vertical layout, just like the default model layout)
 # and include with 'inlines = [InlineClass] in another model.
-class BooksInstanceInline(admin.TabularInline):
-    model = BookInstance
+class BooksInstanceInline(PaginatedInlineMixin, admin.TabularInline):
+    model    = BookInstance
+    ordering = ('due_back', 'id')
+
+    # A text box for the user id (instead of a <select> of all users in every row).
+    raw_id_fields = ('borrower',)
 
 @admin.register(Book) # => Decorator. Does the same as admin.site.register()
-class BookAdmin(admin.ModelAdmin):
+class BookAdmin(LargeTableAdminMixin, AutocompleteAdminMixin, admin.ModelAdmin):
 
     # 'author' is a ForeignKey Field => __str__ of 'Author' model will be displayed
     # 'genre' is a ManyToMany Field, Django does not display these automatically, so 
     #  we add a function 'display_genre' to the 'Book' model to retrieve thoses values.
     list_display = ('title', 'author', 'display_genre')
 
+    autocomplete_widgets = ('author', 'genre')
+
+    # Join the author and prefetch the genres for display_genre()
+    # (instead of two extra queries per row).
+    def get_queryset(self, request):
+        return super(BookAdmin, self).get_queryset(request).for_listing().with_genres()
+
+    # NOTE: Searched with the full-text index instead (see search_indexed()).
+    search_fields = ('title', 'summary', 'isbn', 'author__last_name')
+
+    def search_indexed(self, queryset, search_term):
+        return queryset.filter(pk__in=self.matching_book_ids(search_term))
+
     # Book Instances will be displayed inline at the bottom of each book's detail view. 
     # NOTE: 3 placeholder (non-exiting) entries are automatically added to the list that cannot be removed,
     #       limiting the value of the inline display.
@@ -59,12 +216,67 @@ class BookAdmin(admin.ModelAdmin):
 
 
 @admin.register(BookInstance)
-class BookInstanceAdmin(admin.ModelAdmin):
+class BookInstanceAdmin(LargeTableAdminMixin, AutocompleteAdminMixin, admin.ModelAdmin):
 
     list_display = ('id', 'book', 'status', 'borrower', 'due_back')
+    # Book and borrower in the same query (instead of two extra queries per row).
+    list_select_related = ('book', 'borrower')
 
+    autocomplete_widgets = ('book',)
+
+    # NOTE: Both filters (and the default ordering by due_back) are served by the indexes
+    #       on (status, due_back) and (due_back), see BookInstance.Meta.
     list_filter = ('status', 'due_back')
 
+    # NOTE: Searched by index only (see search_indexed()).
+    search_fields = ('id', 'borrower__username', 'book__title')
+
+    def search_indexed(self, queryset, search_term):
+        """
+        A copy id (primary key), or the copies of a borrower's exact user name and of the books
+        matching the words (full-text index), in one filter.
+        """
+        try:
+            return queryset.filter(pk=uuid.UUID(search_term))
+        except ValueError:
+            pass
+        # Both served by an index: borrower_id IN (SELECT ...) OR book_id IN (...).
+        return queryset.filter(Q(borrower__in=User.objects.filter(username=search_term).values('pk')) |
+                               Q(book__in=self.matching_book_ids(search_term)))
+
+    # https://docs.djangoproject.com/en/1.11/ref/contrib/admin/actions/
+    # NOTE: Each action changes all selected copies with one UPDATE (see catalog/circulation.py).
+    actions = ['renew_for_three_weeks', 'mark_returned']
+
+    def get_actions(self, request):
+        actions = super(BookInstanceAdmin, self).get_actions(request)
+        if not request.user.has_perm('catalog.can_renew'):
+            actions.pop('renew_for_three_weeks', None)
+        return actions
+
+    def report(self, request, outcomes, done):
+        changed = sum(1 for result in outcomes if result.outcome == done)
+        self.message_user(request, '%d of %d copies %s.' % (changed, len(outcomes), done))
+        skipped = [str(result.id) for result in outcomes if result.outcome != done]
+        if skipped:
+            self.message_user(request, 'Not on loan: %s' % ', '.join(skipped), messages.WARNING)
+
+    def renew_for_three_weeks(self, request, queryset):
+        # Same default date (and the same rules) as the renewal form.
+        form = RenewBookForm({'renewal_date': datetime.date.today() + datetime.timedelta(weeks=3)})
+        if not form.is_valid():
+            errors = [error for field_errors in form.errors.values() for error in field_errors]
+            self.message_user(request, 'No copies renewed: %s' % ' '.join(errors), messages.ERROR)
+            return
+        copy_ids = list(queryset.values_list('pk', flat=True))
+        self.report(request, circulation.renew(copy_ids, form.cleaned_data['renewal_date']), circulation.RENEWED)
+    renew_for_three_weeks.short_description = 'Renew selected copies for 3 weeks'
+
+    def mark_returned(self, request, queryset):
+        copy_ids = list(queryset.values_list('pk', flat=True))
+        self.report(request, circulation.mark_returned(copy_ids), circulation.RETURNED)
+    mark_returned.short_description = 'Mark selected copies as returned'
+
     # https://docs.djangoproject.com/en/dev/ref/contrib/admin/#django.contrib.admin.ModelAdmin.fieldsets
     # to be displayed on the details view page.
     fieldsets = (
@@ -80,4 +292,69 @@ class BookInstanceAdmin(admin.ModelAdmin):
                 ('status', 'due_back', 'borrower'),
             )}
         ),
-    )
\ No newline at end of file
+    )
+
+
+@admin.register(Hold)
+class HoldAdmin(LargeTableAdminMixin, AutocompleteAdminMixin, admin.ModelAdmin):
+    """
+    The hold queues (see catalog/holds.py).
+    NOTE: Change the status with the hold views, not here: Saving a hold does not allocate copies.
+    """
+
+    list_display = ('book', 'patron', 'status', 'created_at', 'ready_at', 'copy')
+    list_select_related = ('book', 'patron', 'copy')
+    list_filter = ('status',)
+
+    autocomplete_widgets = ('book',)
+    raw_id_fields = ('patron', 'copy')
+    readonly_fields = ('created_at', 'ready_at')
+
+    # NOTE: Searched by index only (see search_indexed()).
+    search_fields = ('patron__username', 'book__title')
+
+    def search_indexed(self, queryset, search_term):
+        """
+        The holds of a patron's exact user name and of the books matching the words
+        (full-text index), in one filter.
+        """
+        return queryset.filter(Q(patron__in=User.objects.filter(username=search_term).values('pk')) |
+                               Q(book__in=self.matching_book_ids(search_term)))
+
+
+@admin.register(LoanEvent)
+class LoanEventAdmin(LargeTableAdminMixin, admin.ModelAdmin):
+    """
+    The loan history (see catalog/history.py), read only.
+    """
+
+    list_display = ('occurred_at', 'kind', 'copy_id', 'book_id', 'borrower_id', 'due_back')
+    list_filter = ('kind',)
+    # Served by the index on occurred_at.
+    ordering = ('-occurred_at',)
+
+    # NOTE: Searched by index only (see search_indexed()).
+    search_fields = ('copy_id', 'borrower_id')
+
+    def search_indexed(self, queryset, search_term):
+        """
+        A copy id, or a borrower's exact user name.
+        """
+        try:
+            return queryset.filter(copy_id=uuid.UUID(search_term))
+        except ValueError:
+            pass
+        borrower = User.objects.filter(username=search_term).values_list('pk', flat=True).first()
+        if borrower is None:
+            return queryset.none()
+        return queryset.filter(borrower_id=borrower)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        # Old months are deleted by the archive_loan_events and prune_loan_events commands.
+        return False
+
+    def get_readonly_fields(self, request, obj=None):
+        return [field.name for field in self.model._meta.fields]
@@ -0,0 +1,47 @@
+"""
+Searches behind the autocomplete widgets (catalog/widgets.py) and the
+'autocomplete' view (/catalog/autocomplete/<kind>/?q=...).
+
+Each kind returns at most MAX_RESULTS (id, text) pairs for what the user typed:
+
+-- 'author': Authors whose 'last name first name' starts with the query
+             (a range query on the indexed Author.name_key).
+-- 'genre':  Genres whose name starts with the query (the genre table is small).
+-- 'book':   Books matching the words of the query (the full-text index, see catalog/search.py).
+"""
+from . import search
+from .models import Author, Book, Genre
+
+MAX_RESULTS = 20
+
+
+def authors(query):
+    return [(author.pk, str(author))
+            for author in Author.objects.name_prefix(query).order_by('name_key', 'pk')[:MAX_RESULTS]]
+
+
+def genres(query):
+    return [(genre.pk, str(genre))
+            for genre in Genre.objects.filter(name__istartswith=query).order_by('name', 'pk')[:MAX_RESULTS]]
+
+
+def books(query):
+    return [(result.object.pk, str(result.object))
+            for result in search.search(query, limit=MAX_RESULTS, kinds=(search.BOOK,))]
+
+
+KINDS = {
+    'author': authors,
+    'genre':  genres,
+    'book':   books,
+}
+
+
+def complete(kind, query):
+    """
+    Returns the (id, text) pairs for a query, or [] for an empty query.
+    """
+    query = query.strip()
+    if not query:
+        return []
+    return KINDS[kind](query)
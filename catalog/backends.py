@@ -0,0 +1,24 @@
+"""
+Authentication backends of the catalog app.
+"""
+from django.contrib.auth.backends import ModelBackend
+
+from . import permissions
+
+
+class CachedPermissionBackend(ModelBackend):
+    """
+    ModelBackend that keeps the permissions of each user in the cache between requests
+    (see catalog/permissions.py), instead of loading them from the auth tables on every request.
+
+    Use it INSTEAD of ModelBackend in settings.AUTHENTICATION_BACKENDS (authenticating works the same).
+    """
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+        # Like ModelBackend, the permissions are kept on the user object for the rest of the request.
+        if not hasattr(user_obj, '_perm_cache'):
+            user_obj._perm_cache = permissions.get_or_load(
+                user_obj, lambda: super(CachedPermissionBackend, self).get_all_permissions(user_obj))
+        return user_obj._perm_cache
@@ -0,0 +1,69 @@
+"""
+Helpers for the benchmark_* management commands.
+
+The requests are sent in-process with Django's test Client (through all
+middleware, without a web server), and everything they write to the
+database is rolled back at the end (see rolled_back()).
+"""
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+Result = namedtuple('Result', ['requests', 'seconds', 'queries', 'writes'])
+
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE')
+
+
+class Rollback(Exception):
+    pass
+
+
+@contextmanager
+def rolled_back():
+    """
+    Runs the block in a transaction that is rolled back afterwards.
+    """
+    try:
+        with transaction.atomic():
+            yield
+            raise Rollback
+    except Rollback:
+        pass
+
+
+def make_clients(number, host):
+    """
+    Returns 'number' clients, one per simulated visitor (each with its own cookies).
+    """
+    return [Client(HTTP_HOST=host) for visitor in range(number)]
+
+
+def measure(clients, request, number_of_requests):
+    """
+    Calls request(client) number_of_requests times, taking turns with the clients.
+    Returns a Result with the time taken, and the queries and writes per request
+    (counted in a separate, shorter run, as counting slows the requests down).
+    """
+    start = time.time()
+    for request_num in range(number_of_requests):
+        request(clients[request_num % len(clients)])
+    seconds = time.time() - start
+
+    sample = min(number_of_requests, 20)
+    with CaptureQueriesContext(connection) as context:
+        for request_num in range(sample):
+            request(clients[request_num % len(clients)])
+    writes = [query for query in context.captured_queries
+              if query['sql'].lstrip().upper().startswith(WRITE_STATEMENTS)]
+
+    return Result(number_of_requests, seconds, len(context) / float(sample), len(writes) / float(sample))
+
+
+def format_result(name, result):
+    rate = result.requests / result.seconds if result.seconds else float('inf')
+    return '%-12s %8.1f requests/sec %8.2f ms/request %6.2f queries/request %6.2f writes/request' % (
+        name, rate, 1000.0 * result.seconds / result.requests, result.queries, result.writes)
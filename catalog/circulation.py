@@ -0,0 +1,199 @@
+"""
+Checking out, returning and renewing copies (BookInstances).
+
+Single copies: checkout(), return_copy(), renew_copy()
+======================================================
+Each is ONE conditional UPDATE:
+
+    UPDATE catalog_bookinstance SET status = 'o', ..., version = version + 1
+    WHERE id = ... AND status = 'a' [AND version = ...]
+
+so two concurrent checkouts of the same copy can't both succeed, and nothing
+waits for row locks. (A return first reads the borrower, for the loan history.) If the UPDATE changes no row, CirculationConflict is
+raised (with the copy's current state). The optional 'version' argument is
+the BookInstance.version the caller has seen (optimistic locking): the change
+then also fails if anything else changed the copy in the meantime.
+
+Many copies at once: renew(), mark_returned()
+=============================================
+Each operation is one set-based UPDATE inside one transaction (instead of
+a get() and save() per copy), and reports the outcome for every requested
+copy:
+
+-- RENEWED / RETURNED: The copy was changed.
+-- NOT_ON_LOAN:        The copy exists but is not on loan (status 'o'), so it was left alone.
+-- NOT_FOUND:          There is no copy with this id.
+
+Returned copies go to the next waiting hold of their book, if any (see catalog/holds.py).
+Every change is appended to the loan history (see catalog/history.py) and adjusts the copy
+counters of its book (see catalog/copycounts.py), in the same transaction.
+"""
+from collections import Counter, namedtuple
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import copycounts, history, holds
+from .models import BookInstance, LoanEvent
+from .signals import bulk_changed
+
+RENEWED     = 'renewed'
+RETURNED    = 'returned'
+NOT_ON_LOAN = 'not on loan'
+NOT_FOUND   = 'not found'
+
+# Kind of the loan history event of each outcome.
+EVENT_KINDS = {
+    RENEWED:  LoanEvent.RENEW,
+    RETURNED: LoanEvent.RETURN,
+}
+
+# 'copy' is None if the copy does not exist.
+CopyOutcome = namedtuple('CopyOutcome', ['id', 'copy', 'outcome'])
+
+
+def apply_to_loans(copy_ids, outcome, **values):
+    """
+    Sets the given field values on all copies in copy_ids that are on loan,
+    and returns a list of CopyOutcomes (in the order of copy_ids).
+    """
+    copy_ids = list(copy_ids)
+
+    with transaction.atomic():
+        # Lock the rows (on databases that support it), so the status can't change between SELECT and UPDATE.
+        # NOTE: The book and borrower before the change are kept for the loan history.
+        rows = {pk: (status, book_id, borrower_id) for pk, status, book_id, borrower_id in
+                BookInstance.objects.select_for_update().filter(pk__in=copy_ids)
+                .values_list('pk', 'status', 'book_id', 'borrower_id')}
+        statuses = {pk: status for pk, (status, book_id, borrower_id) in rows.items()}
+        on_loan = [pk for pk, status in statuses.items() if status == 'o']
+
+        if on_loan:
+            # NOTE: update() does not set auto_now fields.
+            BookInstance.objects.filter(pk__in=on_loan, status__exact='o').update(
+                updated_at=timezone.now(), version=F('version') + 1, **values)
+            bulk_changed.send(sender=BookInstance, pks=on_loan)
+            if 'status' in values:
+                # The counters of each book, one UPDATE per book (see catalog/copycounts.py).
+                for book_id, number in Counter(rows[pk][1] for pk in on_loan).items():
+                    copycounts.adjust_book(book_id, removed='o', added=values['status'], number=number)
+            history.record(
+                history.event(EVENT_KINDS[outcome], pk, book_id, borrower_id, values.get('due_back'))
+                for pk, (status, book_id, borrower_id) in rows.items() if status == 'o')
+
+    # Load the copies (with their new values) for the report.
+    copies = BookInstance.objects.select_related('book', 'borrower').in_bulk(copy_ids)
+
+    outcomes = []
+    for copy_id in copy_ids:
+        if copy_id not in statuses:
+            outcomes.append(CopyOutcome(copy_id, None, NOT_FOUND))
+        elif statuses[copy_id] != 'o':
+            outcomes.append(CopyOutcome(copy_id, copies.get(copy_id), NOT_ON_LOAN))
+        else:
+            outcomes.append(CopyOutcome(copy_id, copies.get(copy_id), outcome))
+    return outcomes
+
+
+def renew(copy_ids, due_back):
+    """
+    Sets the due date of all given copies that are on loan.
+    NOTE: Validate due_back first (see RenewBookForm).
+    """
+    return apply_to_loans(copy_ids, RENEWED, due_back=due_back)
+
+
+def mark_returned(copy_ids):
+    """
+    Makes all given copies that are on loan available again
+    (or reserves them for the next hold of their book).
+    """
+    # The returns, their history events and the reservations for the next holds succeed or fail together.
+    with transaction.atomic():
+        outcomes = apply_to_loans(copy_ids, RETURNED, status='a', due_back=None, borrower=None)
+        for copy_id, copy, outcome in outcomes:
+            if outcome == RETURNED and holds.allocate_copy(copy_id, copy.book_id) is not None:
+                copy.refresh_from_db()
+    return outcomes
+
+
+# Single copies (optimistic locking)
+# =============================================================================
+
+class CirculationConflict(Exception):
+    """
+    The copy is not in the expected status, or has changed since the caller read it (version).
+    'copy' is the copy as it is now.
+    """
+
+    def __init__(self, copy, message):
+        super(CirculationConflict, self).__init__(message)
+        self.copy = copy
+
+
+def change_copy(copy_id, expected_status, version=None, conditions=None, **values):
+    """
+    Sets the field values on the copy if it has the expected status (and version, if given,
+    and the field values in 'conditions'), with one conditional UPDATE. Returns the changed copy.
+    Raises BookInstance.DoesNotExist or CirculationConflict.
+    """
+    conditions = dict(conditions or {}, pk=copy_id, status=expected_status)
+    if version is not None:
+        conditions['version'] = version
+
+    # The change, the updates of derived data (signal handlers) and loading the result succeed or fail together.
+    with transaction.atomic():
+        # NOTE: update() does not set auto_now fields.
+        changed = BookInstance.objects.filter(**conditions).update(
+            updated_at=timezone.now(), version=F('version') + 1, **values)
+        if changed:
+            bulk_changed.send(sender=BookInstance, pks=[copy_id])
+            if values.get('status', expected_status) != expected_status:
+                # The counters of the copy's book (see catalog/copycounts.py).
+                copycounts.adjust_copy_book(copy_id, removed=expected_status, added=values['status'])
+        copy = BookInstance.objects.select_related('book', 'borrower').get(pk=copy_id)
+
+    if not changed:
+        if copy.status != expected_status:
+            raise CirculationConflict(copy, 'The copy is %s.' % copy.get_status_display().lower())
+        raise CirculationConflict(copy, 'The copy was changed by someone else (version %d).' % copy.version)
+    return copy
+
+
+def checkout(copy_id, borrower, due_back, version=None):
+    """
+    Lends an available copy to 'borrower' until due_back.
+    """
+    with transaction.atomic():
+        copy = change_copy(copy_id, 'a', version, status='o', borrower=borrower, due_back=due_back)
+        history.record([history.event(LoanEvent.CHECKOUT, copy.pk, copy.book_id, copy.borrower_id, due_back)])
+    return copy
+
+
+def return_copy(copy_id, version=None):
+    """
+    Makes a copy that is on loan available again (or reserves it for the next hold of its book).
+    """
+    # The return, its history event and the reservation for the next hold succeed or fail together.
+    with transaction.atomic():
+        # The borrower is kept for the history. If it changes before the UPDATE, the UPDATE does not apply.
+        borrower_id = BookInstance.objects.filter(pk=copy_id).values_list('borrower_id', flat=True).first()
+        copy = change_copy(copy_id, 'o', version, conditions={'borrower_id': borrower_id},
+                           status='a', borrower=None, due_back=None)
+        history.record([history.event(LoanEvent.RETURN, copy.pk, copy.book_id, borrower_id)])
+        if holds.allocate_copy(copy.pk, copy.book_id) is not None:
+            copy = BookInstance.objects.select_related('book', 'borrower').get(pk=copy.pk)
+    return copy
+
+
+def renew_copy(copy_id, due_back, version=None):
+    """
+    Sets the due date of a copy that is on loan.
+    NOTE: Validate due_back first (see RenewBookForm).
+    """
+    with transaction.atomic():
+        copy = change_copy(copy_id, 'o', version, due_back=due_back)
+        history.record([history.event(LoanEvent.RENEW, copy.pk, copy.book_id, copy.borrower_id, due_back)])
+    return copy
+
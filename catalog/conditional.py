@@ -0,0 +1,171 @@
+"""
+Conditional GET (ETag / Last-Modified) for the catalog pages.
+
+Book, Author and BookInstance have an 'updated_at' field (auto_now), and the
+signal handlers in catalog/signals.py also "touch" the rows whose pages show
+a change of a related object (e.g. a book when one of its copies is returned,
+or when its author is renamed). So a page can tell whether it has changed from
+a few updated_at values, without rendering the template:
+
+-- Detail pages:  The object's updated_at (one indexed lookup).
+-- List pages:    The (pk, updated_at) values of the rows of the requested page,
+                  read with the same keyset query as the page, but without joins.
+
+If the client already has the current version (If-None-Match / If-Modified-Since),
+the view answers 304 Not Modified.
+
+NOTE: The ETag also contains the user, because the pages show the user's name
+      and links depending on their permissions.
+"""
+import hashlib
+
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from .models import Author, Book
+from .pagination import InvalidCursor, KeysetPage
+
+
+def touch_books(book_ids):
+    """
+    Marks the books as changed (e.g. when one of their copies or genres changed).
+    NOTE: QuerySet.update() sends no signals, so this does not cascade further.
+    """
+    book_ids = set(pk for pk in book_ids if pk is not None)
+    if book_ids:
+        Book.objects.filter(pk__in=book_ids).update(updated_at=timezone.now())
+
+
+def touch_authors(author_ids):
+    """
+    Marks the authors as changed (e.g. when one of their books was moved to another author).
+    """
+    author_ids = set(pk for pk in author_ids if pk is not None)
+    if author_ids:
+        Author.objects.filter(pk__in=author_ids).update(updated_at=timezone.now())
+
+
+def timestamp(value):
+    # Last-Modified has a resolution of one second.
+    return int(value.timestamp()) if value is not None else None
+
+
+class ConditionalGetMixin(object):
+    """
+    View mixin that answers GET requests with 304 Not Modified if the client's copy is current.
+
+    Override get_last_modified() and/or get_etag_parts(). For conditional requests
+    (If-None-Match / If-Modified-Since) they are called BEFORE the page is rendered
+    (or its objects are loaded), so they should be cheap. For other requests they are
+    called after rendering and should use the objects the view has already loaded.
+    Returning None from both disables the validators for the request.
+    """
+
+    def get_last_modified(self):
+        """
+        Returns the time the page content last changed (an aware datetime), or None.
+        """
+        return None
+
+    def get_etag_parts(self):
+        """
+        Returns a list of values that together identify the page content, or None.
+        """
+        return None
+
+    def get_validators(self):
+        """
+        Returns the (ETag, Last-Modified timestamp) of the page. Both can be None.
+        """
+        etag  = None
+        parts = self.get_etag_parts()
+        if parts is not None:
+            user  = self.request.user
+            parts = [user.pk if user.is_authenticated else 'anonymous'] + list(parts)
+            etag  = quote_etag(hashlib.md5(repr(parts).encode('utf-8')).hexdigest())
+        return etag, timestamp(self.get_last_modified())
+
+    def get(self, request, *args, **kwargs):
+        if 'HTTP_IF_NONE_MATCH' in request.META or 'HTTP_IF_MODIFIED_SINCE' in request.META:
+            etag, last_modified = self.get_validators()
+            if etag is not None or last_modified is not None:
+                response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+                if response is not None:
+                    return response
+
+        response = super(ConditionalGetMixin, self).get(request, *args, **kwargs)
+
+        # Validators of the page just rendered (from the loaded objects, no extra query).
+        etag, last_modified = self.get_validators()
+        if etag is not None:
+            response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+
+class DetailConditionalGetMixin(ConditionalGetMixin):
+    """
+    ConditionalGetMixin for DetailViews of models with an 'updated_at' field.
+    """
+
+    def get_updated_at(self):
+        if getattr(self, 'object', None) is not None:
+            return self.object.updated_at
+
+        if not hasattr(self, '_updated_at'):
+            # Only the timestamp, not the whole object (and its joins).
+            queryset = self.model._default_manager.filter(pk=self.kwargs.get(self.pk_url_kwarg))
+            self._updated_at = queryset.values_list('updated_at', flat=True).first()
+        return self._updated_at
+
+    def get_last_modified(self):
+        return self.get_updated_at()
+
+    def get_etag_parts(self):
+        updated_at = self.get_updated_at()
+        if updated_at is None:
+            # Not found: Let the view answer 404.
+            return None
+        return [self.kwargs.get(self.pk_url_kwarg), updated_at.isoformat()]
+
+
+class ListConditionalGetMixin(ConditionalGetMixin):
+    """
+    ConditionalGetMixin for ListViews with KeysetPaginationMixin
+    (put it before KeysetPaginationMixin in the base classes).
+
+    The ETag is computed from the (pk, updated_at) values of the rows on the
+    requested page (see KeysetPaginator.page_values()), so it changes when a
+    row of the page is changed, added or removed.
+    """
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator, page, object_list, is_paginated = super(
+            ListConditionalGetMixin, self).paginate_queryset(queryset, page_size)
+        if isinstance(page, KeysetPage):
+            # The same values page_values() would read from the database.
+            self._page_values = (
+                [(obj.pk, obj.updated_at) for obj in object_list], page.has_next(), page.has_previous())
+        return (paginator, page, object_list, is_paginated)
+
+    def get_page_values(self):
+        if hasattr(self, '_page_values'):
+            return self._page_values
+
+        paginator = self.get_keyset_paginator(self.get_queryset(), self.get_paginate_by(None))
+        return paginator.page_values(self.request.GET.get(self.cursor_kwarg), ('pk', 'updated_at'))
+
+    def get_etag_parts(self):
+        if self.cursor_kwarg not in self.request.GET and self.page_kwarg in self.request.GET:
+            # Legacy (OFFSET) page: No validator.
+            return None
+
+        try:
+            rows, has_next, has_previous = self.get_page_values()
+        except InvalidCursor:
+            # Let the view answer (404).
+            return None
+        return ([self.request.get_full_path(), has_next, has_previous] +
+                [(pk, updated_at.isoformat()) for pk, updated_at in rows])
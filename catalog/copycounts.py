@@ -0,0 +1,150 @@
+"""
+Denormalized copy counters on Book: copies_total, and the number of copies per status
+(copies_available, copies_on_loan, copies_reserved, copies_in_maintenance).
+
+Pages and filters read the counters instead of the copies: The availability on the book
+detail page, the number of copies per book on the author page, and the 'available' facet
+(catalog/facets.py), which is a filter on copies_available.
+
+Every change of a copy adjusts the counters of its book with ONE relative UPDATE
+in the same transaction:
+
+    UPDATE catalog_book SET copies_on_loan = copies_on_loan + 1,
+                            copies_available = copies_available - 1 WHERE id = ...
+
+so concurrent changes of copies of the same book never overwrite each other's counts.
+
+-- save() and delete() of a copy: Signal handlers in catalog/signals.py (they use the
+   status and book as loaded from the database, see TrackedFieldsMixin).
+-- QuerySet.update() and bulk_create() (catalog/circulation.py, catalog/holds.py,
+   catalog/importer.py): The code that changes the copies calls adjust() itself.
+
+NOTE: A save() of a copy that was changed by someone else since it was loaded
+      adjusts the counters from the wrong status, and raw SQL does not adjust them
+      at all. The reconcile_copy_counts command (reconcile()) counts the copies
+      again and repairs the counters that have drifted.
+"""
+from collections import Counter, namedtuple
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from . import stats
+from .models import Book, BookInstance
+
+TOTAL = 'copies_total'
+
+# Counter of each copy status (see BookInstance.LOAN_STATUS).
+COUNTERS = {
+    'a': 'copies_available',
+    'o': 'copies_on_loan',
+    'r': 'copies_reserved',
+    'd': 'copies_in_maintenance',
+}
+FIELDS = Book.COPY_COUNTERS
+
+# Books per batch of reconcile().
+BATCH_SIZE = 500
+
+Drift = namedtuple('Drift', ['book_id', 'stored', 'counted'])
+
+
+def deltas(status, number):
+    """
+    Returns {counter: change} for 'number' copies with the status (negative: removed copies).
+    """
+    changes = {TOTAL: number}
+    if status in COUNTERS:
+        changes[COUNTERS[status]] = number
+    return changes
+
+
+def adjust(books, removed=None, added=None, number=1):
+    """
+    Adjusts the counters of 'books' (ONE book, e.g. Book.objects.filter(pk=...), or None for
+    copies without a book) with one UPDATE: 'number' copies with the status 'removed' are gone,
+    'number' copies with the status 'added' are new. A change of status is both (copies_total
+    stays the same). The numbers of copies on the home page are adjusted as well (catalog/stats.py).
+    NOTE: Call it in the transaction of the change of the copies.
+    """
+    changes = Counter()
+    if removed is not None:
+        changes.update(deltas(removed, -number))
+    if added is not None:
+        changes.update(deltas(added, number))
+
+    values = dict((field, F(field) + change) for field, change in changes.items() if change)
+    if values and books is not None:
+        books.update(**values)
+    stats.adjust(num_instances=changes[TOTAL], num_instances_available=changes[COUNTERS['a']])
+
+
+def adjust_book(book_id, removed=None, added=None, number=1):
+    adjust(Book.objects.filter(pk=book_id) if book_id is not None else None, removed, added, number)
+
+
+def adjust_copy_book(copy_id, removed=None, added=None):
+    """
+    adjust_book() of the book of a copy (found by a subquery of the same UPDATE).
+    """
+    adjust(Book.objects.filter(pk__in=BookInstance.objects.filter(pk=copy_id).values('book_id')), removed, added)
+
+
+def copies_created(copies):
+    """
+    Adds copies created with bulk_create() (one UPDATE per book and status).
+    """
+    for (book_id, status), number in Counter((copy.book_id, copy.status) for copy in copies).items():
+        adjust_book(book_id, added=status, number=number)
+
+
+# Reconciling
+# =============================================================================
+
+def count_copies(book_ids):
+    """
+    Returns {book_id: {counter: number}} counted in the copies table (one GROUP BY query).
+    """
+    counted = dict((book_id, dict.fromkeys(FIELDS, 0)) for book_id in book_ids)
+    rows = (BookInstance.objects.filter(book_id__in=book_ids).order_by()
+            .values_list('book_id', 'status').annotate(number=Count('pk')))
+    for book_id, status, number in rows:
+        for field, change in deltas(status, number).items():
+            counted[book_id][field] += change
+    return counted
+
+
+def reconcile_batch(book_ids, dry_run=False):
+    """
+    Compares the counters of the books with the copies, repairs them (unless dry_run)
+    and returns the list of Drifts found.
+    """
+    with transaction.atomic():
+        # Locked (on databases that support it): A concurrent change of a copy of these books
+        # waits for the repair, and its relative UPDATE then applies on top of the repaired values.
+        stored = dict((row[0], dict(zip(FIELDS, row[1:]))) for row in
+                      Book.objects.select_for_update().filter(pk__in=book_ids).values_list('pk', *FIELDS))
+        counted = count_copies(list(stored))
+
+        drifts = [Drift(book_id, stored[book_id], counted[book_id])
+                  for book_id in sorted(stored) if stored[book_id] != counted[book_id]]
+        if not dry_run:
+            for drift in drifts:
+                Book.objects.filter(pk=drift.book_id).update(**drift.counted)
+    return drifts
+
+
+def reconcile(batch_size=BATCH_SIZE, dry_run=False):
+    """
+    Checks the counters of all books (in primary key order, batch_size books per transaction).
+    Yields the Drifts found; they are repaired unless dry_run.
+    """
+    last_pk = 0
+    while True:
+        book_ids = list(Book.objects.filter(pk__gt=last_pk).order_by('pk')
+                        .values_list('pk', flat=True)[:batch_size])
+        if not book_ids:
+            return
+        for drift in reconcile_batch(book_ids, dry_run):
+            yield drift
+        last_pk = book_ids[-1]
@@ -0,0 +1,141 @@
+"""
+Streaming export of the catalog (see the export_catalog command and the
+'export' view).
+
+Rows are produced one at a time, so the output can be written (or sent to
+the client) while the next rows are read. The tables are read in chunks in
+primary key order ("WHERE id > <last id> ORDER BY id LIMIT <chunk size>"):
+every chunk is a short indexed query, so memory use stays flat and no
+database cursor is kept open for the whole export.
+
+Related values (author name, language, genres, ISBN) are loaded per chunk
+with select_related()/prefetch_related(), never per row.
+
+The columns match the fields read by the import_catalog command.
+"""
+import csv
+import json
+
+from .models import Author, Book, BookInstance
+
+FORMATS = ('csv', 'jsonl')
+
+CONTENT_TYPES = {
+    'csv':   'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+def book_rows(queryset):
+    for book in queryset:
+        yield {
+            'id':       book.pk,
+            'title':    book.title,
+            'summary':  book.summary,
+            'isbn':     book.isbn,
+            'author':   str(book.author) if book.author else '',
+            'language': book.language.name if book.language else '',
+            # Prefetched for the whole chunk (see EXPORTS).
+            'genre':    '|'.join(genre.name for genre in book.genre.all()),
+        }
+
+
+def author_rows(queryset):
+    for author in queryset:
+        yield {
+            'id':            author.pk,
+            'first_name':    author.first_name,
+            'last_name':     author.last_name,
+            'date_of_birth': author.date_of_birth.isoformat() if author.date_of_birth else '',
+            'date_of_death': author.date_of_death.isoformat() if author.date_of_death else '',
+        }
+
+
+def copy_rows(queryset):
+    for copy in queryset:
+        yield {
+            'id':       str(copy.pk),
+            'book_id':  copy.book_id or '',
+            'isbn':     copy.book.isbn if copy.book else '',
+            'imprint':  copy.imprint,
+            'status':   copy.status,
+            'due_back': copy.due_back.isoformat() if copy.due_back else '',
+        }
+
+
+# kind: (queryset, columns, row function)
+EXPORTS = {
+    'book': (
+        Book.objects.select_related('author', 'language').prefetch_related('genre'),
+        ('id', 'title', 'summary', 'isbn', 'author', 'language', 'genre'),
+        book_rows,
+    ),
+    'author': (
+        Author.objects.all(),
+        ('id', 'first_name', 'last_name', 'date_of_birth', 'date_of_death'),
+        author_rows,
+    ),
+    'copy': (
+        BookInstance.objects.select_related('book').only(
+            'id', 'book_id', 'imprint', 'status', 'due_back', 'book__isbn'),
+        ('id', 'book_id', 'isbn', 'imprint', 'status', 'due_back'),
+        copy_rows,
+    ),
+}
+
+KINDS = tuple(sorted(EXPORTS))
+
+
+def iter_chunks(queryset, chunk_size):
+    """
+    Yields the objects of a queryset in primary key order, loading chunk_size rows per query.
+    """
+    last_pk = None
+    while True:
+        chunk = queryset.order_by('pk')
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+
+        for obj in chunk:
+            yield obj
+        last_pk = chunk[-1].pk
+
+
+def iter_rows(kind, chunk_size=1000):
+    """
+    Yields the rows (dicts) of the export of 'kind'.
+    """
+    queryset, columns, rows = EXPORTS[kind]
+    return rows(iter_chunks(queryset, chunk_size))
+
+
+class Echo(object):
+    """
+    File-like object that returns what is written to it, so csv.writer()
+    can produce lines for a generator.
+    https://docs.djangoproject.com/en/1.11/howto/outputting-csv/#streaming-large-csv-files
+    """
+
+    def write(self, value):
+        return value
+
+
+def iter_lines(kind, format, chunk_size=1000):
+    """
+    Yields the export of 'kind' as lines of text in the given format (CSV with a header row, or JSON lines).
+    """
+    queryset, columns, rows = EXPORTS[kind]
+
+    if format == 'csv':
+        writer = csv.DictWriter(Echo(), fieldnames=columns)
+        yield writer.writerow(dict(zip(columns, columns)))
+        for row in iter_rows(kind, chunk_size):
+            yield writer.writerow(row)
+    elif format == 'jsonl':
+        for row in iter_rows(kind, chunk_size):
+            yield json.dumps(row) + '\n'
+    else:
+        raise ValueError('Unknown format: %s' % format)
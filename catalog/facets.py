@@ -0,0 +1,168 @@
+"""
+Faceted browsing of the book list (genre, language, author, availability).
+
+BookListView can be filtered with the GET parameters
+?genre=<id>&language=<id>&author=<id>&available=1
+and shows, next to each facet value, how many books the list would contain
+if that value was selected as well.
+
+Computing those counts needs one GROUP BY query per facet, so the counts are
+cached per filter combination. All cached counts are invalidated at once by
+bumping a version number (see invalidate()), which the signal handlers in
+catalog/signals.py do whenever a Book, the Book.genre relation, the status of
+a BookInstance or the name of a facet value changes.
+
+NOTE: The default (local memory) cache is per process. With several worker
+      processes, configure a shared cache (e.g. memcached) in CACHES, or the
+      other processes only see a change after CATALOG_FACETS_TIMEOUT seconds.
+"""
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+
+from .models import Book
+
+# Facets in the order they are displayed.
+GENRE     = 'genre'
+LANGUAGE  = 'language'
+AUTHOR    = 'author'
+AVAILABLE = 'available'
+FACETS    = (GENRE, LANGUAGE, AUTHOR, AVAILABLE)
+
+# Number of values (the ones with the most books) shown per facet.
+MAX_VALUES = 20
+
+VERSION_KEY = 'catalog.facets.version'
+
+Facet      = namedtuple('Facet', ['name', 'values'])
+FacetValue = namedtuple('FacetValue', ['value', 'label', 'count', 'selected', 'query'])
+
+
+def get_timeout():
+    return getattr(settings, 'CATALOG_FACETS_TIMEOUT', 600)
+
+
+def filter_books(queryset, filters, exclude=None):
+    """
+    Applies the facet filters (a dict like {'genre': 3, 'available': True}) to a Book queryset.
+    The facet named 'exclude' is not applied (used to count the values of that facet).
+    """
+    for name, value in filters.items():
+        if name == exclude or not value:
+            continue
+        if name == GENRE:
+            queryset = queryset.filter(genre=value)
+        elif name == LANGUAGE:
+            queryset = queryset.filter(language_id=value)
+        elif name == AUTHOR:
+            queryset = queryset.filter(author_id=value)
+        elif name == AVAILABLE:
+            # Books with at least one copy with status 'a' (Available): The counter on Book
+            # (see catalog/copycounts.py), no subquery on the copies.
+            queryset = queryset.filter(copies_available__gt=0)
+    return queryset
+
+
+def compute_counts(filters):
+    """
+    Returns {facet name: [(value, label, count), ...]} for the given filters (the expensive part).
+    """
+    books  = Book.objects.all()
+    counts = {}
+
+    genre_books = filter_books(books, filters, exclude=GENRE)
+    counts[GENRE] = [
+        (row['genre_id'], row['genre__name'], row['count'])
+        for row in Book.genre.through.objects.filter(book__in=genre_books)
+        .values('genre_id', 'genre__name').annotate(count=Count('book_id')).order_by('-count')[:MAX_VALUES]
+    ]
+
+    counts[LANGUAGE] = [
+        (row['language_id'], row['language__name'], row['count'])
+        for row in filter_books(books, filters, exclude=LANGUAGE).filter(language__isnull=False)
+        .values('language_id', 'language__name').annotate(count=Count('id')).order_by('-count')[:MAX_VALUES]
+    ]
+
+    counts[AUTHOR] = [
+        (row['author_id'], '%s, %s' % (row['author__last_name'], row['author__first_name']), row['count'])
+        for row in filter_books(books, filters, exclude=AUTHOR).filter(author__isnull=False)
+        .values('author_id', 'author__last_name', 'author__first_name')
+        .annotate(count=Count('id')).order_by('-count')[:MAX_VALUES]
+    ]
+
+    counts[AVAILABLE] = [
+        (1, 'Available now', filter_books(books, dict(filters, available=True)).count()),
+    ]
+
+    return counts
+
+
+def get_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # NOTE: add() does nothing if another process set the key in the meantime.
+        cache.add(VERSION_KEY, 1, None)
+        version = cache.get(VERSION_KEY, 1)
+    return version
+
+
+def invalidate():
+    """
+    Invalidates the cached counts of ALL filter combinations.
+    """
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        # Key not set (yet): Nothing has been cached with it.
+        pass
+
+
+def cache_key(filters):
+    combination = '&'.join('%s=%s' % (name, filters[name]) for name in FACETS if filters.get(name))
+    return 'catalog.facets:%s:%s' % (get_version(), combination)
+
+
+def get_counts(filters):
+    """
+    Returns the (cached) counts of compute_counts().
+    """
+    key    = cache_key(filters)
+    counts = cache.get(key)
+    if counts is None:
+        counts = compute_counts(filters)
+        cache.set(key, counts, get_timeout())
+    return counts
+
+
+def get_facets(filters, query_dict, cursor_kwarg='cursor', page_kwarg='page'):
+    """
+    Returns the list of Facets to display for the given filters.
+
+    Each FacetValue has the query string that selects (or, if already selected, deselects) it,
+    based on the current request's GET parameters (query_dict).
+    """
+    counts = get_counts(filters)
+
+    facets = []
+    for name in FACETS:
+        values = []
+        for value, label, count in counts[name]:
+            current = filters.get(name)
+            if name == AVAILABLE:
+                current = 1 if current else None
+            selected = current == value
+
+            query = query_dict.copy()
+            # A different selection starts again at the first page.
+            query.pop(cursor_kwarg, None)
+            query.pop(page_kwarg, None)
+            if selected:
+                query.pop(name, None)
+            else:
+                query[name] = value
+
+            values.append(FacetValue(value, label, count, selected, query.urlencode()))
+        facets.append(Facet(name, values))
+    return facets
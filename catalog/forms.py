@@ -1,9 +1,11 @@
 
 import datetime  # For checking the date range of the renewal date.
+import uuid  # For the copy ids of BulkCirculationForm.
 from django.core.exceptions import ValidationError
 from django.utils.translation import ugettext_lazy as _
 
 from django import forms
+from django.contrib.auth.models import User
 
 # NOTE: Form class is ideal if you need to include data from several
 # different models into the form.
@@ -46,6 +48,181 @@ class RenewBookForm(forms.Form):
         #          => The fields you are wanting to validate might not have survived the initial individual field checks.
 
 
+class LoanFilterForm(forms.Form):
+    """
+    Filters of the librarian's list of books on loan (LoanedBooksListView).
+
+    NOTE: Used with GET data, so all fields are optional.
+    """
+    overdue = forms.BooleanField(required=False, help_text="Only show overdue books.")
+    due_within = forms.IntegerField(
+        required=False,
+        min_value=0,
+        help_text="Only show books due back within this number of days.",
+    )
+    borrower = forms.CharField(required=False, max_length=150, help_text="Username of the borrower.")
+
+    def filter(self, queryset):
+        """
+        Applies the (valid) filters to a BookInstance queryset.
+        """
+        if not self.is_valid():
+            return queryset
+
+        data = self.cleaned_data
+        if data['overdue']:
+            queryset = queryset.overdue()
+        if data['due_within'] is not None:
+            queryset = queryset.due_within(data['due_within'])
+        if data['borrower']:
+            queryset = queryset.filter(borrower__username=data['borrower'])
+        return queryset
+
+
+class BookFacetForm(forms.Form):
+    """
+    Facet filters of the book list (BookListView), see catalog/facets.py.
+
+    NOTE: Used with GET data, so all fields are optional.
+    """
+    genre     = forms.IntegerField(required=False, min_value=1)
+    language  = forms.IntegerField(required=False, min_value=1)
+    author    = forms.IntegerField(required=False, min_value=1)
+    available = forms.BooleanField(required=False)
+
+    def get_filters(self):
+        """
+        Returns the selected filters as a dict (empty if the data is invalid).
+        """
+        if not self.is_valid():
+            return {}
+        return dict((name, value) for name, value in self.cleaned_data.items() if value)
+
+
+class CopyIdsField(forms.Field):
+    """
+    List of BookInstance ids (UUIDs), from checkboxes (several values) and/or
+    a text area (ids separated by whitespace, e.g. scanned one per line).
+    Duplicates are removed, the order is kept.
+    """
+    widget = forms.MultipleHiddenInput
+
+    # Maximum number of copies per request.
+    max_copies = 500
+
+    def to_python(self, value):
+        copy_ids = []
+        for item in value or []:
+            for text in item.split():
+                try:
+                    copy_id = uuid.UUID(text)
+                except ValueError:
+                    raise ValidationError(_("Invalid copy id: %(id)s"), params={'id': text})
+                if copy_id not in copy_ids:
+                    copy_ids.append(copy_id)
+
+        if len(copy_ids) > self.max_copies:
+            raise ValidationError(_("Select at most %(max)d copies."), params={'max': self.max_copies})
+        return copy_ids
+
+
+class BulkCirculationForm(RenewBookForm):
+    """
+    Renews or returns many copies at once (see catalog/circulation.py).
+
+    The renewal date is checked with the rules of RenewBookForm, once for all copies,
+    and is only required when renewing.
+    """
+    RENEW  = 'renew'
+    RETURN = 'return'
+
+    action = forms.ChoiceField(choices=((RENEW, 'Renew'), (RETURN, 'Mark returned')))
+    copies = CopyIdsField(help_text="Select the copies (or enter their ids, one per line).")
+
+    def __init__(self, *args, **kwargs):
+        super(BulkCirculationForm, self).__init__(*args, **kwargs)
+        self.fields['renewal_date'].required = False
+
+    def clean_renewal_date(self):
+        if self.cleaned_data['renewal_date'] is None:
+            return None
+        return super(BulkCirculationForm, self).clean_renewal_date()
+
+    def clean(self):
+        cleaned_data = super(BulkCirculationForm, self).clean()
+        if (cleaned_data.get('action') == self.RENEW and cleaned_data.get('renewal_date') is None
+                and 'renewal_date' not in self.errors):
+            self.add_error('renewal_date', _("Enter the renewal date."))
+        return cleaned_data
+
+
+class CopyVersionForm(forms.Form):
+    """
+    Changes one copy. 'version' is the BookInstance.version the user has seen
+    (optional, see catalog/circulation.py); the change fails if the copy has changed since.
+    """
+    version = forms.IntegerField(required=False, min_value=0, widget=forms.HiddenInput)
+
+
+class RenewCopyForm(RenewBookForm, CopyVersionForm):
+    pass
+
+
+class CirculationReportForm(forms.Form):
+    """
+    Options of the circulation report (see catalog/rollups.py).
+
+    NOTE: Used with GET data, so all fields are optional.
+    """
+    BY_CHOICES = (
+        ('book',     'Books'),
+        ('genre',    'Genres'),
+        ('language', 'Languages'),
+    )
+    by   = forms.ChoiceField(choices=BY_CHOICES, required=False, help_text="Rank books, genres or languages.")
+    days = forms.IntegerField(required=False, min_value=1, max_value=366, help_text="Number of days (default: 30).")
+    top  = forms.IntegerField(
+        required=False, min_value=1, max_value=100, help_text="Length of the ranking (default: 10).")
+    id   = forms.IntegerField(required=False, widget=forms.HiddenInput)
+
+    def get_options(self):
+        """
+        Returns (by, days, top, id), with the defaults for missing or invalid values.
+        """
+        data = self.cleaned_data if self.is_valid() else {}
+        return data.get('by') or 'book', data.get('days') or 30, data.get('top') or 10, data.get('id')
+
+
+class DueBackForm(forms.Form):
+    """
+    Lends a copy: The due date defaults to 3 weeks from today.
+    """
+    due_back = forms.DateField(required=False, help_text="Default: 3 weeks from today.")
+
+    def clean_due_back(self):
+        data = self.cleaned_data['due_back']
+        if data is None:
+            return datetime.date.today() + datetime.timedelta(weeks=3)
+        if data < datetime.date.today():
+            raise ValidationError(_('Invalid date - due date in past'))
+        if data > datetime.date.today() + datetime.timedelta(weeks=4):
+            raise ValidationError(_('Invalid date - due date more than 4 weeks ahead'))
+        return data
+
+
+class CheckoutForm(DueBackForm, CopyVersionForm):
+    borrower = forms.ModelChoiceField(
+        queryset=User.objects.filter(is_active=True), to_field_name='username',
+        help_text="User name of the borrower.")
+
+
+class PickUpForm(DueBackForm):
+    """
+    Lends the copy reserved for a hold to its patron (see catalog/holds.py).
+    """
+    pass
+
+
 # NOTE: The following form is based on ModelForm, which is ideal for forms with data from a SINGLE model.
 #       (Pulls a lot of data from the respective model via a Meta class,
 #        so much less typing compared to Form class.)
@@ -85,3 +262,23 @@ class RenewBookModelForm(ModelForm):
         labels     = { 'due_back': _('Renewal date'), }
         help_texts = { 'due_back': _('Enter a date between now and 4 weeks (default 3).'), }
 '''
+
+
+from .models import Book
+from .widgets import AutocompleteSelect, AutocompleteSelectMultiple
+
+class BookForm(forms.ModelForm):
+    """
+    Form of BookCreate and BookUpdate.
+
+    Author and genres are picked with autocomplete widgets (see catalog/widgets.py),
+    which only render the selected values instead of every author and genre.
+    """
+
+    class Meta:
+        model  = Book
+        fields = '__all__'
+        widgets = {
+            'author': AutocompleteSelect('author'),
+            'genre':  AutocompleteSelectMultiple('genre'),
+        }
@@ -0,0 +1,113 @@
+"""
+Versioned caching of template fragments (see the 'fragment_cache' template tag
+in catalog/templatetags/catalog_fragments.py).
+
+Every cached fragment belongs to one object, e.g. ('book', 12), and its cache
+key contains the current version of that object. Instead of deleting cached
+HTML, the signal handlers in catalog/signals.py give an object a new version
+(bump()) whenever something shown in its fragments changes, so the next
+request renders the fragment again. Stale entries simply expire.
+
+Kinds of fragments:
+
+-- BOOK:    The static part of the book detail page (title, author, summary, genres, ...).
+-- COPIES:  The copies of a book (status and due dates change often, so they are cached separately).
+-- AUTHOR:  The author detail page (name, dates, bibliography).
+
+Hit and miss counts per kind are kept in the cache as well (see get_counters()).
+"""
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+BOOK   = 'book'
+COPIES = 'copies'
+AUTHOR = 'author'
+KINDS  = (BOOK, COPIES, AUTHOR)
+
+HIT  = 'hits'
+MISS = 'misses'
+
+
+def get_timeout():
+    return getattr(settings, 'CATALOG_FRAGMENTS_TIMEOUT', 3600)
+
+
+def version_key(kind, pk):
+    return 'catalog.fragments.version:%s:%s' % (kind, pk)
+
+
+def counter_key(kind, counter):
+    return 'catalog.fragments.%s:%s' % (counter, kind)
+
+
+def new_version():
+    # Random rather than incremented: Setting it needs no read first,
+    # and a version that was evicted from the cache can't come back.
+    return uuid.uuid4().hex[:12]
+
+
+def get_version(kind, pk):
+    key     = version_key(kind, pk)
+    version = cache.get(key)
+    if version is None:
+        # NOTE: add() does nothing if another process set the key in the meantime.
+        cache.add(key, new_version(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump(kind, pks):
+    """
+    Gives the objects new versions, which invalidates all their cached fragments.
+    """
+    pks = set(pk for pk in pks if pk is not None)
+    if pks:
+        cache.set_many(dict((version_key(kind, pk), new_version()) for pk in pks), None)
+
+
+def fragment_key(kind, pk, name=''):
+    return 'catalog.fragments:%s:%s:%s:%s' % (kind, pk, get_version(kind, pk), name)
+
+
+def count(kind, counter):
+    key = counter_key(kind, counter)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Not set yet (or evicted).
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def get_counters():
+    """
+    Returns {kind: {'hits': ..., 'misses': ...}}.
+    """
+    keys   = [counter_key(kind, counter) for kind in KINDS for counter in (HIT, MISS)]
+    values = cache.get_many(keys)
+    return dict(
+        (kind, dict((counter, values.get(counter_key(kind, counter), 0)) for counter in (HIT, MISS)))
+        for kind in KINDS
+    )
+
+
+def reset_counters():
+    cache.delete_many([counter_key(kind, counter) for kind in KINDS for counter in (HIT, MISS)])
+
+
+def get_or_render(kind, pk, render, name=''):
+    """
+    Returns the cached fragment of an object, or calls render() and caches its result.
+    """
+    key     = fragment_key(kind, pk, name)
+    content = cache.get(key)
+    if content is not None:
+        count(kind, HIT)
+        return content
+
+    count(kind, MISS)
+    content = render()
+    cache.set(key, content, get_timeout())
+    return content
@@ -0,0 +1,122 @@
+"""
+Loan history: An append-only log of what happened to the copies (LoanEvent).
+
+catalog/circulation.py and catalog/holds.py append an event for every checkout,
+renewal, return, reservation for a hold and released reservation, in the same
+transaction as the change itself (one INSERT, or one bulk INSERT for bulk
+changes), so the log can't disagree with the copies. A save() of a copy that
+lends, returns or renews it (e.g. in the admin) is recorded by a post_save
+handler in catalog/signals.py.
+
+Storage
+=======
+The hot BookInstance table is not touched: No columns or indexes are added to
+it, and the events have no foreign keys, so writing one neither checks nor
+locks other rows.
+
+Every event carries a month key (e.g. 202610 for October 2026, UTC). Old months
+are archived to files and deleted month by month (the archive_loan_events and
+prune_loan_events commands), each with queries on the index (month, id) instead
+of a scan of the whole table.
+NOTE: On PostgreSQL, the table can be partitioned by 'month' (declarative
+      partitioning); deleting a month is then dropping its partition.
+
+Time-range queries (LoanEvent.objects.between()) use the index on occurred_at.
+"""
+import datetime
+import json
+
+from django.db.models import Min
+from django.utils import timezone
+
+from .exporter import iter_chunks
+from .models import LoanEvent
+
+
+def month_key(moment):
+    """
+    Returns the month key of a datetime (or date), e.g. 202610.
+    NOTE: Aware datetimes are converted to UTC first.
+    """
+    if isinstance(moment, datetime.datetime) and timezone.is_aware(moment):
+        moment = moment.astimezone(timezone.utc)
+    return moment.year * 100 + moment.month
+
+
+def parse_month(text):
+    """
+    Returns the month key of 'YYYY-MM', or raises ValueError.
+    """
+    return month_key(datetime.datetime.strptime(text, '%Y-%m'))
+
+
+def format_month(month):
+    return '%04d-%02d' % divmod(month, 100)
+
+
+def event(kind, copy_id, book_id, borrower_id, due_back=None):
+    """
+    Returns a (not yet saved) LoanEvent that happens now.
+    """
+    occurred_at = timezone.now()
+    return LoanEvent(
+        kind=kind, month=month_key(occurred_at), occurred_at=occurred_at,
+        copy_id=copy_id, book_id=book_id, borrower_id=borrower_id, due_back=due_back)
+
+
+def record(events):
+    """
+    Appends the events to the log (one INSERT).
+    NOTE: Call it inside the transaction of the change the events describe.
+    """
+    events = list(events)
+    if events:
+        LoanEvent.objects.bulk_create(events)
+
+
+# Archiving and deleting old months
+# =============================================================================
+
+def iter_months_before(month):
+    """
+    Yields the month keys of all months before 'month' that have events, oldest first
+    (each found with one lookup on the index, without reading the events).
+    """
+    previous = 0
+    while True:
+        previous = (LoanEvent.objects.before_month(month).filter(month__gt=previous)
+                    .aggregate(next_month=Min('month'))['next_month'])
+        if previous is None:
+            return
+        yield previous
+
+
+def event_rows(events):
+    for loan_event in events:
+        yield {
+            'id':          loan_event.pk,
+            'occurred_at': loan_event.occurred_at.isoformat(),
+            'kind':        loan_event.kind,
+            'copy_id':     str(loan_event.copy_id),
+            'book_id':     loan_event.book_id,
+            'borrower_id': loan_event.borrower_id,
+            'due_back':    loan_event.due_back.isoformat() if loan_event.due_back else None,
+        }
+
+
+def iter_month_lines(month, chunk_size=1000):
+    """
+    Yields the events of a month as JSON lines, in primary key order.
+    """
+    events = iter_chunks(LoanEvent.objects.filter(month=month), chunk_size)
+    for row in event_rows(events):
+        yield json.dumps(row) + '\n'
+
+
+def delete_month(month):
+    """
+    Deletes the events of a month, and returns their number.
+    NOTE: LoanEvent has no relations and no delete signals, so this is a single DELETE query.
+    """
+    deleted, per_model = LoanEvent.objects.filter(month=month).delete()
+    return deleted
@@ -0,0 +1,166 @@
+"""
+Hold queue: Patrons place holds on books (place_hold()), and every copy that is
+returned or becomes available is reserved (BookInstance status 'r') for the
+oldest waiting hold of its book (allocate_copy()).
+
+Allocation
+==========
+allocate_copy() never looks at the book's other copies or holds:
+
+1. ONE query on the index (book, status, created_at, id) of Hold finds the oldest waiting hold:
+
+       SELECT id, patron_id FROM catalog_hold
+       WHERE book_id = ... AND status = 'w' ORDER BY created_at, id LIMIT 1
+
+2. Conditional UPDATEs (in one transaction) claim the hold and reserve the copy:
+
+       UPDATE catalog_hold SET status = 'r', copy_id = ... WHERE id = ... AND status = 'w'
+       UPDATE catalog_bookinstance SET status = 'r', borrower_id = ... WHERE id = ... AND status = 'a'
+
+   If a concurrent allocation (of another copy of the book) has claimed the hold first,
+   the next hold is tried. If the copy is no longer available, nothing changes.
+
+So a return costs the same whether the book has one hold or hundreds, and concurrent
+returns never reserve two copies for one hold or one copy for two holds.
+
+The patron picks the reserved copy up with pick_up() (it is then on loan to them);
+cancel_hold() passes a reserved copy on to the next hold. Reservations, pickups
+and released reservations are appended to the loan history (see catalog/history.py).
+"""
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import copycounts, history
+from .models import Book, BookInstance, Hold, LoanEvent
+from .signals import bulk_changed
+
+
+class HoldError(Exception):
+    """
+    The hold can't be placed, picked up or cancelled (the message says why).
+    """
+
+
+def next_hold(book_id):
+    """
+    Returns (id, patron_id) of the oldest waiting hold of the book, or None.
+    """
+    return (Hold.objects.filter(book_id=book_id, status=Hold.WAITING)
+            .order_by('created_at', 'id').values_list('pk', 'patron_id').first())
+
+
+def change_reserved_copy(copy_id, expected_status, **values):
+    """
+    Conditional UPDATE of a copy. Returns True if the copy had the expected status (and was changed).
+    NOTE: Call it inside a transaction (the copy counters of its book are adjusted as well).
+    """
+    # NOTE: update() does not set auto_now fields.
+    changed = BookInstance.objects.filter(pk=copy_id, status=expected_status).update(
+        updated_at=timezone.now(), version=F('version') + 1, **values)
+    if changed:
+        bulk_changed.send(sender=BookInstance, pks=[copy_id])
+        if values.get('status', expected_status) != expected_status:
+            copycounts.adjust_copy_book(copy_id, removed=expected_status, added=values['status'])
+    return bool(changed)
+
+
+def allocate_copy(copy_id, book_id):
+    """
+    Reserves an available copy for the oldest waiting hold of its book.
+    Returns the id of the hold, or None (no waiting hold, or the copy is not available).
+    """
+    while True:
+        with transaction.atomic():
+            hold = next_hold(book_id)
+            if hold is None:
+                return None
+            hold_id, patron_id = hold
+
+            claimed = Hold.objects.filter(pk=hold_id, status=Hold.WAITING).update(
+                status=Hold.READY, copy_id=copy_id, ready_at=timezone.now())
+            if not claimed:
+                # Claimed by a concurrent allocation (or cancelled): Try the next one.
+                continue
+
+            if not change_reserved_copy(copy_id, 'a', status='r', borrower_id=patron_id, due_back=None):
+                # The copy has been lent or reserved in the meantime: The hold keeps waiting.
+                transaction.set_rollback(True)
+                return None
+            history.record([history.event(LoanEvent.RESERVE, copy_id, book_id, patron_id)])
+            return hold_id
+
+
+def fill_holds(book_id):
+    """
+    Reserves available copies of the book for its waiting holds, as long as there are both.
+    Returns the ids of the holds that became ready.
+    """
+    hold_ids = []
+    while True:
+        # Uses the index (book, status) of BookInstance.
+        copy_ids = list(BookInstance.objects.filter(book_id=book_id, status='a')
+                        .order_by().values_list('pk', flat=True)[:1])
+        if not copy_ids:
+            break
+        hold_id = allocate_copy(copy_ids[0], book_id)
+        if hold_id is None:
+            break
+        hold_ids.append(hold_id)
+    return hold_ids
+
+
+def place_hold(book, patron):
+    """
+    Puts a hold for the patron at the end of the book's queue, and reserves an available copy
+    right away if there is one. Returns the hold.
+    Raises HoldError if the patron already has an active hold on the book.
+    """
+    with transaction.atomic():
+        # Lock the book (on databases that support it): A concurrent place_hold() of the same book
+        # waits here, so it can't pass the check before this hold is created.
+        list(Book.objects.select_for_update().filter(pk=book.pk).values_list('pk', flat=True))
+        if Hold.objects.filter(book=book, patron=patron, status__in=Hold.ACTIVE).exists():
+            raise HoldError('You already have a hold on this book.')
+        hold = Hold.objects.create(book=book, patron=patron)
+    fill_holds(book.pk)
+    hold.refresh_from_db()
+    return hold
+
+
+def pick_up(hold_id, due_back):
+    """
+    Lends the copy reserved for a ready hold to its patron until due_back, and returns the copy.
+    NOTE: Validate due_back first (see PickUpForm).
+    Raises Hold.DoesNotExist or HoldError.
+    """
+    with transaction.atomic():
+        hold = Hold.objects.get(pk=hold_id)
+        if not Hold.objects.filter(pk=hold_id, status=Hold.READY).update(status=Hold.FULFILLED):
+            raise HoldError('The hold is not ready for pickup.')
+        # NOTE: Raising rolls the hold back to READY.
+        if not change_reserved_copy(hold.copy_id, 'r', status='o', due_back=due_back):
+            raise HoldError('The reserved copy is no longer reserved.')
+        history.record([history.event(LoanEvent.CHECKOUT, hold.copy_id, hold.book_id, hold.patron_id, due_back)])
+        return BookInstance.objects.select_related('book', 'borrower').get(pk=hold.copy_id)
+
+
+def cancel_hold(hold_id):
+    """
+    Cancels an active hold. A copy reserved for it goes to the next waiting hold
+    (or becomes available). Raises Hold.DoesNotExist or HoldError.
+    """
+    with transaction.atomic():
+        hold = Hold.objects.get(pk=hold_id)
+        cancelled = hold.status in Hold.ACTIVE and Hold.objects.filter(
+            pk=hold_id, status=hold.status).update(status=Hold.CANCELLED)
+        if not cancelled:
+            raise HoldError('The hold is no longer active.')
+
+        released = hold.status == Hold.READY and change_reserved_copy(
+            hold.copy_id, 'r', status='a', borrower=None)
+        if released:
+            history.record([history.event(LoanEvent.RELEASE, hold.copy_id, hold.book_id, hold.patron_id)])
+
+    if released:
+        allocate_copy(hold.copy_id, hold.book_id)
@@ -0,0 +1,424 @@
+"""
+Streaming bulk import of catalog records (see the import_catalog command).
+
+Records are read one at a time from a CSV or JSON-lines stream and written
+in batches with bulk_create(), so memory use does not depend on the size of
+the input. Each batch is one transaction.
+
+Record fields per kind:
+
+-- genre, language: name
+-- author:          first_name, last_name, date_of_birth, date_of_death (YYYY-MM-DD, optional)
+-- book:            title, summary, isbn,
+                    author   ("Last name, First name"),
+                    language (name),
+                    genre    (names, separated by '|' in CSV or a list in JSON)
+-- copy:            isbn (of the book), imprint, status (d/o/a/r), due_back (optional), id (UUID, optional)
+
+Genres, languages and authors referenced by books are looked up by name
+through an in-memory LookupCache (one query per batch for all unknown names)
+and created if they don't exist yet.
+
+Malformed values (dates, copy ids, statuses) stop the import with a
+CatalogImportError naming the record (numbered from 1 in the input; the line
+number of a JSON-lines file without blank lines). The batch is rolled back, so
+the import can be resumed from its checkpoint once the input is fixed.
+
+Importing is idempotent, so a batch can be imported again: Books whose ISBN
+exists already and copies whose id exists already are skipped (as are repeats
+within the input). NOTE: A crash after a batch is committed but before its
+checkpoint is saved imports that batch again on resume; books without an ISBN
+are then created twice.
+"""
+import csv
+import itertools
+import json
+import os
+import time
+import uuid
+from collections import namedtuple
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Max
+from django.utils.dateparse import parse_date
+
+from . import copycounts
+from .models import Author, Book, BookInstance, Genre, Language
+from .signals import bulk_changed
+
+KINDS   = ('genre', 'language', 'author', 'book', 'copy')
+FORMATS = ('csv', 'jsonl')
+
+ImportResult = namedtuple('ImportResult', ['records', 'created', 'skipped', 'seconds'])
+
+
+class CatalogImportError(Exception):
+    pass
+
+
+def read_records(stream, format):
+    """
+    Yields the records of a CSV (with header row) or JSON-lines stream as dicts.
+    """
+    if format == 'csv':
+        for record in csv.DictReader(stream):
+            yield record
+    elif format == 'jsonl':
+        for line_number, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as error:
+                raise CatalogImportError('Line %d: %s' % (line_number, error))
+    else:
+        raise CatalogImportError('Unknown format: %s' % format)
+
+
+def batches(iterable, size):
+    """
+    Splits an iterable into lists of (at most) 'size' items, without reading ahead further.
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def bulk_create_with_pks(model, objects):
+    """
+    bulk_create() that also sets the primary keys of the created objects.
+
+    PostgreSQL returns the new ids from the INSERT. Other databases (SQLite) don't,
+    but there the rows of one INSERT get consecutive ids above the current maximum,
+    so we read them back in that order.
+    NOTE: Has to run inside a transaction (e.g. transaction.atomic()).
+    """
+    if not objects:
+        return objects
+    if connection.features.can_return_ids_from_bulk_insert:
+        return model.objects.bulk_create(objects)
+
+    last_pk = model.objects.aggregate(last_pk=Max('pk'))['last_pk'] or 0
+    model.objects.bulk_create(objects)
+
+    pks = list(model.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True))
+    if len(pks) != len(objects):
+        raise CatalogImportError('Could not determine the ids of the new %s rows.' % model._meta.verbose_name)
+    for obj, pk in zip(objects, pks):
+        obj.pk = pk
+    return objects
+
+
+class LookupCache(object):
+    """
+    In-memory map from natural keys (e.g. genre name) to primary keys.
+
+    resolve() looks up all unknown keys of a batch with one query and
+    creates the missing rows with one bulk_create(), so there is never a
+    get_or_create() per record.
+    """
+
+    def __init__(self, model, key_fields, create=True):
+        self.model      = model
+        self.key_fields = key_fields
+        self.create     = create
+        self.pks        = {}
+        self.created    = 0
+
+    def resolve(self, keys, defaults=None):
+        """
+        Returns {key: pk} for the given keys (tuples of key_fields values).
+        If create is False, unknown keys are mapped to None.
+        'defaults' can map a key to further field values for the new row.
+        """
+        keys    = set(keys)
+        missing = keys.difference(self.pks)
+
+        if missing:
+            # One query for all missing keys (filtered by the first key field, matched exactly below).
+            lookup = {self.key_fields[0] + '__in': set(key[0] for key in missing)}
+            for row in self.model.objects.filter(**lookup).order_by('pk').values_list('pk', *self.key_fields):
+                key = tuple(row[1:])
+                if key in missing:
+                    self.pks.setdefault(key, row[0])
+            missing = missing.difference(self.pks)
+
+        if missing and self.create:
+            defaults = defaults or {}
+            objects  = []
+            for key in missing:
+                values = dict(defaults.get(key, {}))
+                values.update(zip(self.key_fields, key))
+                objects.append(self.model(**values))
+            bulk_create_with_pks(self.model, objects)
+            bulk_changed.send(sender=self.model, pks=[obj.pk for obj in objects])
+
+            for obj in objects:
+                self.pks[tuple(getattr(obj, field) for field in self.key_fields)] = obj.pk
+            self.created += len(objects)
+
+        return dict((key, self.pks.get(key)) for key in keys)
+
+
+def text(record, name):
+    value = record.get(name)
+    return '' if value is None else str(value).strip()
+
+
+def date_or_none(record, name):
+    value = text(record, name)
+    if not value:
+        return None
+    try:
+        parsed = parse_date(value)
+    except ValueError:
+        # Well formed, but not a valid date (e.g. 2017-02-30).
+        parsed = None
+    if parsed is None:
+        raise ValueError('%s is not a date (YYYY-MM-DD): %s' % (name, value))
+    return parsed
+
+
+def uuid_or_none(record, name):
+    value = text(record, name)
+    if not value:
+        return None
+    try:
+        return uuid.UUID(value)
+    except ValueError:
+        raise ValueError('%s is not a UUID: %s' % (name, value))
+
+
+COPY_STATUSES = [status for status, label in BookInstance.LOAN_STATUS]
+
+
+def copy_status(record):
+    status = text(record, 'status') or 'd'
+    if status not in COPY_STATUSES:
+        raise ValueError('status is not one of %s: %s' % ('/'.join(COPY_STATUSES), status))
+    return status
+
+
+def author_key(name):
+    """
+    'Last name, First name' -> (last_name, first_name)
+    """
+    last_name, _, first_name = name.partition(',')
+    return last_name.strip(), first_name.strip()
+
+
+def genre_names(record):
+    genres = record.get('genre') or []
+    if isinstance(genres, str):
+        genres = genres.split('|')
+    return [name.strip() for name in genres if name.strip()]
+
+
+class CatalogImporter(object):
+    """
+    Imports records of one kind (see KINDS).
+
+    With dry_run=True, records are parsed and references resolved against the
+    database, but nothing is written.
+    """
+
+    def __init__(self, kind, batch_size=1000, dry_run=False):
+        if kind not in KINDS:
+            raise CatalogImportError('Unknown kind: %s' % kind)
+
+        self.kind       = kind
+        self.batch_size = batch_size
+        self.dry_run    = dry_run
+        self.skipped    = 0
+
+        create = not dry_run
+        self.genres    = LookupCache(Genre, ('name',), create)
+        self.languages = LookupCache(Language, ('name',), create)
+        self.authors   = LookupCache(Author, ('last_name', 'first_name'), create)
+        # Books are only referenced (by copies), never created by lookup.
+        self.books     = LookupCache(Book, ('isbn',), create=False)
+        self.created   = 0
+        # Number of the first record of the current batch (for error messages).
+        self.first     = 1
+
+    def run(self, records, skip=0, on_batch=None):
+        """
+        Imports the records (an iterable of dicts), skipping the first 'skip' ones.
+        on_batch(records_done) is called after each committed batch (e.g. to save a checkpoint).
+        """
+        start = time.time()
+        done  = skip
+        records = itertools.islice(records, skip, None)
+
+        for batch in batches(records, self.batch_size):
+            self.first = done + 1
+            if self.dry_run:
+                self.import_batch(batch)
+            else:
+                try:
+                    with transaction.atomic():
+                        self.import_batch(batch)
+                except IntegrityError as error:
+                    # E.g. a row written by someone else in the meantime.
+                    raise CatalogImportError('Records %d-%d: %s' % (done + 1, done + len(batch), error))
+            done += len(batch)
+            if on_batch is not None:
+                on_batch(done)
+
+        created = (self.created + self.genres.created + self.languages.created + self.authors.created)
+        return ImportResult(done - skip, created, self.skipped, time.time() - start)
+
+    def import_batch(self, batch):
+        getattr(self, 'import_%s' % self.kind)(batch)
+
+    def parse(self, batch, parse):
+        """
+        Yields (record, parse(record)) for the records of the batch.
+        Raises CatalogImportError with the number of the first malformed record.
+        """
+        for number, record in enumerate(batch, self.first):
+            try:
+                yield record, parse(record)
+            except ValueError as error:
+                raise CatalogImportError('Record %d: %s' % (number, error))
+
+    def new_keys(self, keys, existing):
+        """
+        Returns a list of flags, True for each key that is neither in 'existing' nor repeated
+        before it in 'keys' (the others are counted as skipped). A key None is always new.
+        """
+        seen  = set(existing)
+        flags = []
+        for key in keys:
+            flags.append(key is None or key not in seen)
+            seen.add(key)
+        self.skipped += flags.count(False)
+        return flags
+
+    # Genres, languages, authors: Created only if they don't exist yet.
+    def import_genre(self, batch):
+        self.genres.resolve([(text(record, 'name'),) for record in batch if text(record, 'name')])
+
+    def import_language(self, batch):
+        self.languages.resolve([(text(record, 'name'),) for record in batch if text(record, 'name')])
+
+    def import_author(self, batch):
+        defaults = {}
+        parsed   = self.parse(batch, lambda record: {
+            'date_of_birth': date_or_none(record, 'date_of_birth'),
+            'date_of_death': date_or_none(record, 'date_of_death'),
+        })
+        for record, dates in parsed:
+            key = (text(record, 'last_name'), text(record, 'first_name'))
+            if not key[0]:
+                self.skipped += 1
+                continue
+            defaults[key] = dates
+        self.authors.resolve(defaults.keys(), defaults)
+
+    def import_book(self, batch):
+        # Books whose ISBN exists already (e.g. imported by an earlier run of this batch) are skipped.
+        isbns    = [text(record, 'isbn') for record in batch]
+        existing = Book.objects.filter(isbn__in=set(isbns) - {''}).values_list('isbn', flat=True)
+        flags    = self.new_keys([isbn or None for isbn in isbns], existing)
+        batch    = [record for record, new in zip(batch, flags) if new]
+
+        # Resolve all references of the batch first (one query per model).
+        authors   = self.authors.resolve(
+            [author_key(text(record, 'author')) for record in batch if text(record, 'author')])
+        languages = self.languages.resolve(
+            [(text(record, 'language'),) for record in batch if text(record, 'language')])
+        genres    = self.genres.resolve(
+            [(name,) for record in batch for name in genre_names(record)])
+
+        books = [
+            Book(
+                title=text(record, 'title'),
+                summary=text(record, 'summary'),
+                isbn=text(record, 'isbn'),
+                author_id=authors.get(author_key(text(record, 'author'))) if text(record, 'author') else None,
+                language_id=languages.get((text(record, 'language'),)),
+            )
+            for record in batch
+        ]
+        if self.dry_run:
+            return
+
+        bulk_create_with_pks(Book, books)
+
+        # Book.genre rows in bulk, too.
+        Through = Book.genre.through
+        Through.objects.bulk_create([
+            Through(book_id=book.pk, genre_id=genres[(name,)])
+            for book, record in zip(books, batch)
+            for name in set(genre_names(record))
+        ])
+        self.created += len(books)
+        bulk_changed.send(sender=Book, pks=[book.pk for book in books])
+
+    def import_copy(self, batch):
+        books = self.books.resolve([(text(record, 'isbn'),) for record in batch])
+
+        parsed = list(self.parse(batch, lambda record: {
+            'id':       uuid_or_none(record, 'id') or uuid.uuid4(),
+            'status':   copy_status(record),
+            'due_back': date_or_none(record, 'due_back'),
+        }))
+
+        # Copies whose id exists already (e.g. imported by an earlier run of this batch) are skipped.
+        ids      = [values['id'] for record, values in parsed]
+        existing = BookInstance.objects.filter(pk__in=ids).values_list('pk', flat=True)
+        flags    = self.new_keys(ids, existing)
+
+        copies = []
+        for (record, values), new in zip(parsed, flags):
+            if not new:
+                continue
+            book_id = books.get((text(record, 'isbn'),))
+            if book_id is None:
+                # Unknown book: Can't be imported.
+                self.skipped += 1
+                continue
+            copies.append(BookInstance(book_id=book_id, imprint=text(record, 'imprint'), **values))
+        if self.dry_run:
+            return
+
+        BookInstance.objects.bulk_create(copies)
+        copycounts.copies_created(copies)
+        self.created += len(copies)
+        bulk_changed.send(sender=BookInstance, pks=[copy.pk for copy in copies])
+
+
+class Checkpoint(object):
+    """
+    Remembers how many records of a source have been imported (committed),
+    so an interrupted import can be resumed.
+    """
+
+    def __init__(self, path, source, kind):
+        self.path   = path
+        self.source = source
+        self.kind   = kind
+
+    def load(self):
+        """
+        Returns the number of records already imported (0 if the checkpoint is for another source).
+        """
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path) as checkpoint_file:
+            data = json.load(checkpoint_file)
+        if data.get('source') != self.source or data.get('kind') != self.kind:
+            return 0
+        return data['records']
+
+    def save(self, records):
+        # Write to a temporary file first, so a crash never leaves a broken checkpoint behind.
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w') as checkpoint_file:
+            json.dump({'source': self.source, 'kind': self.kind, 'records': records}, checkpoint_file)
+        os.replace(temporary_path, self.path)
@@ -0,0 +1,54 @@
+import io
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog import history
+
+
+class Command(BaseCommand):
+    """
+    Writes the loan history of old months to files, one JSON-lines file per month
+    (loan_events_YYYY-MM.jsonl), and deletes the archived months from the database.
+
+    Usage: python3 manage.py archive_loan_events --before 2026-01 [--output-dir archive] [--keep]
+
+    NOTE: A month is only deleted after its file has been written completely.
+          The events are read in chunks in primary key order (see catalog/exporter.py),
+          so memory use does not depend on the size of a month.
+    """
+
+    help = 'Archives (and deletes) the loan history of the months before a given month.'
+
+    def add_arguments(self, parser):
+        # NOTE: Checked in handle(), call_command() does not support required options (Django 1.11).
+        parser.add_argument('--before', help='First month to keep, as YYYY-MM (required).')
+        parser.add_argument('--output-dir', default='.', help='Directory of the files (default: current directory).')
+        parser.add_argument(
+            '--keep', action='store_true', help='Only write the files, keep the events in the database.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000, help='Number of events read per query (default: 1000).')
+
+    def handle(self, *args, **options):
+        try:
+            before = history.parse_month(options['before'] or '')
+        except ValueError:
+            raise CommandError('--before must be a month (YYYY-MM), not %r.' % options['before'])
+
+        for month in history.iter_months_before(before):
+            path = os.path.join(options['output_dir'], 'loan_events_%s.jsonl' % history.format_month(month))
+            if os.path.exists(path):
+                raise CommandError('%s exists already, the month has been archived before.' % path)
+
+            written = 0
+            with io.open(path, 'w', encoding='utf-8') as output:
+                for line in history.iter_month_lines(month, options['chunk_size']):
+                    output.write(line)
+                    written += 1
+
+            if options['keep']:
+                self.stdout.write('%s: %d events written to %s' % (history.format_month(month), written, path))
+            else:
+                deleted = history.delete_month(month)
+                self.stdout.write('%s: %d events written to %s, %d deleted' % (
+                    history.format_month(month), written, path, deleted))
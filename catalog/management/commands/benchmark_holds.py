@@ -0,0 +1,141 @@
+import datetime
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from django.test.utils import CaptureQueriesContext
+
+from catalog import circulation, copycounts, holds
+from catalog.models import Book, BookInstance, Hold
+from catalog.signals import bulk_changed
+
+USER_PREFIX = 'benchmark-holds-'
+
+
+class Command(BaseCommand):
+    """
+    Measures the throughput of returns of a popular book with a long hold queue:
+    Several threads return copies at the same time, and each returned copy is
+    reserved for the next waiting hold (see catalog/holds.py). The patron then
+    picks it up (so it can be returned again), which is not timed.
+
+    Usage: python3 manage.py benchmark_holds [--threads 4] [--copies 10] [--rounds 50] [--queue 500]
+
+    The queries per return include the updates of derived data (signal handlers),
+    the allocation itself is one SELECT and two UPDATEs.
+    At the end, the command checks that every served hold got exactly one copy.
+
+    NOTE: Unlike the other benchmarks, the threads have their own database connections,
+          so their changes can't be rolled back: The benchmark book, copies, holds and
+          users are deleted afterwards instead.
+    NOTE: SQLite allows one writer at a time. Transactions that fail because the database
+          is locked are repeated, and counted as 'retries'.
+    """
+
+    help = 'Measures concurrent returns of copies that are reserved for the next hold.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4, help='Concurrent threads (default: 4).')
+        parser.add_argument('--copies', type=int, default=10, help='Copies returned by each thread (default: 10).')
+        parser.add_argument('--rounds', type=int, default=50, help='Returns of each copy (default: 50).')
+        parser.add_argument(
+            '--queue', type=int, default=500, help='Holds still waiting after the last return (default: 500).')
+
+    def handle(self, *args, **options):
+        book = Book.objects.create(title='Benchmark book', summary='Benchmark', isbn='0000000000000')
+        try:
+            self.measure(book, options)
+        finally:
+            Hold.objects.filter(book=book).delete()
+            BookInstance.objects.filter(book=book).delete()
+            book.delete()
+            User.objects.filter(username__startswith=USER_PREFIX).delete()
+
+    def measure(self, book, options):
+        threads, copies, rounds = options['threads'], options['copies'], options['rounds']
+        self.retries = 0
+        returns = threads * copies * rounds
+        copy_ids = self.create_loans(book, threads * copies)
+        self.create_holds(book, returns + options['queue'] + 1)
+
+        # Queries of one return (with its allocation).
+        with CaptureQueriesContext(connection) as context:
+            self.retry(circulation.return_copy, copy_ids[0])
+        self.retry(self.pick_up, copy_ids[0])
+
+        seconds = []
+        barrier = threading.Barrier(threads)
+
+        def work(thread_copy_ids):
+            try:
+                barrier.wait()
+                spent = 0.0
+                for round_num in range(rounds):
+                    for copy_id in thread_copy_ids:
+                        start = time.time()
+                        self.retry(circulation.return_copy, copy_id)
+                        spent += time.time() - start
+                        self.retry(self.pick_up, copy_id)
+                seconds.append(spent)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=work, args=(copy_ids[thread_num::threads],))
+                   for thread_num in range(threads)]
+        start = time.time()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.time() - start
+
+        self.stdout.write('%d threads, %d copies, %d holds waiting after the last return' % (
+            threads, len(copy_ids), Hold.objects.filter(book=book, status=Hold.WAITING).count()))
+        self.stdout.write('return+allocate %8.1f returns/sec %8.2f ms/return %6.2f queries/return %6d retries' % (
+            returns / elapsed, 1000.0 * sum(seconds) / returns, len(context), self.retries))
+        self.stdout.write(self.verify(book, returns + 1))
+
+    def retry(self, function, *args):
+        while True:
+            try:
+                return function(*args)
+            except OperationalError:
+                self.retries += 1
+
+    def pick_up(self, copy_id):
+        hold_id = Hold.objects.filter(copy_id=copy_id, status=Hold.READY).values_list('pk', flat=True).get()
+        holds.pick_up(hold_id, datetime.date.today() + datetime.timedelta(weeks=3))
+
+    def create_loans(self, book, number):
+        borrower = User.objects.create_user(USER_PREFIX + 'borrower')
+        due_back = datetime.date.today() + datetime.timedelta(weeks=3)
+        copies = [BookInstance(book=book, imprint='Benchmark', status='o', due_back=due_back, borrower=borrower)
+                  for copy_num in range(number)]
+        BookInstance.objects.bulk_create(copies)
+        copycounts.copies_created(copies)
+        bulk_changed.send(sender=BookInstance, pks=[copy.pk for copy in copies])
+        return [copy.pk for copy in copies]
+
+    def create_holds(self, book, number):
+        """
+        Queues 'number' holds (one per patron) on the book.
+        """
+        User.objects.bulk_create([User(username=USER_PREFIX + str(user_num)) for user_num in range(number)])
+        patrons = User.objects.filter(username__startswith=USER_PREFIX).exclude(username__endswith='borrower')
+        Hold.objects.bulk_create([Hold(book=book, patron=patron) for patron in patrons.order_by('pk')])
+
+    def verify(self, book, served):
+        """
+        Every return served one hold, and no hold (or copy) was served twice.
+        """
+        fulfilled = Hold.objects.filter(book=book, status=Hold.FULFILLED)
+        problems = []
+        if fulfilled.count() != served:
+            problems.append('%d holds served (expected %d)' % (fulfilled.count(), served))
+        if Hold.objects.filter(book=book, status=Hold.READY).exists():
+            problems.append('holds still ready for pickup')
+        if BookInstance.objects.filter(book=book).exclude(status='o').exists():
+            problems.append('copies not on loan')
+        return 'check: ' + ('; '.join(problems) if problems else 'ok (%d holds served once each)' % served)
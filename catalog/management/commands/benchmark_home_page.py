@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
+
+from catalog import benchmark, visits
+
+
+class Command(BaseCommand):
+    """
+    Compares the throughput of the home page with each visit counter mode (see catalog/visits.py).
+
+    Usage: python3 manage.py benchmark_home_page [--requests 1000] [--visitors 50]
+
+    NOTE: The requests are sent in-process (see catalog/benchmark.py) and all their
+          database writes are rolled back, so it can be run against any database.
+    """
+
+    help = 'Measures the home page throughput with each visit counter mode.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000, help='Requests per mode (default: 1000).')
+        parser.add_argument(
+            '--visitors', type=int, default=50,
+            help='Number of simulated visitors, each with their own cookies (default: 50).')
+        parser.add_argument(
+            '--host', default='localhost', help='Host name of the requests (must be in ALLOWED_HOSTS).')
+
+    def handle(self, *args, **options):
+        url = reverse('index')
+
+        for mode in visits.MODES:
+            with override_settings(CATALOG_VISIT_COUNTER=mode), benchmark.rolled_back():
+                clients = benchmark.make_clients(options['visitors'], options['host'])
+                # Warm up: Statistics, first visit (new session) of every visitor.
+                for client in clients:
+                    client.get(url)
+
+                result = benchmark.measure(clients, lambda client: client.get(url), options['requests'])
+            self.stdout.write(benchmark.format_result(mode, result))
@@ -0,0 +1,93 @@
+import datetime
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth.models import Permission, User
+from django.core.management.base import BaseCommand
+from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
+
+from catalog import benchmark
+from catalog.models import Book, BookInstance
+
+PASSWORD = 'benchmark-password'
+# NOTE: Password hashing is deliberately slow (and the same for every session engine),
+#       so the benchmark users get a fast hasher to make the session costs visible.
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+
+class Command(BaseCommand):
+    """
+    Compares the session engines (settings.SESSION_ENGINES) on the pages of logged in users:
+    Logging in, the user's borrowed books (my_borrowed) and all borrowed books (borrowed).
+
+    Usage: python3 manage.py benchmark_sessions [--requests 200] [--users 20] [--engine db --engine cache ...]
+
+    NOTE: The requests are sent in-process (see catalog/benchmark.py) and all their
+          database writes are rolled back, so it can be run against any database.
+          The 'cache' and 'cached_db' engines use the 'sessions' cache as configured,
+          the benchmark logs its users out again to remove their sessions from it.
+    """
+
+    help = 'Measures login, my_borrowed and borrowed with each session engine.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests per page and engine (default: 200).')
+        parser.add_argument('--users', type=int, default=20, help='Number of simulated users (default: 20).')
+        parser.add_argument(
+            '--engine', action='append', dest='engines', choices=list(settings.SESSION_ENGINES),
+            help='Session engine to measure, can be repeated (default: all).')
+        parser.add_argument(
+            '--host', default='localhost', help='Host name of the requests (must be in ALLOWED_HOSTS).')
+
+    def handle(self, *args, **options):
+        for name in options['engines'] or list(settings.SESSION_ENGINES):
+            # The file engine writes to a directory of its own, removed afterwards.
+            file_path = tempfile.mkdtemp(prefix='benchmark_sessions_')
+            try:
+                with override_settings(SESSION_ENGINE=settings.SESSION_ENGINES[name], SESSION_FILE_PATH=file_path,
+                                       PASSWORD_HASHERS=FAST_HASHERS), benchmark.rolled_back():
+                    results = self.run_engine(options)
+            finally:
+                shutil.rmtree(file_path, ignore_errors=True)
+
+            self.stdout.write(name)
+            for page, result in results:
+                self.stdout.write('  ' + benchmark.format_result(page, result))
+
+    def run_engine(self, options):
+        users   = self.create_users(options['users'])
+        clients = benchmark.make_clients(len(users), options['host'])
+        logins  = dict(zip(clients, users))
+
+        def login(client):
+            client.post(reverse('login'), {'username': logins[client].username, 'password': PASSWORD})
+
+        results = [('login', benchmark.measure(clients, login, options['requests']))]
+        for page in ('my_borrowed', 'borrowed'):
+            url = reverse(page)
+            results.append((page, benchmark.measure(clients, lambda client: client.get(url), options['requests'])))
+
+        # Deletes the sessions from the cache, session files etc.
+        for client in clients:
+            client.logout()
+        return results
+
+    def create_users(self, number):
+        """
+        Creates 'number' librarians (who may see all borrowed books) with 2 loans each.
+        """
+        permission = Permission.objects.get(codename='can_mark_returned', content_type__app_label='catalog')
+        book       = Book.objects.create(title='Benchmark book', summary='Benchmark', isbn='0000000000000')
+        due_back   = datetime.date.today() + datetime.timedelta(weeks=3)
+
+        users = []
+        for user_num in range(number):
+            user = User.objects.create_user('benchmark-user-%d' % user_num, password=PASSWORD)
+            user.user_permissions.add(permission)
+            for copy_num in range(2):
+                BookInstance.objects.create(
+                    book=book, imprint='Benchmark', status='o', due_back=due_back, borrower=user)
+            users.append(user)
+        return users
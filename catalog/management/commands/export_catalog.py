@@ -0,0 +1,42 @@
+import io
+
+from django.core.management.base import BaseCommand
+
+from catalog import exporter
+
+
+class Command(BaseCommand):
+    """
+    Writes all books, authors or copies to a CSV or JSON-lines file.
+
+    Usage:
+    python3 manage.py export_catalog book --output books.csv
+    python3 manage.py export_catalog copy --format jsonl > copies.jsonl
+
+    NOTE: Rows are written as they are read (see catalog/exporter.py),
+          so memory use does not depend on the size of the catalog.
+    """
+
+    help = 'Exports books, authors or copies as CSV or JSON lines.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=exporter.KINDS, help='Kind of records to export.')
+        parser.add_argument('--format', choices=exporter.FORMATS, default='csv', help='Output format (default: csv).')
+        parser.add_argument('--output', default='-', help="File to write to (default: '-', standard output).")
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Number of rows read per query (default: 1000).')
+
+    def handle(self, *args, **options):
+        lines = exporter.iter_lines(options['kind'], options['format'], options['chunk_size'])
+
+        if options['output'] == '-':
+            for line in lines:
+                # The lines already end with a line break.
+                self.stdout.write(line, ending='')
+            return
+
+        # newline='' as required by the csv module.
+        with io.open(options['output'], 'w', encoding='utf-8', newline='') as output:
+            for line in lines:
+                output.write(line)
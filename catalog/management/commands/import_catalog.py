@@ -0,0 +1,91 @@
+import io
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.importer import FORMATS, KINDS, CatalogImporter, CatalogImportError, Checkpoint, read_records
+
+
+class Command(BaseCommand):
+    """
+    Streams catalog records from a CSV or JSON-lines file into the database.
+
+    Usage:
+    python3 manage.py import_catalog book books.csv
+    python3 manage.py import_catalog copy copies.jsonl --batch-size 5000 --checkpoint copies.checkpoint
+    python3 manage.py import_catalog author authors.csv --dry-run
+
+    See catalog/importer.py for the fields of each kind of record.
+    NOTE: Import genres, languages and authors before the books that reference them
+          (or let the book import create them by name), and books before their copies.
+    NOTE: A malformed record stops the import (its batch is rolled back). Books with an
+          existing ISBN and copies with an existing id are skipped, so a batch imported again
+          after a crash (committed, but not yet in the checkpoint) is not duplicated, except
+          for books without an ISBN.
+    """
+
+    help = 'Imports genres, languages, authors, books or copies from a CSV or JSON-lines file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=KINDS, help='Kind of the records in the file.')
+        parser.add_argument('path', help="File to import ('-' for standard input).")
+        parser.add_argument(
+            '--format', choices=FORMATS,
+            help='Format of the file (default: from the file extension, .csv or .jsonl).')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of records written per INSERT/transaction (default: 1000).')
+        parser.add_argument(
+            '--checkpoint',
+            help='File recording the progress. If it exists, the import resumes after the last committed batch.')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Parse and resolve the records without writing anything, and report the throughput.')
+
+    def handle(self, *args, **options):
+        path   = options['path']
+        format = options['format'] or self.guess_format(path)
+
+        skip, on_batch = 0, None
+        if options['checkpoint'] and not options['dry_run']:
+            source     = path if path == '-' else os.path.abspath(path)
+            checkpoint = Checkpoint(options['checkpoint'], source, options['kind'])
+            skip       = checkpoint.load()
+            on_batch   = checkpoint.save
+            if skip:
+                self.stdout.write('Resuming after %d records.' % skip)
+
+        importer = CatalogImporter(options['kind'], options['batch_size'], options['dry_run'])
+
+        if path == '-':
+            stream = sys.stdin
+        else:
+            # newline='' as required by the csv module.
+            stream = io.open(path, encoding='utf-8', newline='')
+
+        try:
+            result = importer.run(read_records(stream, format), skip=skip, on_batch=on_batch)
+        except CatalogImportError as error:
+            raise CommandError(str(error))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        rate = result.records / result.seconds if result.seconds else float(result.records)
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                'Dry run: Parsed %d %s records in %.2f seconds (%.0f rows/sec), %d would be skipped.' % (
+                    result.records, options['kind'], result.seconds, rate, result.skipped)))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                'Imported %d %s records in %.2f seconds (%.0f rows/sec): %d rows created, %d skipped.' % (
+                    result.records, options['kind'], result.seconds, rate, result.created, result.skipped)))
+
+    def guess_format(self, path):
+        extension = os.path.splitext(path)[1].lower()
+        if extension == '.csv':
+            return 'csv'
+        if extension in ('.jsonl', '.json', '.ndjson'):
+            return 'jsonl'
+        raise CommandError('Cannot guess the format of %s, use --format.' % path)
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog import history
+
+
+class Command(BaseCommand):
+    """
+    Deletes the loan history of old months (without archiving it, see archive_loan_events).
+
+    Usage: python3 manage.py prune_loan_events --before 2026-01
+
+    NOTE: Each month is deleted with one DELETE on the index (month, id),
+          so the rest of the table is not read.
+    """
+
+    help = 'Deletes the loan history of the months before a given month.'
+
+    def add_arguments(self, parser):
+        # NOTE: Checked in handle(), call_command() does not support required options (Django 1.11).
+        parser.add_argument('--before', help='First month to keep, as YYYY-MM (required).')
+
+    def handle(self, *args, **options):
+        try:
+            before = history.parse_month(options['before'] or '')
+        except ValueError:
+            raise CommandError('--before must be a month (YYYY-MM), not %r.' % options['before'])
+
+        for month in history.iter_months_before(before):
+            self.stdout.write('%s: %d events deleted' % (history.format_month(month), history.delete_month(month)))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from catalog import stats
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the home page statistics (see catalog/stats.py) from scratch.
+
+    Usage: python3 manage.py rebuild_catalog_stats
+    NOTE: Run this after changing the catalog with bulk operations that bypass
+          the model signals (e.g. raw SQL or QuerySet.update()).
+    """
+
+    help = 'Recomputes the precomputed record counts shown on the home page.'
+
+    def handle(self, *args, **options):
+        statistics = stats.rebuild_statistics()
+
+        self.stdout.write(self.style.SUCCESS(
+            'Rebuilt catalog statistics: %d books, %d copies (%d available), '
+            '%d authors, %d genres.' % (
+                statistics.num_books,
+                statistics.num_instances,
+                statistics.num_instances_available,
+                statistics.num_authors,
+                statistics.num_genres,
+            )))
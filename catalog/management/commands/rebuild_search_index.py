@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog import search
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the full-text search table (see catalog/search.py) from scratch.
+
+    Usage: python3 manage.py rebuild_search_index [--batch-size 1000]
+    """
+
+    help = 'Rebuilds the full-text search index of books and authors.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of rows loaded and indexed at a time (default: 1000).')
+
+    def handle(self, *args, **options):
+        if search.get_backend() is None:
+            self.stdout.write(self.style.WARNING(
+                'This database has no search table, search falls back to icontains lookups.'))
+            return
+
+        start = time.time()
+        num_books, num_authors = search.rebuild_index(batch_size=options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(
+            'Indexed %d books and %d authors in %.1f seconds.' % (num_books, num_authors, time.time() - start)))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from catalog import copycounts
+from catalog.signals import copies_changed
+
+
+class Command(BaseCommand):
+    """
+    Counts the copies of every book again and repairs the copy counters stored on
+    the books that have drifted (see catalog/copycounts.py).
+
+    Usage: python3 manage.py reconcile_copy_counts [--batch-size 500] [--dry-run]
+
+    NOTE: Run this after changing copies with raw SQL, or e.g. every night by cron
+          (exit status 0 either way; each drift is reported).
+    """
+
+    help = 'Detects and repairs drifted copy counters on the books.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=copycounts.BATCH_SIZE,
+            help='Books checked per transaction (default: %d).' % copycounts.BATCH_SIZE)
+        parser.add_argument(
+            '--dry-run', action='store_true', help='Only report the drifted counters, without repairing them.')
+
+    def handle(self, *args, **options):
+        drifted = []
+        for drift in copycounts.reconcile(options['batch_size'], options['dry_run']):
+            drifted.append(drift.book_id)
+            changes = ', '.join('%s %d (counted %d)' % (field, drift.stored[field], drift.counted[field])
+                                for field in copycounts.FIELDS if drift.stored[field] != drift.counted[field])
+            self.stdout.write('Book %d: %s' % (drift.book_id, changes))
+
+        if options['dry_run']:
+            self.stdout.write('%d books with drifted counters.' % len(drifted))
+        else:
+            # The pages show the counters.
+            copies_changed(drifted)
+            self.stdout.write('%d books with drifted counters repaired.' % len(drifted))
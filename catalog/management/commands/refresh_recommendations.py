@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog import recommendations
+
+
+class Command(BaseCommand):
+    """
+    Recomputes the "Patrons who borrowed this also borrowed" recommendations of the books
+    affected by the new checkouts (see catalog/recommendations.py). Meant to be run
+    regularly, e.g. every hour by cron:
+
+    0 * * * * python3 manage.py refresh_recommendations
+
+    Usage: python3 manage.py refresh_recommendations [--full] [--size 5] [--lag 300]
+
+    NOTE: numpy and scipy (requirements.txt) are needed for large loan histories. Without them,
+          the command warns and computes in pure Python, which is much slower.
+    """
+
+    help = 'Recomputes the "also borrowed" recommendations of the books with new checkouts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true', help='Recompute the recommendations of all books.')
+        parser.add_argument(
+            '--size', type=int, default=None,
+            help='Recommendations per book (default: settings.CATALOG_RECOMMENDATIONS_SIZE).')
+        parser.add_argument(
+            '--lag', type=int, default=None,
+            help='Only include events older than this many seconds (default: settings.CATALOG_ROLLUP_LAG).')
+
+    def handle(self, *args, **options):
+        if recommendations.sparse is None:
+            self.stderr.write(self.style.WARNING(
+                'NumPy and SciPy are not installed, the recommendations are computed in pure Python (slow).'))
+        try:
+            computed, changed = recommendations.refresh(options['full'], options['size'], options['lag'])
+        except recommendations.ConcurrentRefresh as error:
+            raise CommandError('%s Try again.' % error)
+        self.stdout.write('Recommendations of %d books computed, %d changed.' % (computed, changed))
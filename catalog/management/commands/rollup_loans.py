@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog import rollups
+
+
+class Command(BaseCommand):
+    """
+    Folds the new loan history events into the daily rollups of the circulation report
+    (see catalog/rollups.py). Meant to be run regularly, e.g. every 5 minutes by cron:
+
+    */5 * * * * python3 manage.py rollup_loans
+
+    Usage: python3 manage.py rollup_loans [--chunk-size 1000] [--lag 300] [--rebuild]
+
+    NOTE: Only the events since the last run are read, so a run takes as long as the
+          number of new events, not the size of the history.
+    """
+
+    help = 'Folds new loan history events into the daily circulation rollups.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000, help='Events folded per transaction (default: 1000).')
+        parser.add_argument(
+            '--lag', type=int, default=None,
+            help='Only fold events older than this many seconds (default: settings.CATALOG_ROLLUP_LAG).')
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Delete the rollups first and fold the whole (remaining) history again.')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            rollups.reset()
+        try:
+            folded = rollups.fold(options['chunk_size'], options['lag'])
+        except rollups.ConcurrentFold as error:
+            raise CommandError('%s Try again.' % error)
+        self.stdout.write('%d events folded into the daily rollups.' % folded)
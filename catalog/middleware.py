@@ -0,0 +1,90 @@
+"""
+Middleware of the catalog app.
+"""
+from django.conf import settings
+from django.utils.cache import get_conditional_response
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from . import pagecache
+
+# Cookie telling that the session (cookie) of a request belongs to an anonymous visitor.
+ANONYMOUS_COOKIE = 'catalog_anonymous'
+
+
+def anonymous_marker(session_key):
+    return salted_hmac('catalog.middleware.anonymous', session_key).hexdigest()
+
+
+class AnonymousPageCacheMiddleware(object):
+    """
+    Serves GET requests of anonymous visitors from the page cache (see catalog/pagecache.py),
+    and stores the pages rendered for them.
+
+    NOTE: Put it BEFORE SessionMiddleware and AuthenticationMiddleware, so a cached page is
+          served without loading the session or the user.
+
+    Whether a visitor is anonymous has to be decided without loading the session:
+    -- Requests without a session cookie are anonymous.
+    -- Visitors WITH a session (e.g. from the visit counter on the home page) are anonymous if they
+       also send the ANONYMOUS_COOKIE, which is a signature of their session key. The middleware sets
+       it on the pages rendered for anonymous visitors. Logging in changes the session key,
+       so the cookie no longer matches.
+
+    Pages are only stored if they set no cookies and don't contain a CSRF token
+    (both would be specific to one visitor).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timeout = None
+        if request.method == 'GET' and self.is_anonymous(request):
+            timeout = pagecache.get_timeout(request.path_info)
+
+        if timeout is not None:
+            response = pagecache.get_page(request)
+            if response is not None:
+                response['X-Page-Cache'] = 'hit'
+                # The client may already have the page.
+                return get_conditional_response(request, etag=response.get('ETag'), response=response)
+
+        response = self.get_response(request)
+
+        user = getattr(request, 'user', None)
+        if user is None or user.is_authenticated:
+            return response
+
+        if timeout is not None and self.can_store(request, response):
+            pagecache.store_page(request, response, timeout)
+        self.mark_anonymous(request, response)
+        return response
+
+    def is_anonymous(self, request):
+        session_key = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+        if not session_key:
+            return True
+        marker = request.COOKIES.get(ANONYMOUS_COOKIE)
+        return bool(marker) and constant_time_compare(marker, anonymous_marker(session_key))
+
+    def can_store(self, request, response):
+        return (response.status_code == 200 and not response.streaming and not response.cookies
+                and not request.META.get('CSRF_COOKIE_USED')
+                and 'private' not in response.get('Cache-Control', ''))
+
+    def mark_anonymous(self, request, response):
+        """
+        Sets ANONYMOUS_COOKIE for the (new or existing) session of an anonymous visitor.
+        """
+        session_key = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+        if settings.SESSION_COOKIE_NAME in response.cookies:
+            session_key = response.cookies[settings.SESSION_COOKIE_NAME].value
+        if not session_key:
+            return
+
+        marker = anonymous_marker(session_key)
+        if request.COOKIES.get(ANONYMOUS_COOKIE) != marker:
+            response.set_cookie(
+                ANONYMOUS_COOKIE, marker,
+                max_age=settings.SESSION_COOKIE_AGE, httponly=True,
+                secure=settings.SESSION_COOKIE_SECURE or None)
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 02:31
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0005_auto_20170425_1559'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogStatistics',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('num_books', models.PositiveIntegerField(default=0)),
+                ('num_instances', models.PositiveIntegerField(default=0)),
+                ('num_instances_available', models.PositiveIntegerField(default=0)),
+                ('num_authors', models.PositiveIntegerField(default=0)),
+                ('num_genres', models.PositiveIntegerField(default=0)),
+                ('num_python_books', models.PositiveIntegerField(default=0)),
+                ('generation', models.PositiveIntegerField(default=0)),
+                ('built_generation', models.PositiveIntegerField(default=0)),
+                ('computed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name_plural': 'catalog statistics',
+            },
+        ),
+    ]
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.utils import OperationalError
+
+# Full-text search table (see catalog/search.py).
+# NOTE: The SQL is copied here (instead of imported), so this migration
+#       does not change when catalog/search.py does.
+CREATE_SQL = {
+    'sqlite': [
+        'CREATE VIRTUAL TABLE catalog_search USING fts5(kind UNINDEXED, object_id UNINDEXED, title, body)',
+    ],
+    'postgresql': [
+        'CREATE TABLE catalog_search ('
+        ' kind varchar(10) NOT NULL,'
+        ' object_id integer NOT NULL,'
+        ' title text NOT NULL,'
+        ' body text NOT NULL,'
+        ' document tsvector NOT NULL,'
+        ' PRIMARY KEY (kind, object_id))',
+        'CREATE INDEX catalog_search_document ON catalog_search USING GIN (document)',
+    ],
+}
+
+
+def create_search_table(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    try:
+        for sql in CREATE_SQL.get(vendor, []):
+            schema_editor.execute(sql)
+    except OperationalError:
+        # SQLite compiled without FTS5: catalog.search falls back to icontains lookups.
+        if vendor != 'sqlite':
+            raise
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor in CREATE_SQL:
+        schema_editor.execute('DROP TABLE IF EXISTS catalog_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0008_auto_20261018_1034'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
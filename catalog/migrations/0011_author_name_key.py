@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 02:58
+from __future__ import unicode_literals
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+
+# NOTE: Copied from catalog.models.make_name_key() (instead of imported), so this migration
+#       keeps working if the model code changes.
+def make_name_key(*names):
+    text = unicodedata.normalize('NFKD', ' '.join(names))
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(re.findall(r'\w+', text.casefold(), re.UNICODE))
+
+
+def set_name_keys(apps, schema_editor):
+    Author = apps.get_model('catalog', 'Author')
+    last_pk = 0
+    while True:
+        # In primary key order, 1000 authors at a time.
+        batch = list(Author.objects.filter(pk__gt=last_pk).order_by('pk')
+                     .values_list('pk', 'last_name', 'first_name')[:1000])
+        if not batch:
+            break
+        for pk, last_name, first_name in batch:
+            Author.objects.filter(pk=pk).update(name_key=make_name_key(last_name, first_name)[:255])
+        last_pk = batch[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0010_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='name_key',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(set_name_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 03:18
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0013_hold'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoanEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('month', models.PositiveIntegerField()),
+                ('occurred_at', models.DateTimeField()),
+                ('kind', models.CharField(choices=[('checkout', 'Checked out'), ('renew', 'Renewed'), ('return', 'Returned'), ('reserve', 'Reserved for a hold'), ('release', 'Reservation released')], max_length=8)),
+                ('copy_id', models.UUIDField()),
+                ('book_id', models.IntegerField(blank=True, null=True)),
+                ('borrower_id', models.IntegerField(blank=True, null=True)),
+                ('due_back', models.DateField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='loanevent',
+            index=models.Index(fields=['month', 'id'], name='catalog_loa_month_79c5f9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loanevent',
+            index=models.Index(fields=['occurred_at'], name='catalog_loa_occurre_53b9cb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loanevent',
+            index=models.Index(fields=['copy_id', 'occurred_at'], name='catalog_loa_copy_id_c4b400_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loanevent',
+            index=models.Index(fields=['borrower_id', 'occurred_at'], name='catalog_loa_borrowe_c2daaa_idx'),
+        ),
+    ]
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 03:22
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0014_loanevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookDailyLoans',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('checkouts', models.PositiveIntegerField(default=0)),
+                ('renewals', models.PositiveIntegerField(default=0)),
+                ('reservations', models.PositiveIntegerField(default=0)),
+                ('book_id', models.IntegerField()),
+            ],
+            options={
+                'verbose_name_plural': 'book daily loans',
+            },
+        ),
+        migrations.CreateModel(
+            name='GenreDailyLoans',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('checkouts', models.PositiveIntegerField(default=0)),
+                ('renewals', models.PositiveIntegerField(default=0)),
+                ('reservations', models.PositiveIntegerField(default=0)),
+                ('genre_id', models.IntegerField()),
+            ],
+            options={
+                'verbose_name_plural': 'genre daily loans',
+            },
+        ),
+        migrations.CreateModel(
+            name='LanguageDailyLoans',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('checkouts', models.PositiveIntegerField(default=0)),
+                ('renewals', models.PositiveIntegerField(default=0)),
+                ('reservations', models.PositiveIntegerField(default=0)),
+                ('language_id', models.IntegerField()),
+            ],
+            options={
+                'verbose_name_plural': 'language daily loans',
+            },
+        ),
+        migrations.CreateModel(
+            name='LoanRollupState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_event_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='languagedailyloans',
+            index=models.Index(fields=['language_id', 'day'], name='catalog_lan_languag_4b19ae_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='languagedailyloans',
+            unique_together=set([('day', 'language_id')]),
+        ),
+        migrations.AddIndex(
+            model_name='genredailyloans',
+            index=models.Index(fields=['genre_id', 'day'], name='catalog_gen_genre_i_360e73_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='genredailyloans',
+            unique_together=set([('day', 'genre_id')]),
+        ),
+        migrations.AddIndex(
+            model_name='bookdailyloans',
+            index=models.Index(fields=['book_id', 'day'], name='catalog_boo_book_id_f1afa7_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='bookdailyloans',
+            unique_together=set([('day', 'book_id')]),
+        ),
+    ]
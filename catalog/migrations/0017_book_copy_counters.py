@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 03:31
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+# NOTE: Copied from catalog.copycounts (instead of imported), so this migration
+#       keeps working if the model code changes.
+COUNTERS = {
+    'a': 'copies_available',
+    'o': 'copies_on_loan',
+    'r': 'copies_reserved',
+    'd': 'copies_in_maintenance',
+}
+
+
+def count_copies(apps, schema_editor):
+    BookInstance = apps.get_model('catalog', 'BookInstance')
+    Book         = apps.get_model('catalog', 'Book')
+
+    counters = {}
+    rows = (BookInstance.objects.filter(book__isnull=False).order_by()
+            .values_list('book_id', 'status').annotate(number=Count('pk')))
+    for book_id, status, number in rows:
+        values = counters.setdefault(book_id, {'copies_total': 0})
+        values['copies_total'] += number
+        if status in COUNTERS:
+            values[COUNTERS[status]] = values.get(COUNTERS[status], 0) + number
+    for book_id, values in counters.items():
+        Book.objects.filter(pk=book_id).update(**values)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0016_recommendations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='copies_available',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='copies_in_maintenance',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='copies_on_loan',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='copies_reserved',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='copies_total',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_copies, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 04:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+BATCH_SIZE = 500
+
+
+def store_pairs(apps, schema_editor):
+    """
+    Stores the pairs of the checkouts the recommendations were computed from (up to the
+    watermark); the next refresh adds those of the later events.
+    """
+    LoanEvent           = apps.get_model('catalog', 'LoanEvent')
+    BorrowedPair        = apps.get_model('catalog', 'BorrowedPair')
+    RecommendationState = apps.get_model('catalog', 'RecommendationState')
+
+    state = RecommendationState.objects.filter(pk=1).first()
+    if state is None:
+        return
+    pairs = (LoanEvent.objects.filter(kind='checkout', pk__lte=state.last_event_id, borrower_id__isnull=False,
+                                      book_id__isnull=False)
+             .order_by().values_list('borrower_id', 'book_id').distinct())
+    batch = []
+    for borrower_id, book_id in pairs.iterator():
+        batch.append(BorrowedPair(borrower_id=borrower_id, book_id=book_id))
+        if len(batch) == BATCH_SIZE:
+            BorrowedPair.objects.bulk_create(batch)
+            batch = []
+    BorrowedPair.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0017_book_copy_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BorrowedPair',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('borrower_id', models.IntegerField()),
+                ('book_id', models.IntegerField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='borrowedpair',
+            index=models.Index(fields=['book_id', 'borrower_id'], name='catalog_bor_book_id_34405b_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='borrowedpair',
+            unique_together=set([('borrower_id', 'book_id')]),
+        ),
+        migrations.RunPython(store_pairs, migrations.RunPython.noop),
+    ]
@@ -4,7 +4,9 @@ from django.contrib.auth.models import User
 
 # http://stackoverflow.com/questions/30471812/global-name-reverse-is-not-defined
 from django.core.urlresolvers import reverse
-from datetime import date # Used in 'is_overdue' function
+from datetime import date, timedelta # Used in 'is_overdue' function and BookInstanceQuerySet
+import re
+import unicodedata
 
 # Create your models here.
 class Genre(models.Model):
@@ -44,7 +46,82 @@ class Language(models.Model):
 
 # =============================================================================
 
-class Book(models.Model):
+class TrackedFieldsMixin(object):
+    """
+    Remembers the values of the model's TRACKED_FIELDS as loaded from (or last saved to)
+    the database, so signal handlers can tell what a save() changed (see has_changed()).
+    """
+    TRACKED_FIELDS = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(TrackedFieldsMixin, cls).from_db(db, field_names, values)
+        instance._remember_loaded_values()
+        return instance
+
+    def _remember_loaded_values(self):
+        self._loaded_values = dict((name, self.__dict__.get(name)) for name in self.TRACKED_FIELDS)
+
+    def save(self, *args, **kwargs):
+        super(TrackedFieldsMixin, self).save(*args, **kwargs)
+        # NOTE: post_save handlers run inside super().save(), so they still see the old values.
+        self._remember_loaded_values()
+
+    def get_loaded_value(self, name):
+        """
+        Returns the value of a tracked field as it was loaded from (or last saved to) the database,
+        or None for a new object.
+        """
+        return getattr(self, '_loaded_values', {}).get(name)
+
+    def has_changed(self, name):
+        """
+        Returns True if a tracked field differs from the database (always True for new objects).
+        """
+        if not hasattr(self, '_loaded_values'):
+            return True
+        return self._loaded_values[name] != getattr(self, name)
+
+
+# =============================================================================
+
+class BookQuerySet(models.QuerySet):
+    """
+    Custom QuerySet (and, via as_manager(), manager) for Book.
+
+    Each method loads the related objects a page needs up front
+    (a fixed number of queries), instead of one query per row in the template.
+    """
+
+    def for_listing(self):
+        """
+        Books for list pages: Joins the author (shown next to each title).
+        """
+        return self.select_related('author')
+
+    def with_genres(self):
+        """
+        Prefetches the genres (one extra query for all books), e.g. for display_genre().
+        """
+        return self.prefetch_related('genre')
+
+    def for_detail(self):
+        """
+        Book for the detail page: Joins author and language.
+        NOTE: Genres and copies are NOT prefetched: The page caches them in template fragments
+              (see catalog/fragments.py), which load them (one query each) only when rendered.
+        """
+        return self.select_related('author', 'language')
+
+    def for_bibliography(self):
+        """
+        Books as listed on the author detail page: With genres.
+        NOTE: The number of copies is the counter Book.copies_total (no join with the copies).
+        """
+        return self.with_genres()
+
+
+class Book(TrackedFieldsMixin, models.Model):
     """
     Model representing a book (but not a specific copy of a book).
     """
@@ -64,6 +141,35 @@ class Book(models.Model):
     # A book is associated with ONE and only ONE langage => ForeignKey
     language = models.ForeignKey('Language', on_delete=models.SET_NULL, null=True)
 
+    # Last change of the book or of anything shown on its page (see catalog/conditional.py).
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # Numbers of the book's copies, in total and per status, maintained by catalog/copycounts.py,
+    # so availability is shown and filtered without reading the copies.
+    # NOTE: Plain IntegerFields: A counter that has drifted (see the reconcile_copy_counts command)
+    #       must not make the next checkout fail on a CHECK (>= 0) constraint.
+    copies_total          = models.IntegerField(default=0, editable=False)
+    copies_available      = models.IntegerField(default=0, editable=False)
+    copies_on_loan        = models.IntegerField(default=0, editable=False)
+    copies_reserved       = models.IntegerField(default=0, editable=False)
+    copies_in_maintenance = models.IntegerField(default=0, editable=False)
+
+    COPY_COUNTERS = ('copies_total', 'copies_available', 'copies_on_loan', 'copies_reserved', 'copies_in_maintenance')
+
+    objects = BookQuerySet.as_manager()
+
+    # Fields whose value as loaded from the database is remembered (see TrackedFieldsMixin).
+    # NOTE: The author's page lists the book, so a change of author has to update both pages.
+    TRACKED_FIELDS = ('author_id', 'title')
+
+    class Meta:
+        indexes = [
+            # Sort key of the keyset pagination in BookListView.
+            # NOTE: Also serves lookups by (a prefix of) the title.
+            models.Index(fields=['title', 'id']),
+            models.Index(fields=['isbn']),
+        ]
+
     def __str__(self):
         """
         String for representing the Model object. 
@@ -84,12 +190,21 @@ class Book(models.Model):
         # -- Define an associated template.
 
 
+    def save(self, *args, **kwargs):
+        # The copy counters are only changed by relative UPDATEs (see catalog/copycounts.py),
+        # so saving a loaded book must not write back the (possibly outdated) counts it was loaded with.
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.COPY_COUNTERS]
+        super(Book, self).save(*args, **kwargs)
+
     def display_genre(self):
         """
         Creates a string for the Genre. This is required to display genre in Admin.
         """
          
         # Get first 3 genres and join to a string.
+        # NOTE: Uses the prefetched genres if the book was loaded with Book.objects.with_genres().
         return ', '.join([ genre.name for genre in self.genre.all()[:3] ])
 
     display_genre.short_description = 'Genre'
@@ -100,7 +215,43 @@ class Book(models.Model):
 
 import uuid # Required for unique book instances.
 
-class BookInstance(models.Model):
+class BookInstanceQuerySet(models.QuerySet):
+    """
+    Custom QuerySet (and, via as_manager(), manager) for BookInstance.
+    """
+
+    def on_loan(self):
+        return self.filter(status__exact='o')
+
+    def for_circulation(self):
+        """
+        Joins the book and the borrower shown in the loan lists.
+        """
+        return self.select_related('book', 'borrower')
+
+    def with_overdue(self, today=None):
+        """
+        Annotates each copy with 'overdue' (due_back in the past), computed by the database.
+        """
+        today = today or date.today()
+        return self.annotate(overdue=models.Case(
+            models.When(due_back__lt=today, then=models.Value(True)),
+            default=models.Value(False),
+            output_field=models.BooleanField(),
+        ))
+
+    def overdue(self, today=None):
+        return self.filter(due_back__lt=today or date.today())
+
+    def due_within(self, days, today=None):
+        """
+        Copies due back between today and 'days' days from today.
+        """
+        today = today or date.today()
+        return self.filter(due_back__range=(today, today + timedelta(days=days)))
+
+
+class BookInstance(TrackedFieldsMixin, models.Model):
     """
     Model representing a specific copy of a book (i.e. that can be borrowed from the library). 
     """
@@ -145,8 +296,33 @@ class BookInstance(models.Model):
         blank=True,
     )
 
+    # Last change of the copy.
+    # NOTE: Set by save() (auto_now); QuerySet.update() has to set it explicitly.
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # Incremented by every change, for optimistic locking (see catalog/circulation.py):
+    # A client sends the version it has seen, and the change only applies if it is still current.
+    # NOTE: Incremented by save(); QuerySet.update() has to increment it explicitly (F('version') + 1).
+    version = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = BookInstanceQuerySet.as_manager()
+
+    # Fields whose value as loaded from the database is remembered (see TrackedFieldsMixin).
+    # NOTE: Used by signal handlers that only need to act if e.g. the status has changed.
+    TRACKED_FIELDS = ('status', 'book_id', 'borrower_id', 'due_back')
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            self.version += 1
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'version'}
+        super(BookInstance, self).save(*args, **kwargs)
+
     # Add a property that we can call from our templates
     # from datetime import date # Called at the top of the file
+    # NOTE: For lists, use BookInstance.objects.with_overdue() instead,
+    #       which lets the database compute the flag.
     @property
     def is_overdue(self):
         if date.today() > self.due_back:
@@ -157,6 +333,18 @@ class BookInstance(models.Model):
     class Meta:
         ordering = ["due_back"]
 
+        # Indexes for the circulation queries (see catalog/tests/test_query_plans.py):
+        indexes = [
+            # Books on loan, by due date (LoanedBooksListView).
+            models.Index(fields=['status', 'due_back']),
+            # Books on loan to a user, by due date (LoanedBooksByUserListView).
+            models.Index(fields=['borrower', 'status', 'due_back']),
+            # Default ordering.
+            models.Index(fields=['due_back']),
+            # A book's copies in a status, e.g. its available copies for the hold queue (catalog/holds.py).
+            models.Index(fields=['book', 'status']),
+        ]
+
         # Assign permission to "Librarian" group in the Admin site.
         permissions = (
             ("can_mark_returned", "Set book as returned"),
@@ -192,6 +380,324 @@ class BookInstance(models.Model):
 
 # =============================================================================
 
+class Hold(models.Model):
+    """
+    Model representing a patron's request for a book (any copy of it).
+
+    The holds of a book form a queue: The next copy that is returned or becomes available
+    is reserved (BookInstance status 'r') for the oldest waiting hold (see catalog/holds.py).
+    """
+
+    WAITING   = 'w'
+    READY     = 'r'
+    FULFILLED = 'f'
+    CANCELLED = 'c'
+    HOLD_STATUS = (
+        (WAITING,   'Waiting'),
+        (READY,     'Ready for pickup'),
+        (FULFILLED, 'Picked up'),
+        (CANCELLED, 'Cancelled'),
+    )
+    # Holds that are still in the queue or waiting to be picked up.
+    ACTIVE = (WAITING, READY)
+
+    book       = models.ForeignKey('Book', on_delete=models.CASCADE)
+    patron     = models.ForeignKey(User, on_delete=models.CASCADE)
+    status     = models.CharField(max_length=1, choices=HOLD_STATUS, default=WAITING)
+    # Position in the queue (ties are broken by id).
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    # The copy reserved for the patron (set when the hold becomes READY).
+    copy       = models.ForeignKey(BookInstance, on_delete=models.SET_NULL, null=True, blank=True)
+    ready_at   = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at', 'id']
+
+        indexes = [
+            # The oldest waiting hold of a book: One index lookup, no sort (see catalog/tests/test_query_plans.py).
+            models.Index(fields=['book', 'status', 'created_at', 'id']),
+            # A patron's active holds ("My Borrowed").
+            models.Index(fields=['patron', 'status']),
+        ]
+
+    def __str__(self):
+        """
+        String for representing the Model object.
+        """
+
+        return '%s: %s (%s)' % (self.patron, self.book, self.get_status_display())
+
+
+# =============================================================================
+
+class LoanEventQuerySet(models.QuerySet):
+    """
+    Custom QuerySet (and, via as_manager(), manager) for LoanEvent.
+    NOTE: Each of these filters is served by one of the indexes in LoanEvent.Meta.
+    """
+
+    def between(self, start, end):
+        """
+        Events from start (inclusive) to end (exclusive).
+        """
+        return self.filter(occurred_at__gte=start, occurred_at__lt=end)
+
+    def of_copy(self, copy_id):
+        return self.filter(copy_id=copy_id)
+
+    def of_borrower(self, borrower_id):
+        return self.filter(borrower_id=borrower_id)
+
+    def before_month(self, month):
+        """
+        Events of the months before 'month' (a month key, see catalog/history.py).
+        """
+        return self.filter(month__lt=month)
+
+
+class LoanEvent(models.Model):
+    """
+    Model representing one entry of the append-only loan history (see catalog/history.py):
+    A copy was checked out, renewed, returned, reserved for a hold or released.
+
+    NOTE: Rows are only inserted, never updated (whole months are deleted when archived).
+          There are no foreign keys: Writing an event does not check or lock any
+          BookInstance or User row, and the history outlives deleted copies and users.
+    """
+
+    CHECKOUT = 'checkout'
+    RENEW    = 'renew'
+    RETURN   = 'return'
+    RESERVE  = 'reserve'
+    RELEASE  = 'release'
+    EVENT_KINDS = (
+        (CHECKOUT, 'Checked out'),
+        (RENEW,    'Renewed'),
+        (RETURN,   'Returned'),
+        (RESERVE,  'Reserved for a hold'),
+        (RELEASE,  'Reservation released'),
+    )
+
+    id          = models.BigAutoField(primary_key=True)
+    # Year and month of occurred_at (UTC), e.g. 202610: Old months are archived and deleted by this key.
+    month       = models.PositiveIntegerField()
+    occurred_at = models.DateTimeField()
+    kind        = models.CharField(max_length=8, choices=EVENT_KINDS)
+
+    copy_id     = models.UUIDField()
+    book_id     = models.IntegerField(null=True, blank=True)
+    # The patron the copy was lent to, returned by or reserved for.
+    borrower_id = models.IntegerField(null=True, blank=True)
+    # Due date after the event (checkouts and renewals).
+    due_back    = models.DateField(null=True, blank=True)
+
+    objects = LoanEventQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Archiving and deleting a month, in primary key order (see catalog/history.py).
+            models.Index(fields=['month', 'id']),
+            # Time ranges.
+            models.Index(fields=['occurred_at']),
+            # History of a copy, or of a borrower.
+            models.Index(fields=['copy_id', 'occurred_at']),
+            models.Index(fields=['borrower_id', 'occurred_at']),
+        ]
+
+    def __str__(self):
+        """
+        String for representing the Model object.
+        """
+
+        return '%s %s: %s' % (self.occurred_at, self.copy_id, self.get_kind_display())
+
+
+# =============================================================================
+
+class DailyLoans(models.Model):
+    """
+    Abstract model for the daily circulation rollups (see catalog/rollups.py):
+    Numbers of loan history events (LoanEvent) per day and book, genre or language.
+
+    NOTE: Like LoanEvent, the rollups hold plain ids instead of foreign keys.
+    """
+
+    # Local date (settings.TIME_ZONE) of the events.
+    day          = models.DateField()
+    checkouts    = models.PositiveIntegerField(default=0)
+    renewals     = models.PositiveIntegerField(default=0)
+    reservations = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class BookDailyLoans(DailyLoans):
+    book_id = models.IntegerField()
+
+    class Meta:
+        # The index of the unique constraint (day first) serves the top-N queries over a range of days.
+        unique_together = ('day', 'book_id')
+        # Time series of one book.
+        indexes = [models.Index(fields=['book_id', 'day'])]
+        verbose_name_plural = 'book daily loans'
+
+
+class GenreDailyLoans(DailyLoans):
+    genre_id = models.IntegerField()
+
+    class Meta:
+        unique_together = ('day', 'genre_id')
+        indexes = [models.Index(fields=['genre_id', 'day'])]
+        verbose_name_plural = 'genre daily loans'
+
+
+class LanguageDailyLoans(DailyLoans):
+    language_id = models.IntegerField()
+
+    class Meta:
+        unique_together = ('day', 'language_id')
+        indexes = [models.Index(fields=['language_id', 'day'])]
+        verbose_name_plural = 'language daily loans'
+
+
+class LoanRollupState(models.Model):
+    """
+    Model holding how far the loan history has been folded into the daily rollups.
+
+    There is only ever ONE row (pk=1), maintained by catalog/rollups.py.
+    """
+
+    # Id of the last LoanEvent counted in the rollups (the "watermark").
+    last_event_id = models.BigIntegerField(default=0)
+    updated_at    = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        """
+        String for representing the Model object.
+        """
+
+        return 'Loan rollups up to event %d (%s)' % (self.last_event_id, self.updated_at)
+
+
+# =============================================================================
+
+class BookRecommendation(models.Model):
+    """
+    Model representing one "Patrons who borrowed this also borrowed" recommendation:
+    The book at position 'rank' (0 first) among the books most often borrowed by the
+    borrowers of 'book'. Computed offline by catalog/recommendations.py.
+    """
+
+    book        = models.ForeignKey('Book', on_delete=models.CASCADE)
+    recommended = models.ForeignKey('Book', on_delete=models.CASCADE, related_name='+')
+    rank        = models.PositiveSmallIntegerField()
+    # Cosine similarity of the two books' borrowers: shared / sqrt(borrowers of book * borrowers of recommended).
+    score       = models.FloatField()
+    # Number of patrons who borrowed both books.
+    shared      = models.PositiveIntegerField()
+
+    class Meta:
+        # The index of the unique constraint serves the detail page: WHERE book_id = ... ORDER BY rank.
+        unique_together = ('book', 'rank')
+
+    def __str__(self):
+        """
+        String for representing the Model object.
+        """
+
+        return '%s -> %s (%d)' % (self.book_id, self.recommended_id, self.rank)
+
+
+class BorrowedPair(models.Model):
+    """
+    Model representing that a borrower has borrowed a book (at least once): The distinct
+    (borrower, book) pairs of the checkouts, which the recommendations are computed from.
+    Appended to by catalog/recommendations.py from the new loan history events, and kept
+    when old events are archived or pruned.
+    """
+
+    # NOTE: No foreign keys, like LoanEvent: Pairs of deleted books are ignored when read.
+    borrower_id = models.IntegerField()
+    book_id     = models.IntegerField()
+
+    class Meta:
+        # The index of the unique constraint serves the books of borrowers (WHERE borrower_id IN ...),
+        # the other one the borrowers of books and their number (WHERE book_id IN ... GROUP BY book_id).
+        unique_together = ('borrower_id', 'book_id')
+        indexes = [
+            models.Index(fields=['book_id', 'borrower_id']),
+        ]
+
+    def __str__(self):
+        """
+        String for representing the Model object.
+        """
+
+        return '%s borrowed %s' % (self.borrower_id, self.book_id)
+
+
+class RecommendationState(models.Model):
+    """
+    Model holding up to which loan history event the recommendations are computed.
+
+    There is only ever ONE row (pk=1), maintained by catalog/recommendations.py.
+    """
+
+    last_event_id = models.BigIntegerField(default=0)
+    updated_at    = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        """
+        String for representing the Model object.
+        """
+
+        return 'Recommendations up to event %d (%s)' % (self.last_event_id, self.updated_at)
+
+
+# =============================================================================
+
+def make_name_key(*names):
+    """
+    Normalizes names for prefix searches: Lower case, without accents and punctuation,
+    e.g. make_name_key('Brontë', 'Emily') == 'bronte emily'.
+    """
+    text = unicodedata.normalize('NFKD', ' '.join(names))
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(re.findall(r'\w+', text.casefold(), re.UNICODE))
+
+
+def prefix_range(prefix):
+    """
+    Returns (lowest, highest) so that lowest <= value < highest for all values starting with prefix.
+    NOTE: A range (unlike LIKE 'prefix%' or istartswith) can use a plain index on every database.
+    """
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class AuthorQuerySet(models.QuerySet):
+    """
+    Custom QuerySet (and, via as_manager(), manager) for Author.
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        # bulk_create() does not call save(), which sets name_key.
+        for author in objs:
+            author.name_key = author.make_name_key()
+        return super(AuthorQuerySet, self).bulk_create(objs, *args, **kwargs)
+
+    def name_prefix(self, prefix):
+        """
+        Authors whose 'last name first name' starts with prefix (uses the index on name_key).
+        """
+        prefix = make_name_key(prefix)
+        if not prefix:
+            return self.none()
+        lowest, highest = prefix_range(prefix)
+        return self.filter(name_key__gte=lowest, name_key__lt=highest)
+
+
 class Author(models.Model):
     """
     Model representing the author.
@@ -203,6 +709,21 @@ class Author(models.Model):
     date_of_death = models.DateField('Died', null=True, blank=True)
     # NOTE: What does 'Died' mean? Does it specify the only choice?
 
+    # Last change of the author or of anything shown on their page (see catalog/conditional.py).
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # 'last name first name', normalized with make_name_key(), for the autocomplete (see AuthorQuerySet.name_prefix()).
+    # NOTE: Set by save() and bulk_create(); QuerySet.update() of the names has to set it explicitly.
+    name_key = models.CharField(max_length=255, db_index=True, editable=False, default='')
+
+    objects = AuthorQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Sort key of the keyset pagination in AuthorListView.
+            models.Index(fields=['last_name', 'first_name', 'id']),
+        ]
+
 
     # https://docs.djangoproject.com/en/1.8/ref/urlresolvers/#reverse
     def get_absolute_url(self):
@@ -212,10 +733,55 @@ class Author(models.Model):
 
         return reverse('author-detail', args=[str(self.id)])
 
+    def make_name_key(self):
+        return make_name_key(self.last_name, self.first_name)[:255]
+
+    def save(self, *args, **kwargs):
+        self.name_key = self.make_name_key()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'first_name', 'last_name'}.intersection(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'name_key'}
+        super(Author, self).save(*args, **kwargs)
+
+
+    def __str__(self):
+        """
+        String for representing the Model object. 
+        """
+
+        return '%s, %s' % (self.last_name, self.first_name)
+
+# =============================================================================
+
+class CatalogStatistics(models.Model):
+    """
+    Model holding the precomputed record counts shown on the home page.
+
+    There is only ever ONE row (pk=1). It is maintained by catalog/stats.py,
+    so the 'index' view can read all counts with a single lookup instead of 
+    running one COUNT(*) query per number.
+    """
+
+    num_books               = models.PositiveIntegerField(default=0)
+    num_instances           = models.PositiveIntegerField(default=0)
+    num_instances_available = models.PositiveIntegerField(default=0)
+    num_authors             = models.PositiveIntegerField(default=0)
+    num_genres              = models.PositiveIntegerField(default=0)
+    num_python_books        = models.PositiveIntegerField(default=0)
+
+    # Bumped (by signals) every time a counted model changes.
+    generation       = models.PositiveIntegerField(default=0)
+    # Value of 'generation' the counts above were computed for.
+    # NOTE: The counts are up to date as long as built_generation == generation.
+    built_generation = models.PositiveIntegerField(default=0)
+    computed_at      = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = 'catalog statistics'
 
     def __str__(self):
         """
         String for representing the Model object. 
         """
 
-        return '%s, %s' % (self.last_name, self.first_name)
\ No newline at end of file
+        return 'Catalog statistics (%s)' % (self.computed_at,)
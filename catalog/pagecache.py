@@ -0,0 +1,98 @@
+"""
+Full-page cache for anonymous visitors (see AnonymousPageCacheMiddleware in
+catalog/middleware.py).
+
+Which pages are cached, and for how long, is configured per URL path in
+settings.CATALOG_PAGE_CACHE_TIMEOUTS (regular expression, seconds); the first
+matching entry wins. The pages are stored in the cache
+settings.CATALOG_PAGE_CACHE_ALIAS (see CACHES in locallibrary/settings.py).
+
+Purging
+-------
+The cache keys contain a global generation and a version per URL path, so
+purging never has to find the cached keys:
+
+-- purge_paths([...]): Invalidates all cached pages of the paths (with any query string).
+-- purge_all():        Invalidates all cached pages.
+
+The signal handlers in catalog/signals.py call them when the catalog changes.
+NOTE: A purge only reaches the processes that share the cache. With the per process
+      'locmem' default, other worker processes keep serving their cached copies until
+      they expire (see CATALOG_PAGE_CACHE_TIMEOUTS in locallibrary/settings.py).
+"""
+import hashlib
+import re
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+GENERATION_KEY = 'catalog.pages.generation'
+
+
+def get_cache():
+    return caches[getattr(settings, 'CATALOG_PAGE_CACHE_ALIAS', 'default')]
+
+
+def get_timeout(path):
+    """
+    Returns the number of seconds the page at 'path' is cached, or None if it is not cached.
+    """
+    # NOTE: The re module caches the compiled expressions.
+    for pattern, seconds in getattr(settings, 'CATALOG_PAGE_CACHE_TIMEOUTS', ()):
+        if re.match(pattern, path):
+            return seconds
+    return None
+
+
+def path_key(path):
+    return 'catalog.pages.path:%s' % hashlib.md5(path.encode('utf-8')).hexdigest()
+
+
+def new_version():
+    return uuid.uuid4().hex[:12]
+
+
+def page_key(request):
+    """
+    Returns the cache key of the page for a request.
+    """
+    cache   = get_cache()
+    path    = path_key(request.path)
+    current = cache.get_many([GENERATION_KEY, path])
+
+    versions = []
+    for key in (GENERATION_KEY, path):
+        version = current.get(key)
+        if version is None:
+            # NOTE: add() does nothing if another process set the key in the meantime.
+            cache.add(key, new_version(), None)
+            version = cache.get(key)
+        versions.append(version)
+
+    url = '%s%s' % (request.get_host(), request.get_full_path())
+    return 'catalog.pages:%s:%s:%s' % (versions[0], versions[1], hashlib.md5(url.encode('utf-8')).hexdigest())
+
+
+def get_page(request):
+    return get_cache().get(page_key(request))
+
+
+def store_page(request, response, timeout):
+    get_cache().set(page_key(request), response, timeout)
+
+
+def purge_paths(paths):
+    """
+    Invalidates the cached pages of the given URL paths (e.g. '/catalog/book/12').
+    """
+    paths = set(paths)
+    if paths:
+        get_cache().set_many(dict((path_key(path), new_version()) for path in paths), None)
+
+
+def purge_all():
+    """
+    Invalidates all cached pages.
+    """
+    get_cache().set(GENERATION_KEY, new_version(), None)
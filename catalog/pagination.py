@@ -0,0 +1,354 @@
+"""
+Keyset ("seek") pagination for the catalog list views.
+
+Django's Paginator uses LIMIT/OFFSET, so the database has to walk over all
+previous rows to get to a deep page, and every page also pays for a COUNT(*).
+Keyset pagination instead remembers the sort key of the last (or first) row
+of the current page and asks for the rows after (or before) it:
+
+    WHERE (title > 'X') OR (title = 'X' AND id > 42) ORDER BY title, id LIMIT 21
+
+With an index on the sort key this costs the same for every page.
+
+The sort key is passed between pages as an opaque, signed token in the
+'cursor' GET parameter (e.g. /catalog/books/?cursor=...).
+
+Usage:
+
+    class BookListView(KeysetPaginationMixin, generic.ListView):
+        model = Book
+        paginate_by = 20
+        keyset_ordering = ('title', 'id')
+
+NOTE: The fields of keyset_ordering must be NOT NULL and the last one has to
+      be unique (usually the primary key), otherwise rows can be skipped.
+"""
+from django.core import signing
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.http import Http404
+from django.utils.functional import cached_property
+from django.utils.translation import ugettext as _
+
+CURSOR_SALT = 'catalog.pagination.cursor'
+
+# Directions stored in a cursor.
+NEXT     = 'n'
+PREVIOUS = 'p'
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(direction, values):
+    """
+    Returns an opaque (signed) token for the given direction and sort key values.
+    """
+    values = [value if isinstance(value, (int, str)) else str(value) for value in values]
+    return signing.dumps([direction, values], salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(cursor):
+    """
+    Returns the (direction, values) tuple stored in a token created by encode_cursor().
+    """
+    try:
+        direction, values = signing.loads(cursor, salt=CURSOR_SALT)
+    except (signing.BadSignature, ValueError, TypeError):
+        raise InvalidCursor(cursor)
+
+    if direction not in (NEXT, PREVIOUS):
+        raise InvalidCursor(cursor)
+    return direction, values
+
+
+class KeysetPage(object):
+    """
+    One page of results of a KeysetPaginator.
+
+    Provides the parts of django.core.paginator.Page that our templates use
+    (has_next, has_previous, has_other_pages, iteration), plus
+    next_query/previous_query: The query strings of the neighbouring pages.
+    """
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator   = paginator
+
+        self.next_cursor     = None
+        self.previous_cursor = None
+        if object_list:
+            if has_next:
+                self.next_cursor = encode_cursor(NEXT, paginator.get_key(object_list[-1]))
+            if has_previous:
+                self.previous_cursor = encode_cursor(PREVIOUS, paginator.get_key(object_list[0]))
+
+        self.next_query     = ''
+        self.previous_query = ''
+
+    def __repr__(self):
+        return '<Keyset page of %d objects>' % len(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def set_query(self, query_dict, cursor_kwarg='cursor', page_kwarg='page'):
+        """
+        Builds next_query/previous_query from the current request's GET parameters,
+        so that other parameters (e.g. filters) are kept when changing pages.
+        """
+        query = query_dict.copy()
+        query.pop(page_kwarg, None)
+
+        if self.next_cursor:
+            query[cursor_kwarg] = self.next_cursor
+            self.next_query = query.urlencode()
+        if self.previous_cursor:
+            query[cursor_kwarg] = self.previous_cursor
+            self.previous_query = query.urlencode()
+
+
+class KeysetPaginator(object):
+    """
+    Paginates a queryset by the fields in 'ordering' (e.g. ('title', 'id')).
+
+    NOTE: There is no count and no num_pages: Not having to count the rows
+          is the whole point.
+    """
+
+    def __init__(self, queryset, per_page, ordering):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+
+        model = queryset.model
+        # (Model attribute, lookup name, descending?) for each field of the ordering.
+        self.fields = []
+        for field_name in self.ordering:
+            descending = field_name.startswith('-')
+            name = field_name.lstrip('-')
+            attname = 'pk' if name == 'pk' else model._meta.get_field(name).attname
+            self.fields.append((attname, name, descending))
+
+    def get_key(self, obj):
+        """
+        Returns the sort key values of an object.
+        """
+        return [getattr(obj, attname) for attname, name, descending in self.fields]
+
+    def get_ordering(self, direction):
+        if direction == NEXT:
+            return self.ordering
+        # Walk backwards: Reverse every field of the ordering.
+        return tuple(name if descending else '-' + name for attname, name, descending in self.fields)
+
+    def get_seek_filter(self, direction, values):
+        """
+        Returns the Q object selecting the rows after (NEXT) or before (PREVIOUS) 'values'.
+
+        (a, b, c) > (x, y, z) is expanded to:
+        a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z)
+        """
+        if len(values) != len(self.fields):
+            raise InvalidCursor(values)
+
+        condition = Q()
+        for position, (attname, name, descending) in enumerate(self.fields):
+            greater = (direction == NEXT) != descending
+            lookups = dict(
+                (previous_name, values[index])
+                for index, (_attname, previous_name, _descending) in enumerate(self.fields[:position])
+            )
+            lookups[name + ('__gt' if greater else '__lt')] = values[position]
+            condition |= Q(**lookups)
+        return condition
+
+    def get_page_queryset(self, cursor=None):
+        """
+        Returns (direction, values, queryset) for the page of the given cursor,
+        where queryset selects the rows of the page (plus the following ones).
+        """
+        direction, values = NEXT, None
+        if cursor:
+            direction, values = decode_cursor(cursor)
+
+        queryset = self.queryset.order_by(*self.get_ordering(direction))
+        if values is not None:
+            queryset = queryset.filter(self.get_seek_filter(direction, values))
+        return direction, values, queryset
+
+    def slice_page(self, rows, direction, values):
+        """
+        Returns (rows of the page in display order, has_next, has_previous)
+        for the per_page + 1 rows fetched for a page.
+        """
+        # The extra row tells if there is a further page.
+        has_more = len(rows) > self.per_page
+        rows     = rows[:self.per_page]
+        if not rows:
+            return rows, False, False
+
+        if direction == NEXT:
+            return rows, has_more, values is not None
+
+        rows.reverse()
+        return rows, True, has_more
+
+    def page_values(self, cursor, fields):
+        """
+        Returns (rows, has_next, has_previous) like slice_page(), but with tuples of the values
+        of 'fields' instead of objects (e.g. to compute an ETag, see catalog/conditional.py).
+        """
+        direction, values, queryset = self.get_page_queryset(cursor)
+        # NOTE: The related objects are not needed for the values.
+        rows = queryset.select_related(None).prefetch_related(None).values_list(*fields)
+        return self.slice_page(list(rows[:self.per_page + 1]), direction, values)
+
+    def page(self, cursor=None):
+        """
+        Returns the KeysetPage for the given cursor (the first page if None).
+        """
+        direction, values, queryset = self.get_page_queryset(cursor)
+        object_list, has_next, has_previous = self.slice_page(
+            list(queryset[:self.per_page + 1]), direction, values)
+        return KeysetPage(object_list, self, has_next=has_next, has_previous=has_previous)
+
+
+class KeysetPaginationMixin(object):
+    """
+    ListView mixin that paginates by keyset instead of by page number.
+
+    Set keyset_ordering to the (indexed) sort key of the list.
+    Requests with a legacy ?page=N parameter (and no cursor)
+    still get the usual (OFFSET) page, so old links keep working.
+    """
+
+    keyset_ordering = ('pk',)
+    cursor_kwarg    = 'cursor'
+
+    def get_keyset_ordering(self):
+        return self.keyset_ordering
+
+    def get_keyset_paginator(self, queryset, page_size):
+        return KeysetPaginator(queryset, page_size, self.get_keyset_ordering())
+
+    def paginate_queryset(self, queryset, page_size):
+        if self.cursor_kwarg not in self.request.GET and self.page_kwarg in self.request.GET:
+            return super(KeysetPaginationMixin, self).paginate_queryset(
+                queryset.order_by(*self.get_keyset_ordering()), page_size)
+
+        paginator = self.get_keyset_paginator(queryset, page_size)
+        try:
+            page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        except InvalidCursor:
+            raise Http404(_("Invalid page."))
+
+        page.set_query(self.request.GET, self.cursor_kwarg, self.page_kwarg)
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+
+class QueryPreservingPaginationMixin(object):
+    """
+    ListView mixin for the usual (OFFSET) pagination that keeps the other
+    GET parameters (e.g. filters) in the page links.
+
+    Sets next_query/previous_query on the page, like KeysetPage does,
+    so base.html renders both kinds of pages the same way.
+    """
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator, page, object_list, is_paginated = super(
+            QueryPreservingPaginationMixin, self).paginate_queryset(queryset, page_size)
+
+        query = self.request.GET.copy()
+        page.next_query     = ''
+        page.previous_query = ''
+        if page.has_next():
+            query[self.page_kwarg] = page.next_page_number()
+            page.next_query = query.urlencode()
+        if page.has_previous():
+            query[self.page_kwarg] = page.previous_page_number()
+            page.previous_query = query.urlencode()
+
+        return (paginator, page, object_list, is_paginated)
+
+
+# Estimated counts (for the admin)
+# =============================================================================
+
+def estimate_count(model, using='default'):
+    """
+    Returns the approximate number of rows in the table of 'model' without counting them,
+    or None if the database can't tell.
+
+    -- PostgreSQL: The planner statistics (pg_class.reltuples, updated by (auto)VACUUM/ANALYZE).
+    -- MySQL:      information_schema.tables.table_rows.
+    -- SQLite:     The largest rowid, one index lookup (too high if rows were deleted).
+    """
+    connection = connections[using]
+    table      = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [table])
+        elif connection.vendor == 'mysql':
+            cursor.execute(
+                'SELECT table_rows FROM information_schema.tables '
+                'WHERE table_schema = DATABASE() AND table_name = %s', [table])
+        elif connection.vendor == 'sqlite':
+            cursor.execute('SELECT MAX(rowid) FROM %s' % connection.ops.quote_name(table))
+        else:
+            return None
+        row = cursor.fetchone()
+
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator (for ModelAdmin.paginator) that avoids COUNT(*) over big tables:
+
+    -- Unfiltered: The table size from the database statistics (see estimate_count()),
+                   counted exactly only below exact_count_limit rows.
+    -- Filtered:   Counted, but only up to max_filtered_count rows (so the pages
+                   after that can't be reached; narrow the filter instead).
+
+    NOTE: Set ModelAdmin.show_full_result_count = False as well, otherwise the
+          changelist counts the whole table for "(... total)" next to the filter results.
+    """
+
+    exact_count_limit  = 10000
+    max_filtered_count = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not isinstance(queryset, QuerySet):
+            return super(EstimatedCountPaginator, self).count
+
+        if not queryset.query.where:
+            estimate = estimate_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > self.exact_count_limit:
+                return estimate
+            return queryset.count()
+
+        # COUNT(*) over a subquery with LIMIT: stops after max_filtered_count rows.
+        return queryset[:self.max_filtered_count].count()
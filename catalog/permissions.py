@@ -0,0 +1,102 @@
+"""
+Cross-request cache of the permissions of each user (see CachedPermissionBackend
+in catalog/backends.py).
+
+Without it, the first permission check of every request (the sidebar in
+base.html, the 'perms' checks in the templates, PermissionRequiredMixin)
+loads the user's permissions and the permissions of their groups from the
+auth tables again.
+
+The cached permissions of a user are invalidated by version, like the
+fragments (see catalog/fragments.py):
+
+-- bump_users([...]): A user's own permissions, groups or status changed.
+-- bump_all():        The permissions of a group changed (or a group or permission was deleted),
+                      which can concern any user.
+
+The signal handlers in catalog/signals.py call them. Both bump the version right away
+and again when the transaction of the change commits (see now_and_on_commit()).
+
+NOTE: The 'locmem' default cache is per process. With several worker processes,
+      configure a shared cache (CATALOG_CACHE=memcached, see locallibrary/settings.py),
+      or the other processes only see a change after CATALOG_PERMISSIONS_TIMEOUT
+      seconds (which is short for that reason).
+"""
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+GENERATION_KEY = 'catalog.permissions.generation'
+
+
+def get_timeout():
+    return getattr(settings, 'CATALOG_PERMISSIONS_TIMEOUT', 3600)
+
+
+def version_key(user_pk):
+    return 'catalog.permissions.version:%s' % user_pk
+
+
+def new_version():
+    return uuid.uuid4().hex[:12]
+
+
+def permissions_key(user_pk):
+    """
+    Returns the cache key of the permissions of a user (with the current versions).
+    """
+    keys    = [GENERATION_KEY, version_key(user_pk)]
+    current = cache.get_many(keys)
+
+    versions = []
+    for key in keys:
+        version = current.get(key)
+        if version is None:
+            # NOTE: add() does nothing if another process set the key in the meantime.
+            cache.add(key, new_version(), None)
+            version = cache.get(key)
+        versions.append(version)
+    return 'catalog.permissions:%s:%s:%s' % (versions[0], versions[1], user_pk)
+
+
+def get_or_load(user, load):
+    """
+    Returns the cached permissions of a user (a set of 'app_label.codename' strings),
+    or calls load() and caches its result.
+    """
+    key         = permissions_key(user.pk)
+    permissions = cache.get(key)
+    if permissions is None:
+        permissions = set(load())
+        cache.set(key, permissions, get_timeout())
+    return permissions
+
+
+def now_and_on_commit(bump):
+    """
+    Calls bump() now, and again when the current transaction (if any) commits.
+    A request between the two reads the old permissions from the database and may cache
+    them under the version of the first bump; the second bump makes that entry unreachable.
+    """
+    bump()
+    if connection.in_atomic_block:
+        transaction.on_commit(bump)
+
+
+def bump_users(user_pks):
+    """
+    Invalidates the cached permissions of the given users.
+    """
+    user_pks = set(pk for pk in user_pks if pk is not None)
+    if user_pks:
+        now_and_on_commit(
+            lambda: cache.set_many(dict((version_key(pk), new_version()) for pk in user_pks), None))
+
+
+def bump_all():
+    """
+    Invalidates the cached permissions of all users.
+    """
+    now_and_on_commit(lambda: cache.set(GENERATION_KEY, new_version(), None))
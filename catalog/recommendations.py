@@ -0,0 +1,338 @@
+"""
+"Patrons who borrowed this also borrowed" recommendations on the book detail page.
+
+The detail page reads the precomputed top books of its book (BookRecommendation)
+with ONE query on the index (book, rank). They are computed offline by the
+refresh_recommendations command (run e.g. every hour by cron) from the loan
+history (catalog/history.py):
+
+-- Every checkout event gives a (borrower, book) pair. The distinct pairs are stored
+   (BorrowedPair) and form a binary borrower x book matrix A.
+-- The co-borrowing counts of a set of books are the sparse product A[:, books].T @ A
+   (number of patrons who borrowed both books). They are scored with the cosine
+   similarity shared / sqrt(borrowers of the book * borrowers of the other book),
+   so books everybody borrows don't top every list, and the top
+   CATALOG_RECOMMENDATIONS_SIZE other books of each row are kept.
+-- Only the rows of books that changed are written, and only their pages are
+   invalidated.
+
+The products use NumPy and SciPy (pinned in requirements.txt), which handle a
+million loans in well under a minute. Without them, the same recommendations are
+computed in pure Python (co_borrowed_python()), which is fine for small libraries
+(the refresh_recommendations command warns about it).
+
+Incremental refresh
+===================
+Like the daily rollups (catalog/rollups.py), a refresh only reads the events after
+its watermark (RecommendationState.last_event_id), up to the first event that is
+younger than CATALOG_ROLLUP_LAG seconds, and stores their new pairs. Only a new pair
+changes scores: A first checkout of book X by borrower B changes the scores of every
+book that shares a borrower with X. So the books refreshed are those borrowed by any
+borrower of X, and only the pairs of THEIR borrowers are read (plus the number of
+borrowers of each book, with one GROUP BY on the index of BorrowedPair); the other
+rows stay as they are. A full refresh (refresh_recommendations --full) reads all pairs.
+NOTE: The pairs outlive the events: Archiving or pruning old events
+      (archive_loan_events, prune_loan_events) keeps their recommendations.
+"""
+import datetime
+import math
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max, Min
+from django.utils import timezone
+
+from . import conditional, rollups
+from .models import Book, BookRecommendation, BorrowedPair, LoanEvent, RecommendationState
+from .signals import purge_pages
+
+try:
+    import numpy
+    from scipy import sparse
+except ImportError:
+    # Optional: co_borrowed_python() is used instead.
+    numpy = sparse = None
+
+STATE_PK = 1
+
+# Books per query with 'IN (...)' (SQLite allows at most 999 parameters).
+BATCH_SIZE = 500
+
+
+class ConcurrentRefresh(Exception):
+    """
+    Another refresh moved the watermark in the meantime (nothing was written).
+    """
+
+
+def get_size():
+    return getattr(settings, 'CATALOG_RECOMMENDATIONS_SIZE', 5)
+
+
+def batches(ids, size=BATCH_SIZE):
+    ids = sorted(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+# Reading the history and the pairs
+# =============================================================================
+
+def get_watermark(after, cutoff):
+    """
+    Returns the id of the last event that can be included: The event before the first one
+    that is newer than cutoff (or the last event), but never less than 'after'.
+    """
+    first_new = LoanEvent.objects.filter(occurred_at__gte=cutoff).aggregate(first=Min('pk'))['first']
+    if first_new is None:
+        last = LoanEvent.objects.aggregate(last=Max('pk'))['last'] or 0
+    else:
+        last = first_new - 1
+    return max(after, last)
+
+
+def checkouts(after=0, up_to=None):
+    """
+    Checkout events (after < id <= up_to) of borrowers and books that exist.
+    """
+    events = LoanEvent.objects.filter(kind=LoanEvent.CHECKOUT, pk__gt=after, borrower_id__isnull=False,
+                                      book_id__in=Book.objects.values('pk'))
+    if up_to is not None:
+        events = events.filter(pk__lte=up_to)
+    return events.order_by()
+
+
+def store_pairs(after, up_to):
+    """
+    Stores the pairs of the checkouts after < id <= up_to that are not stored yet.
+    Returns the new pairs. NOTE: Call it inside a transaction.
+    """
+    pairs  = set(checkouts(after, up_to).values_list('borrower_id', 'book_id').distinct())
+    stored = set()
+    for batch in batches({borrower_id for borrower_id, book_id in pairs}):
+        stored.update(BorrowedPair.objects.filter(borrower_id__in=batch).values_list('borrower_id', 'book_id'))
+    new_pairs = sorted(pairs - stored)
+    BorrowedPair.objects.bulk_create(
+        [BorrowedPair(borrower_id=borrower_id, book_id=book_id) for borrower_id, book_id in new_pairs],
+        batch_size=BATCH_SIZE)
+    return new_pairs
+
+
+def stored_pairs():
+    # Pairs of books that exist (the pairs of deleted books stay in the table).
+    return BorrowedPair.objects.filter(book_id__in=Book.objects.values('pk')).order_by()
+
+
+def read_pairs(borrower_ids=None):
+    """
+    Returns the stored (borrower_id, book_id) pairs of the borrowers (of all borrowers if None).
+    """
+    if borrower_ids is None:
+        return list(stored_pairs().values_list('borrower_id', 'book_id'))
+    pairs = []
+    for batch in batches(borrower_ids):
+        pairs.extend(stored_pairs().filter(borrower_id__in=batch).values_list('borrower_id', 'book_id'))
+    return pairs
+
+
+def borrowers_of(book_ids):
+    borrower_ids = set()
+    for batch in batches(book_ids):
+        borrower_ids.update(BorrowedPair.objects.filter(book_id__in=batch).values_list('borrower_id', flat=True))
+    return borrower_ids
+
+
+def borrower_counts(book_ids):
+    """
+    Returns {book_id: number of borrowers} of the books.
+    """
+    counts = {}
+    for batch in batches(book_ids):
+        counts.update(BorrowedPair.objects.filter(book_id__in=batch).order_by()
+                      .values_list('book_id').annotate(number=Count('pk')))
+    return counts
+
+
+def read_affected(new_book_ids):
+    """
+    Returns (book_ids, pairs, counts) for an incremental refresh after new pairs of the books
+    new_book_ids: The ids of all books borrowed by a borrower of one of them (whose scores depend
+    on their borrowers), the pairs of the borrowers of those books only, and the numbers of
+    borrowers of all books in the pairs.
+    """
+    book_ids = {book_id for borrower_id, book_id in read_pairs(borrowers_of(new_book_ids))}
+    pairs    = read_pairs(borrowers_of(book_ids))
+    counts   = borrower_counts({book_id for borrower_id, book_id in pairs})
+    return book_ids, pairs, counts
+
+
+# Computing
+# =============================================================================
+
+def co_borrowed_python(pairs, book_ids, size, counts=None):
+    """
+    Returns {book_id: [(recommended_id, score, shared), ...]} with the 'size' best other books
+    of each of the books (best first; ties go to more shared borrowers, then to the lower id).
+    'pairs' are distinct (borrower_id, book_id) pairs, at least all pairs of the borrowers of the books.
+    'counts' ({book_id: number of borrowers}) is needed if they are not all pairs of the other books.
+    """
+    borrowers = defaultdict(set)
+    books     = defaultdict(list)
+    for borrower_id, book_id in pairs:
+        borrowers[book_id].add(borrower_id)
+        books[borrower_id].append(book_id)
+    if counts is None:
+        counts = dict((book_id, len(borrower_ids)) for book_id, borrower_ids in borrowers.items())
+
+    recommendations = {}
+    for book_id in book_ids:
+        shared = Counter()
+        for borrower_id in borrowers[book_id]:
+            shared.update(books[borrower_id])
+        shared.pop(book_id, None)
+
+        ranked = sorted(
+            ((count / math.sqrt(counts[book_id] * counts[other]), count, other)
+             for other, count in shared.items()),
+            key=lambda row: (-row[0], -row[1], row[2]))
+        recommendations[book_id] = [(other, score, count) for score, count, other in ranked[:size]]
+    return recommendations
+
+
+def co_borrowed_sparse(pairs, book_ids, size, counts=None, block_size=1000):
+    """
+    Same as co_borrowed_python(), with sparse matrix products (NumPy and SciPy).
+    The books are computed in blocks of block_size rows, which bounds the memory needed.
+    """
+    recommendations = {book_id: [] for book_id in book_ids}
+    if not pairs or not book_ids:
+        return recommendations
+
+    pairs = numpy.array(pairs, dtype=numpy.int64)
+    borrower_ids, rows    = numpy.unique(pairs[:, 0], return_inverse=True)
+    column_ids,   columns = numpy.unique(pairs[:, 1], return_inverse=True)
+
+    # Borrower x book, 1 if the borrower has borrowed the book.
+    matrix = sparse.csr_matrix((numpy.ones(len(pairs), dtype=numpy.int64), (rows, columns)),
+                               shape=(len(borrower_ids), len(column_ids)))
+    by_book   = matrix.T.tocsr()
+    if counts is None:
+        borrowers = numpy.asarray(matrix.sum(axis=0)).ravel()
+    else:
+        borrowers = numpy.array([counts[book_id] for book_id in column_ids.tolist()], dtype=numpy.int64)
+
+    targets   = numpy.array(sorted(book_ids), dtype=numpy.int64)
+    positions = numpy.searchsorted(column_ids, targets)
+    found     = positions < len(column_ids)
+    found[found] = column_ids[positions[found]] == targets[found]
+    positions = positions[found]
+
+    for start in range(0, len(positions), block_size):
+        block  = positions[start:start + block_size]
+        # Block x book: Number of patrons who borrowed both books.
+        shared = (by_book[block] @ matrix).tocsr()
+        block_rows = numpy.repeat(numpy.arange(len(block)), numpy.diff(shared.indptr))
+        scores = shared.data / numpy.sqrt(borrowers[block[block_rows]] * borrowers[shared.indices])
+
+        for row, position in enumerate(block):
+            begin, end = shared.indptr[row], shared.indptr[row + 1]
+            others = shared.indices[begin:end]
+            keep   = others != position
+            others, counts, row_scores = others[keep], shared.data[begin:end][keep], scores[begin:end][keep]
+
+            # lexsort() sorts by the last key first.
+            best = numpy.lexsort((column_ids[others], -counts, -row_scores))[:size]
+            recommendations[int(column_ids[position])] = [
+                (int(column_ids[others[i]]), float(row_scores[i]), int(counts[i])) for i in best]
+    return recommendations
+
+
+def co_borrowed(pairs, book_ids, size, counts=None):
+    if sparse is not None:
+        return co_borrowed_sparse(pairs, book_ids, size, counts)
+    return co_borrowed_python(pairs, book_ids, size, counts)
+
+
+# Storing
+# =============================================================================
+
+def current_recommendations(book_ids):
+    """
+    Returns the stored recommendations of the books, in the format of co_borrowed().
+    """
+    current = defaultdict(list)
+    for batch in batches(book_ids):
+        rows = (BookRecommendation.objects.filter(book_id__in=batch).order_by('book_id', 'rank')
+                .values_list('book_id', 'recommended_id', 'score', 'shared'))
+        for book_id, recommended_id, score, shared in rows:
+            current[book_id].append((recommended_id, score, shared))
+    return current
+
+
+def save(recommendations):
+    """
+    Replaces the stored recommendations of the books whose recommendations changed.
+    Returns the ids of those books.
+    NOTE: Call it inside a transaction.
+    """
+    current = current_recommendations(recommendations)
+    changed = [book_id for book_id, rows in recommendations.items() if current.get(book_id, []) != rows]
+
+    for batch in batches(changed):
+        BookRecommendation.objects.filter(book_id__in=batch).delete()
+    BookRecommendation.objects.bulk_create(
+        [BookRecommendation(book_id=book_id, recommended_id=recommended_id, rank=rank, score=score, shared=shared)
+         for book_id in changed
+         for rank, (recommended_id, score, shared) in enumerate(recommendations[book_id])],
+        batch_size=BATCH_SIZE)
+    return changed
+
+
+def refresh(full=False, size=None, lag=None):
+    """
+    Recomputes the recommendations of the books affected by the new checkouts (of all books
+    if full=True). Returns (number of books recomputed, number of books whose recommendations changed).
+    Raises ConcurrentRefresh if another refresh finished first.
+    """
+    size   = get_size() if size is None else size
+    lag    = rollups.get_lag() if lag is None else lag
+    cutoff = timezone.now() - datetime.timedelta(seconds=lag)
+
+    state, created = RecommendationState.objects.get_or_create(pk=STATE_PK)
+    watermark = get_watermark(state.last_event_id, cutoff)
+
+    # NOTE: Storing the same pairs again is skipped, so pairs stored by a refresh that then
+    #       fails (e.g. ConcurrentRefresh) do no harm.
+    try:
+        with transaction.atomic():
+            new_pairs = store_pairs(state.last_event_id, watermark)
+    except IntegrityError:
+        raise ConcurrentRefresh('The pairs were stored by another run.')
+
+    if full:
+        pairs    = read_pairs()
+        counts   = None
+        book_ids = {book_id for borrower_id, book_id in pairs}
+        # Deleted books: The other books' recommendations of them are gone (CASCADE) and are replaced.
+        book_ids.update(BookRecommendation.objects.values_list('book_id', flat=True).distinct())
+    elif new_pairs:
+        book_ids, pairs, counts = read_affected({book_id for borrower_id, book_id in new_pairs})
+    else:
+        # No new pairs (e.g. only returns, or books borrowed again): Nothing to compute, only the watermark moves.
+        book_ids, pairs, counts = set(), [], None
+    recommendations = co_borrowed(pairs, book_ids, size, counts)
+
+    with transaction.atomic():
+        changed = save(recommendations)
+        # Conditional UPDATE (see catalog/rollups.py): Raising rolls the new rows back.
+        moved = RecommendationState.objects.filter(pk=STATE_PK, last_event_id=state.last_event_id).update(
+            last_event_id=watermark, updated_at=timezone.now())
+        if not moved:
+            raise ConcurrentRefresh('The recommendations were refreshed by another run.')
+
+    # The recommendations are not part of a cached fragment: Touching the books changes
+    # the validators of their pages, purging removes the cached copies.
+    conditional.touch_books(changed)
+    purge_pages(book_ids=changed)
+    return len(book_ids), len(changed)
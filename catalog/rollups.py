@@ -0,0 +1,247 @@
+"""
+Daily circulation rollups behind the circulation report (most borrowed books,
+demand per genre and per language over time).
+
+The report never runs GROUP BYs over the loan history or the catalog tables.
+Instead, the rollup_loans command (run e.g. every few minutes by cron) folds the
+NEW loan history events (catalog/history.py) into small daily tables:
+BookDailyLoans, GenreDailyLoans and LanguageDailyLoans.
+
+-- The events after the watermark (LoanRollupState.last_event_id) are read in
+   id order, in chunks.
+-- Each chunk is counted per (day, book), (day, genre) and (day, language) in
+   Python, added to the rollup rows, and the watermark is moved to the chunk's
+   last event, all in ONE transaction: Every event is counted exactly once, even
+   if the command is interrupted or two runs overlap.
+-- NOTE: Events are only folded once they are CATALOG_ROLLUP_LAG seconds old.
+   An event's id is assigned when it is written, so a transaction that started
+   earlier can still commit an event with a smaller id; the lag gives it time
+   to commit before the watermark passes its id.
+-- NOTE: Genres and language are those of the book when its events are folded.
+
+The report (get_report()) reads the rollups of a range of days, and is cached
+until the next fold moves the watermark.
+"""
+import datetime
+from collections import Counter, defaultdict, namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import (Book, BookDailyLoans, Genre, GenreDailyLoans, Language, LanguageDailyLoans, LoanEvent,
+                     LoanRollupState)
+
+BOOK     = 'book'
+GENRE    = 'genre'
+LANGUAGE = 'language'
+
+# kind: (rollup model, id field, model of the ids, field with the name)
+ROLLUPS = {
+    BOOK:     (BookDailyLoans,     'book_id',     Book,     'title'),
+    GENRE:    (GenreDailyLoans,    'genre_id',    Genre,    'name'),
+    LANGUAGE: (LanguageDailyLoans, 'language_id', Language, 'name'),
+}
+KINDS = (BOOK, GENRE, LANGUAGE)
+
+# Counted kinds of events, and the rollup column each one is added to.
+COLUMNS = {
+    LoanEvent.CHECKOUT: 'checkouts',
+    LoanEvent.RENEW:    'renewals',
+    LoanEvent.RESERVE:  'reservations',
+}
+
+STATE_PK = 1
+
+Ranked = namedtuple('Ranked', ['id', 'name', 'checkouts', 'renewals', 'reservations'])
+Day    = namedtuple('Day', ['day', 'checkouts', 'renewals', 'reservations'])
+Report = namedtuple('Report', ['kind', 'start', 'end', 'top', 'series', 'rolled_up_at'])
+
+
+class ConcurrentFold(Exception):
+    """
+    Another fold moved the watermark in the meantime (the chunk was rolled back).
+    """
+
+
+def get_lag():
+    return getattr(settings, 'CATALOG_ROLLUP_LAG', 300)
+
+
+def get_timeout():
+    return getattr(settings, 'CATALOG_REPORTS_TIMEOUT', 600)
+
+
+# Folding
+# =============================================================================
+
+def count_events(events):
+    """
+    Returns {kind: {(day, id): Counter({column: number})}} for a list of LoanEvents.
+    """
+    book_ids = {event.book_id for event in events if event.book_id is not None}
+    # Genres and languages of all books of the chunk: Two queries.
+    genres = defaultdict(list)
+    for book_id, genre_id in (Book.genre.through.objects.filter(book_id__in=book_ids)
+                              .values_list('book_id', 'genre_id')):
+        genres[book_id].append(genre_id)
+    languages = dict(Book.objects.filter(pk__in=book_ids, language__isnull=False).values_list('pk', 'language_id'))
+
+    counts = {kind: defaultdict(Counter) for kind in KINDS}
+    for event in events:
+        column = COLUMNS.get(event.kind)
+        if column is None or event.book_id is None:
+            continue
+        day = timezone.localdate(event.occurred_at)
+        counts[BOOK][day, event.book_id][column] += 1
+        for genre_id in genres[event.book_id]:
+            counts[GENRE][day, genre_id][column] += 1
+        if event.book_id in languages:
+            counts[LANGUAGE][day, languages[event.book_id]][column] += 1
+    return counts
+
+
+def add_counts(kind, counts):
+    """
+    Adds the counts of count_events() to the rollup rows of 'kind' (creating the missing ones).
+    """
+    model, field, named_model, name_field = ROLLUPS[kind]
+    if not counts:
+        return
+
+    existing = set(model.objects.filter(
+        day__in={day for day, key in counts}, **{field + '__in': {key for day, key in counts}}
+    ).values_list('day', field))
+
+    new_rows = []
+    for (day, key), columns in counts.items():
+        if (day, key) in existing:
+            model.objects.filter(day=day, **{field: key}).update(
+                **{column: F(column) + number for column, number in columns.items()})
+        else:
+            new_rows.append(model(day=day, **dict(columns, **{field: key})))
+    model.objects.bulk_create(new_rows)
+
+
+def fold_chunk(chunk_size, cutoff):
+    """
+    Folds the next events after the watermark (at most chunk_size, none from cutoff on)
+    into the rollups. Returns the number of events folded (0: nothing to do).
+    """
+    with transaction.atomic():
+        # Locked (on databases that support it), so overlapping runs wait for each other.
+        state, created = LoanRollupState.objects.select_for_update().get_or_create(pk=STATE_PK)
+
+        events = list(LoanEvent.objects.filter(pk__gt=state.last_event_id).order_by('pk')
+                      .only('id', 'occurred_at', 'kind', 'book_id')[:chunk_size])
+        # The events after the first one that is too new have to wait as well (see the NOTE above).
+        for position, event in enumerate(events):
+            if event.occurred_at >= cutoff:
+                events = events[:position]
+                break
+        if not events:
+            return 0
+
+        for kind, counts in count_events(events).items():
+            add_counts(kind, counts)
+
+        # Conditional UPDATE: Fails if another run folded these events first (e.g. on SQLite,
+        # which ignores select_for_update()). Raising rolls the counts back.
+        moved = LoanRollupState.objects.filter(pk=STATE_PK, last_event_id=state.last_event_id).update(
+            last_event_id=events[-1].pk, updated_at=timezone.now())
+        if not moved:
+            raise ConcurrentFold('The loan rollups were changed by another run.')
+    return len(events)
+
+
+def fold(chunk_size=1000, lag=None):
+    """
+    Folds all events that are old enough into the rollups. Returns the number of events folded.
+    """
+    lag    = get_lag() if lag is None else lag
+    cutoff = timezone.now() - datetime.timedelta(seconds=lag)
+
+    folded = 0
+    while True:
+        number = fold_chunk(chunk_size, cutoff)
+        if not number:
+            return folded
+        folded += number
+
+
+def reset():
+    """
+    Deletes all rollups and resets the watermark, so the next fold starts over.
+    NOTE: Events deleted by archive_loan_events or prune_loan_events can't be counted again.
+    """
+    with transaction.atomic():
+        for model, field, named_model, name_field in ROLLUPS.values():
+            model.objects.all().delete()
+        LoanRollupState.objects.update_or_create(pk=STATE_PK, defaults={'last_event_id': 0, 'updated_at': None})
+
+
+# Reports
+# =============================================================================
+
+TOTALS = {
+    'total_checkouts':    Sum('checkouts'),
+    'total_renewals':     Sum('renewals'),
+    'total_reservations': Sum('reservations'),
+}
+
+
+def top(kind, start, end, number):
+    """
+    Returns the 'number' books, genres or languages with the most checkouts from start to end
+    (inclusive), as a list of Ranked.
+    """
+    model, field, named_model, name_field = ROLLUPS[kind]
+    rows = list(model.objects.filter(day__range=(start, end)).values(field).annotate(**TOTALS)
+                .order_by('-total_checkouts', field)[:number])
+
+    names = dict(named_model.objects.filter(pk__in=[row[field] for row in rows]).values_list('pk', name_field))
+    return [Ranked(row[field], names.get(row[field], '(deleted)'),
+                   row['total_checkouts'], row['total_renewals'], row['total_reservations'])
+            for row in rows]
+
+
+def series(kind, start, end, key=None):
+    """
+    Returns the daily totals from start to end (inclusive) as a list of Day (one per day),
+    of all books, or of one book, genre or language ('key' is its id).
+    """
+    model, field, named_model, name_field = ROLLUPS[kind]
+    queryset = model.objects.filter(day__range=(start, end))
+    if key is not None:
+        queryset = queryset.filter(**{field: key})
+    totals = {row['day']: row for row in queryset.values('day').annotate(**TOTALS).order_by('day')}
+
+    days = []
+    for offset in range((end - start).days + 1):
+        day = start + datetime.timedelta(days=offset)
+        row = totals.get(day, {})
+        days.append(Day(day, row.get('total_checkouts', 0), row.get('total_renewals', 0),
+                        row.get('total_reservations', 0)))
+    return days
+
+
+def get_report(kind, days, number, key=None):
+    """
+    Returns the Report of the last 'days' days (including today): the top 'number' of 'kind'
+    and the daily totals (of the one with id 'key', if given).
+    Cached until the next fold (the watermark is part of the cache key).
+    """
+    last_event_id, rolled_up_at = (LoanRollupState.objects.filter(pk=STATE_PK)
+                                   .values_list('last_event_id', 'updated_at').first() or (0, None))
+    end   = timezone.localdate()
+    start = end - datetime.timedelta(days=days - 1)
+
+    cache_key = 'catalog.rollups:%d:%s:%s:%s:%d:%s' % (last_event_id, kind, start, end, number, key)
+    report = cache.get(cache_key)
+    if report is None:
+        report = Report(kind, start, end, top(kind, start, end, number), series(kind, start, end, key),
+                        rolled_up_at)
+        cache.set(cache_key, report, get_timeout())
+    return report
@@ -0,0 +1,282 @@
+"""
+Full-text search over books and authors.
+
+The searchable text of every Book (title, summary, ISBN, author name) and
+every Author (name) is stored in a separate search table, 'catalog_search',
+which is created by migration 0009 depending on the database:
+
+-- SQLite:     An FTS5 virtual table (ranked with bm25()).
+-- PostgreSQL: A table with a tsvector column and a GIN index (ranked with ts_rank()).
+-- Others:     No table. search() falls back to (slow) icontains lookups.
+
+The table is kept in sync by signal handlers (catalog/signals.py) and can be
+rebuilt in bulk with:
+python3 manage.py rebuild_search_index
+"""
+import re
+from collections import namedtuple
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Author, Book
+
+TABLE = 'catalog_search'
+
+# Kinds of indexed objects.
+# NOTE: On SQLite the position in this tuple is part of the row id (see SQLiteSearchBackend.rowid()),
+#       so don't reorder it.
+BOOK   = 'book'
+AUTHOR = 'author'
+KINDS  = (BOOK, AUTHOR)
+
+SearchResult = namedtuple('SearchResult', ['kind', 'object', 'rank'])
+
+
+def tokenize(query):
+    """
+    Splits a user query into words (dropping all characters with a special meaning to the search engines).
+    """
+    return re.findall(r'\w+', query, re.UNICODE)
+
+
+def book_document(book):
+    """
+    Returns the (title, body) text indexed for a book.
+    """
+    author = ''
+    if book.author is not None:
+        author = '%s %s' % (book.author.first_name, book.author.last_name)
+    return book.title, ' '.join([book.summary, book.isbn, author])
+
+
+def author_document(author):
+    """
+    Returns the (title, body) text indexed for an author.
+    """
+    return str(author), '%s %s' % (author.first_name, author.last_name)
+
+
+class SQLiteSearchBackend(object):
+    """
+    Search table as an FTS5 virtual table:
+    CREATE VIRTUAL TABLE catalog_search USING fts5(kind UNINDEXED, object_id UNINDEXED, title, body)
+    """
+
+    @staticmethod
+    def rowid(kind, object_id):
+        # NOTE: FTS5 can only look up rows quickly by rowid (UNINDEXED columns are scanned),
+        #       so we derive a unique rowid from kind and object id.
+        return object_id * len(KINDS) + KINDS.index(kind)
+
+    def index(self, cursor, kind, documents):
+        rows = [(self.rowid(kind, object_id), kind, object_id, title, body)
+                for object_id, title, body in documents]
+        cursor.executemany('DELETE FROM %s WHERE rowid = %%s' % TABLE, [row[:1] for row in rows])
+        cursor.executemany(
+            'INSERT INTO %s (rowid, kind, object_id, title, body) VALUES (%%s, %%s, %%s, %%s, %%s)' % TABLE, rows)
+
+    def remove(self, cursor, kind, object_ids):
+        cursor.executemany(
+            'DELETE FROM %s WHERE rowid = %%s' % TABLE,
+            [(self.rowid(kind, object_id),) for object_id in object_ids])
+
+    def clear(self, cursor):
+        cursor.execute('DELETE FROM %s' % TABLE)
+
+    def search(self, cursor, words, kinds, limit):
+        # Prefix query ("word"*) for every word; all words have to match.
+        match = ' '.join('"%s"*' % word for word in words)
+        # bm25() weights per column: kind, object_id, title, body. Lower is better.
+        cursor.execute(
+            'SELECT kind, object_id, bm25(%s, 0.0, 0.0, 10.0, 1.0) AS rank FROM %s '
+            'WHERE %s MATCH %%s AND kind IN (%s) ORDER BY rank LIMIT %%s'
+            % (TABLE, TABLE, TABLE, ', '.join(['%s'] * len(kinds))),
+            [match] + list(kinds) + [limit])
+        return [(kind, object_id, -rank) for kind, object_id, rank in cursor.fetchall()]
+
+
+class PostgresSearchBackend(object):
+    """
+    Search table with a precomputed tsvector column (title weighted 'A', body 'B')
+    and a GIN index on it.
+    """
+
+    config = 'english'
+
+    def index(self, cursor, kind, documents):
+        cursor.executemany(
+            'INSERT INTO {table} (kind, object_id, title, body, document) '
+            'VALUES (%s, %s, %s, %s, '
+            " setweight(to_tsvector('{config}', %s), 'A') || setweight(to_tsvector('{config}', %s), 'B')) "
+            'ON CONFLICT (kind, object_id) DO UPDATE SET '
+            ' title = EXCLUDED.title, body = EXCLUDED.body, document = EXCLUDED.document'
+            .format(table=TABLE, config=self.config),
+            [(kind, object_id, title, body, title, body) for object_id, title, body in documents])
+
+    def remove(self, cursor, kind, object_ids):
+        cursor.execute(
+            'DELETE FROM %s WHERE kind = %%s AND object_id = ANY(%%s)' % TABLE, [kind, list(object_ids)])
+
+    def clear(self, cursor):
+        cursor.execute('TRUNCATE %s' % TABLE)
+
+    def search(self, cursor, words, kinds, limit):
+        # Prefix query (word:*) for every word; all words have to match.
+        query = ' & '.join('%s:*' % word for word in words)
+        cursor.execute(
+            "SELECT kind, object_id, ts_rank(document, query) AS rank "
+            "FROM {table}, to_tsquery('{config}', %s) query "
+            "WHERE document @@ query AND kind = ANY(%s) ORDER BY rank DESC LIMIT %s"
+            .format(table=TABLE, config=self.config),
+            [query, list(kinds), limit])
+        return cursor.fetchall()
+
+
+BACKENDS = {
+    'sqlite':     SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+# Database aliases known to have a search table.
+_has_table = set()
+
+
+def get_backend(conn=None):
+    """
+    Returns the search backend for the database, or None if there is no search table.
+    """
+    conn = conn or connection
+    backend_class = BACKENDS.get(conn.vendor)
+    if backend_class is None:
+        return None
+
+    if conn.alias not in _has_table:
+        with conn.cursor() as cursor:
+            if TABLE not in conn.introspection.table_names(cursor):
+                return None
+        _has_table.add(conn.alias)
+    return backend_class()
+
+
+# Keeping the index up to date
+# =============================================================================
+
+def index_books(books):
+    """
+    Adds/updates the search documents of the given books.
+    NOTE: Load the books with Book.objects.for_listing() to avoid one author query per book.
+    """
+    backend = get_backend()
+    if backend is None:
+        return
+
+    documents = [(book.pk,) + book_document(book) for book in books]
+    with connection.cursor() as cursor:
+        backend.index(cursor, BOOK, documents)
+
+
+def index_authors(authors):
+    """
+    Adds/updates the search documents of the given authors.
+    """
+    backend = get_backend()
+    if backend is None:
+        return
+
+    documents = [(author.pk,) + author_document(author) for author in authors]
+    with connection.cursor() as cursor:
+        backend.index(cursor, AUTHOR, documents)
+
+
+def remove(kind, object_ids):
+    """
+    Removes the search documents of the given objects.
+    """
+    backend = get_backend()
+    if backend is None:
+        return
+
+    with connection.cursor() as cursor:
+        backend.remove(cursor, kind, object_ids)
+
+
+def rebuild_index(batch_size=1000):
+    """
+    Rebuilds the whole search table. Returns the number of indexed (books, authors).
+
+    NOTE: Walks the tables in primary key order, batch_size rows at a time,
+          so memory use does not grow with the size of the catalog.
+    """
+    backend = get_backend()
+    if backend is None:
+        return 0, 0
+
+    with connection.cursor() as cursor:
+        backend.clear(cursor)
+
+    counts = []
+    for queryset, index in ((Book.objects.for_listing(), index_books), (Author.objects.all(), index_authors)):
+        count, last_pk = 0, 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+            if not batch:
+                break
+            index(batch)
+            count  += len(batch)
+            last_pk = batch[-1].pk
+        counts.append(count)
+
+    return tuple(counts)
+
+
+# Searching
+# =============================================================================
+
+def search(query, limit=50, kinds=KINDS):
+    """
+    Returns a list of SearchResults (best match first) for the words in 'query',
+    of the given kinds of objects only.
+    """
+    words = tokenize(query)
+    if not words:
+        return []
+
+    backend = get_backend()
+    if backend is None:
+        return fallback_search(words, kinds, limit)
+
+    with connection.cursor() as cursor:
+        matches = backend.search(cursor, words, kinds, limit)
+
+    # Load the matching objects with one query per kind.
+    book_ids   = [object_id for kind, object_id, rank in matches if kind == BOOK]
+    author_ids = [object_id for kind, object_id, rank in matches if kind == AUTHOR]
+    objects = {
+        BOOK:   Book.objects.for_listing().in_bulk(book_ids),
+        AUTHOR: Author.objects.in_bulk(author_ids),
+    }
+
+    return [SearchResult(kind, objects[kind][object_id], rank)
+            for kind, object_id, rank in matches
+            if object_id in objects[kind]]
+
+
+def fallback_search(words, kinds, limit):
+    """
+    Search without a search table (unranked, sequential scans).
+    """
+    books, authors = Book.objects.for_listing(), Author.objects.all()
+    for word in words:
+        books = books.filter(
+            Q(title__icontains=word) | Q(summary__icontains=word) | Q(isbn__icontains=word) |
+            Q(author__first_name__icontains=word) | Q(author__last_name__icontains=word))
+        authors = authors.filter(Q(first_name__icontains=word) | Q(last_name__icontains=word))
+
+    results = []
+    if BOOK in kinds:
+        results += [SearchResult(BOOK, book, 0) for book in books[:limit]]
+    if AUTHOR in kinds:
+        results += [SearchResult(AUTHOR, author, 0) for author in authors[:limit]]
+    return results[:limit]
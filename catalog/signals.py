@@ -0,0 +1,430 @@
+"""
+Signal handlers that keep derived catalog data in sync with the models.
+
+NOTE: The handlers are connected in CatalogConfig.ready() (catalog/apps.py),
+      which imports this module.
+NOTE: QuerySet.update() and bulk_create() do NOT send post_save signals.
+      Code that changes the catalog that way has to send the bulk_changed
+      signal below instead.
+"""
+from django.contrib.auth.models import Group, Permission, User
+from django.core.urlresolvers import reverse
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import Signal, receiver
+
+from . import conditional, copycounts, facets, fragments, history, pagecache, permissions, search, stats
+from .models import Author, Book, BookInstance, Genre, Language, LoanEvent
+
+# Sent by code that changes catalog rows in bulk (bulk_create(), QuerySet.update()),
+# which does not send post_save/post_delete for each row.
+# Arguments:
+# -- sender: The model class of the changed rows.
+# -- pks:    Primary keys of the created/changed rows.
+bulk_changed = Signal(providing_args=['pks'])
+
+# Home page statistics (catalog/stats.py)
+# =============================================================================
+#
+# Only changes of a count write to the statistics row. The numbers of copies (in total and available)
+# are adjusted with the copy counters of their book (see catalog/copycounts.py).
+
+# Counts of the other counted models (number of rows).
+COUNTS = {
+    Author: 'num_authors',
+    Genre:  'num_genres',
+}
+
+
+def counted_row_saved(sender, instance, created, **kwargs):
+    if created:
+        stats.adjust(**{COUNTS[sender]: 1})
+
+
+def counted_row_deleted(sender, instance, **kwargs):
+    stats.adjust(**{COUNTS[sender]: -1})
+
+
+def counted_rows_created(sender, pks, **kwargs):
+    # Bulk creates of the importer: Counted again on the next read.
+    stats.mark_changed()
+
+for model in COUNTS:
+    post_save.connect(counted_row_saved, sender=model)
+    post_delete.connect(counted_row_deleted, sender=model)
+for model in (Book, Author, Genre):
+    bulk_changed.connect(counted_rows_created, sender=model)
+
+
+@receiver(post_save, sender=Book)
+def book_saved_stats(sender, instance, created, **kwargs):
+    python = int(stats.is_python_book(instance.title))
+    if created:
+        stats.adjust(num_books=1, num_python_books=python)
+    elif instance.has_changed('title'):
+        stats.adjust(num_python_books=python - stats.is_python_book(instance.get_loaded_value('title')))
+
+
+@receiver(post_delete, sender=Book)
+def book_deleted_stats(sender, instance, **kwargs):
+    stats.adjust(num_books=-1, num_python_books=-stats.is_python_book(instance.get_loaded_value('title')))
+
+
+# Full-text search index (catalog/search.py)
+# =============================================================================
+
+@receiver(post_save, sender=Book)
+def index_book(sender, instance, **kwargs):
+    search.index_books([instance])
+
+
+@receiver(post_delete, sender=Book)
+def unindex_book(sender, instance, **kwargs):
+    search.remove(search.BOOK, [instance.pk])
+
+
+@receiver(post_save, sender=Author)
+def index_author(sender, instance, **kwargs):
+    search.index_authors([instance])
+    # The author's name is part of the documents of their books.
+    search.index_books(instance.book_set.for_listing())
+
+
+@receiver(bulk_changed, sender=Book)
+def index_books_in_bulk(sender, pks, **kwargs):
+    search.index_books(Book.objects.for_listing().filter(pk__in=pks))
+
+
+@receiver(bulk_changed, sender=Author)
+def index_authors_in_bulk(sender, pks, **kwargs):
+    search.index_authors(Author.objects.filter(pk__in=pks))
+
+
+@receiver(pre_delete, sender=Author)
+def remember_author_books(sender, instance, **kwargs):
+    # NOTE: After the delete, the books' author is already set to NULL
+    #       (on_delete=SET_NULL), so we have to find them before.
+    instance._search_book_ids = list(instance.book_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Author)
+def unindex_author(sender, instance, **kwargs):
+    search.remove(search.AUTHOR, [instance.pk])
+    book_ids = getattr(instance, '_search_book_ids', [])
+    if book_ids:
+        search.index_books(Book.objects.for_listing().filter(pk__in=book_ids))
+
+
+# Facet counts of the book list (catalog/facets.py)
+# =============================================================================
+
+# Models whose changes (or names) show up in the facet counts.
+FACET_MODELS = (Book, Genre, Language, Author)
+
+
+def invalidate_facets():
+    facets.invalidate()
+    # The counts are shown on the book list.
+    purge_pages(book_list=True)
+
+
+def facets_changed(sender, **kwargs):
+    invalidate_facets()
+
+for model in FACET_MODELS + (BookInstance,):
+    bulk_changed.connect(facets_changed, sender=model)
+
+for model in FACET_MODELS:
+    post_save.connect(facets_changed, sender=model)
+    post_delete.connect(facets_changed, sender=model)
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def book_genres_changed(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_facets()
+
+
+@receiver(post_save, sender=BookInstance)
+def copy_saved(sender, instance, created, **kwargs):
+    # Only the availability facet depends on the copies.
+    if created or instance.has_changed('status') or instance.has_changed('book_id'):
+        invalidate_facets()
+
+
+@receiver(post_delete, sender=BookInstance)
+def copy_deleted(sender, instance, **kwargs):
+    invalidate_facets()
+
+
+# Copy counters on Book (catalog/copycounts.py)
+# =============================================================================
+
+@receiver(post_save, sender=BookInstance)
+def copy_saved_counts(sender, instance, created, **kwargs):
+    if created:
+        copycounts.adjust_book(instance.book_id, added=instance.status)
+    elif instance.has_changed('book_id'):
+        # Moved to another book (possibly with a new status as well).
+        copycounts.adjust_book(instance.get_loaded_value('book_id'), removed=instance.get_loaded_value('status'))
+        copycounts.adjust_book(instance.book_id, added=instance.status)
+    elif instance.has_changed('status'):
+        copycounts.adjust_book(instance.book_id, removed=instance.get_loaded_value('status'), added=instance.status)
+
+
+@receiver(post_delete, sender=BookInstance)
+def copy_deleted_counts(sender, instance, **kwargs):
+    # The book and status of the deleted row, as loaded (the copy may have been changed without saving).
+    copycounts.adjust_book(instance.get_loaded_value('book_id'), removed=instance.get_loaded_value('status'))
+
+
+# Detail pages: Cached template fragments (catalog/fragments.py), conditional GET (catalog/conditional.py)
+# and the full-page cache (catalog/pagecache.py)
+# =============================================================================
+#
+# When something shown on a book's or author's page changes, the page's fragments get a new
+# version, the book's/author's updated_at is set ("touched") and the cached pages are purged.
+# NOTE: A save() of the book/author itself already sets its updated_at (auto_now), so touch=False.
+
+def purge_pages(book_ids=(), author_ids=(), book_list=False, author_list=False):
+    """
+    Purges the cached detail pages of the given books and authors, and the list pages.
+    """
+    paths = [reverse('book-detail', args=[pk]) for pk in book_ids if pk is not None]
+    paths += [reverse('author-detail', args=[pk]) for pk in author_ids if pk is not None]
+    if book_list:
+        paths.append(reverse('books'))
+    if author_list:
+        paths.append(reverse('authors'))
+    pagecache.purge_paths(paths)
+
+
+def author_ids_of_books(book_ids):
+    return list(Book.objects.filter(pk__in=book_ids).values_list('author_id', flat=True).distinct())
+
+
+def authors_changed(author_ids, touch=True):
+    author_ids = list(author_ids)
+    fragments.bump(fragments.AUTHOR, author_ids)
+    if touch:
+        conditional.touch_authors(author_ids)
+    purge_pages(author_ids=author_ids, author_list=True)
+
+
+def books_changed(book_ids, touch=True):
+    book_ids = list(book_ids)
+    fragments.bump(fragments.BOOK, book_ids)
+    if touch:
+        conditional.touch_books(book_ids)
+    purge_pages(book_ids=book_ids, book_list=True)
+
+
+def book_pages_changed(book_ids):
+    """
+    Invalidates the pages of the given books and of their authors (whose pages list them).
+    """
+    book_ids = list(book_ids)
+    if book_ids:
+        books_changed(book_ids)
+        authors_changed(author_ids_of_books(book_ids))
+
+
+def copies_changed(book_ids, counts_changed=True):
+    """
+    Invalidates the copies of the given books, and (if copies were added, moved or removed)
+    the copy counts on their authors' pages.
+    """
+    book_ids = [book_id for book_id in book_ids if book_id is not None]
+    if book_ids:
+        fragments.bump(fragments.COPIES, book_ids)
+        conditional.touch_books(book_ids)
+        purge_pages(book_ids=book_ids)
+        if counts_changed:
+            authors_changed(author_ids_of_books(book_ids))
+
+
+@receiver(post_save, sender=Book)
+def book_saved(sender, instance, **kwargs):
+    books_changed([instance.pk], touch=False)
+    authors_changed([instance.author_id, instance.get_loaded_value('author_id')])
+
+
+@receiver(post_delete, sender=Book)
+def book_deleted(sender, instance, **kwargs):
+    books_changed([instance.pk], touch=False)
+    fragments.bump(fragments.COPIES, [instance.pk])
+    authors_changed([instance.author_id])
+
+
+@receiver(bulk_changed, sender=Book)
+def books_changed_in_bulk(sender, pks, **kwargs):
+    book_pages_changed(pks)
+
+
+@receiver(post_save, sender=Author)
+def author_saved(sender, instance, **kwargs):
+    authors_changed([instance.pk], touch=False)
+    # The author's name is shown on the pages of their books.
+    books_changed(list(instance.book_set.values_list('pk', flat=True)))
+
+
+@receiver(post_delete, sender=Author)
+def author_deleted(sender, instance, **kwargs):
+    authors_changed([instance.pk], touch=False)
+    # See remember_author_books().
+    books_changed(getattr(instance, '_search_book_ids', []))
+
+
+@receiver(bulk_changed, sender=Author)
+def authors_changed_in_bulk(sender, pks, **kwargs):
+    authors_changed(pks)
+
+
+@receiver(pre_delete, sender=Genre)
+@receiver(pre_delete, sender=Language)
+def remember_books(sender, instance, **kwargs):
+    # NOTE: After the delete, the books no longer refer to the genre/language,
+    #       so we have to find them before.
+    instance._fragment_book_ids = list(instance.book_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Genre)
+@receiver(post_save, sender=Language)
+def genre_or_language_saved(sender, instance, created, **kwargs):
+    # The name is shown on the pages of the books (and, for genres, in the bibliography of their authors).
+    if not created:
+        book_pages_changed(instance.book_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Genre)
+@receiver(post_delete, sender=Language)
+def genre_or_language_deleted(sender, instance, **kwargs):
+    book_pages_changed(getattr(instance, '_fragment_book_ids', []))
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def book_genres_changed_pages(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        # book.genre.add(...) etc.
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            book_pages_changed([instance.pk])
+    elif action == 'pre_clear':
+        # genre.book_set.clear(): pk_set is None, so find the books before.
+        instance._fragment_book_ids = list(instance.book_set.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        book_pages_changed(getattr(instance, '_fragment_book_ids', []))
+    elif action in ('post_add', 'post_remove'):
+        book_pages_changed(pk_set)
+
+
+@receiver(post_save, sender=BookInstance)
+def copy_saved_pages(sender, instance, created, **kwargs):
+    moved = created or instance.has_changed('book_id')
+    copies_changed([instance.book_id, instance.get_loaded_value('book_id')], counts_changed=moved)
+
+
+@receiver(post_delete, sender=BookInstance)
+def copy_deleted_pages(sender, instance, **kwargs):
+    copies_changed([instance.book_id])
+
+
+@receiver(bulk_changed, sender=BookInstance)
+def copies_changed_in_bulk(sender, pks, **kwargs):
+    copies_changed(BookInstance.objects.filter(pk__in=pks).values_list('book_id', flat=True).distinct())
+
+
+# Loan history (catalog/history.py)
+# =============================================================================
+#
+# catalog/circulation.py and catalog/holds.py record their own events (they use QuerySet.update()).
+# A save() that lends, returns or renews a copy (e.g. in the admin or the book's inline) is recorded here.
+# NOTE: Connected before copy_made_available() below, so a return is recorded before the reservation
+#       that it triggers.
+
+def loan_events(instance, created):
+    """
+    Returns the LoanEvents of a save() of a copy, from its status, borrower and due date as loaded.
+    """
+    was_on_loan = not created and instance.get_loaded_value('status') == 'o'
+    borrower_id = instance.get_loaded_value('borrower_id')
+    events = []
+
+    returned = was_on_loan and (instance.status != 'o' or instance.borrower_id != borrower_id)
+    if returned:
+        events.append(history.event(LoanEvent.RETURN, instance.pk, instance.get_loaded_value('book_id'), borrower_id))
+    if instance.status == 'o' and (not was_on_loan or returned):
+        events.append(history.event(
+            LoanEvent.CHECKOUT, instance.pk, instance.book_id, instance.borrower_id, instance.due_back))
+    elif instance.status == 'o' and instance.has_changed('due_back'):
+        events.append(history.event(
+            LoanEvent.RENEW, instance.pk, instance.book_id, instance.borrower_id, instance.due_back))
+    return events
+
+
+@receiver(post_save, sender=BookInstance)
+def copy_saved_history(sender, instance, created, **kwargs):
+    history.record(loan_events(instance, created))
+
+
+# Hold queue (catalog/holds.py)
+# =============================================================================
+
+@receiver(post_save, sender=BookInstance)
+def copy_made_available(sender, instance, created, **kwargs):
+    # A copy made available with save() (e.g. new stock in the admin) goes to the next waiting hold.
+    # NOTE: Imported here, because catalog/holds.py imports this module (bulk_changed).
+    if instance.status == 'a' and instance.book_id and (created or instance.has_changed('status')):
+        from . import holds
+        if holds.allocate_copy(instance.pk, instance.book_id) is not None:
+            # The caller's instance is now reserved as well: Another save() of it must not
+            # make the copy available again (or adjust the counters from the wrong status).
+            instance.refresh_from_db(fields=['status', 'borrower', 'due_back', 'version'])
+
+
+# Permission cache (catalog/permissions.py)
+# =============================================================================
+
+M2M_CHANGED = ('post_add', 'post_remove', 'post_clear')
+
+
+@receiver(m2m_changed, sender=User.user_permissions.through)
+@receiver(m2m_changed, sender=User.groups.through)
+def user_permissions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in M2M_CHANGED:
+        return
+    if not reverse:
+        # user.user_permissions.add(...), user.groups.add(...) etc.
+        permissions.bump_users([instance.pk])
+    elif pk_set is not None:
+        # permission.user_set.add(...), group.user_set.add(...) etc.
+        permissions.bump_users(pk_set)
+    else:
+        # permission.user_set.clear(), group.user_set.clear(): The users are not known.
+        permissions.bump_all()
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def group_permissions_changed(sender, action, **kwargs):
+    if action in M2M_CHANGED:
+        permissions.bump_all()
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields, **kwargs):
+    # is_active and is_superuser change the permissions. Logging in only saves last_login.
+    # NOTE: New users as well: The pk of a rolled back user can be given out again (e.g. on SQLite),
+    #       and its cached permissions must not pass to the new user.
+    if update_fields != frozenset(['last_login']):
+        permissions.bump_users([instance.pk])
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    permissions.bump_users([instance.pk])
+
+
+@receiver(post_save, sender=Permission)
+@receiver(post_delete, sender=Permission)
+@receiver(post_delete, sender=Group)
+def group_or_permission_changed(sender, **kwargs):
+    # NOTE: Deleting a group or permission also deletes its relations, without m2m_changed signals.
+    permissions.bump_all()
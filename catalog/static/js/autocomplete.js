@@ -0,0 +1,87 @@
+/*
+ * Autocomplete for <select data-autocomplete-url="..."> elements (see catalog/widgets.py).
+ *
+ * Puts a search box in front of each such select. What the user types is sent
+ * to the autocomplete URL (?q=...), and the matches replace the options that
+ * are not selected, so the user can pick from them.
+ *
+ * The URL answers with {"results": [{"id": ..., "text": ...}, ...]}.
+ */
+(function () {
+    'use strict';
+
+    // Milliseconds after the last key press before searching.
+    var DELAY = 250;
+
+    function replaceOptions(select, results) {
+        var kept = {};
+        Array.prototype.slice.call(select.options).forEach(function (option) {
+            if (option.selected || option.value === '') {
+                kept[option.value] = true;
+            } else {
+                select.removeChild(option);
+            }
+        });
+
+        results.forEach(function (result) {
+            var value = String(result.id);
+            if (!kept[value]) {
+                select.appendChild(new Option(result.text, value));
+            }
+        });
+    }
+
+    function setUp(select) {
+        // Skip the template row of admin inlines (its copies would get a search box without a handler);
+        // the added rows are set up on 'formset:added' below.
+        if (select.getAttribute('data-autocomplete-ready') || select.name.indexOf('__prefix__') !== -1) {
+            return;
+        }
+        select.setAttribute('data-autocomplete-ready', '1');
+
+        var input = document.createElement('input');
+        input.type = 'search';
+        input.placeholder = 'Type to search...';
+        input.className = 'autocomplete-search';
+        select.parentNode.insertBefore(input, select);
+
+        var timer = null;
+        var latest = null;
+
+        input.addEventListener('input', function () {
+            clearTimeout(timer);
+            timer = setTimeout(function () {
+                var query = input.value.trim();
+                if (!query) {
+                    return;
+                }
+                var request = new XMLHttpRequest();
+                latest = request;
+                request.open('GET', select.getAttribute('data-autocomplete-url') + '?q=' + encodeURIComponent(query));
+                request.onload = function () {
+                    // Ignore answers to older queries.
+                    if (request === latest && request.status === 200) {
+                        replaceOptions(select, JSON.parse(request.responseText).results);
+                    }
+                };
+                request.send();
+            }, DELAY);
+        });
+    }
+
+    function setUpAll(root) {
+        Array.prototype.forEach.call(root.querySelectorAll('select[data-autocomplete-url]'), setUp);
+    }
+
+    document.addEventListener('DOMContentLoaded', function () {
+        setUpAll(document);
+    });
+
+    // Rows added with "Add another ..." in admin inlines: The admin's inlines.js announces them
+    // with the jQuery event 'formset:added' (not a DOM event) once their names are numbered.
+    if (window.django && window.django.jQuery) {
+        window.django.jQuery(document).on('formset:added', function (event, row) {
+            setUpAll(row[0]);
+        });
+    }
+}());
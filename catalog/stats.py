@@ -0,0 +1,161 @@
+"""
+Precomputed catalog statistics for the home page.
+
+The counts shown by the 'index' view are stored in the single row of the
+CatalogStatistics model. Reading them is ONE query, no matter how big the
+catalog is.
+
+How up to date the counts are is controlled by the CATALOG_STATS_CONSISTENCY
+setting:
+
+-- 'exact' (default):
+   Changes that change a count adjust it with ONE relative UPDATE of the row
+   (adjust(), e.g. num_books = num_books + 1), the way catalog/copycounts.py
+   keeps the copy counters of each book: New and deleted books, authors, genres
+   and copies, copies that become (or stop being) available, and books whose
+   title gains or loses 'Python' (see catalog/signals.py and catalog/copycounts.py).
+   Other changes (e.g. a renewal) don't touch the row at all. Changes whose effect
+   is not known (bulk imports) bump CatalogStatistics.generation instead
+   (mark_changed()); the next read notices that the counts were built for an
+   older generation and recomputes them.
+-- <N> (an integer, number of seconds):
+   Signals do not touch the statistics row at all. The counts are recomputed
+   on read once they are older than N seconds.
+
+The counts can also be rebuilt from scratch with:
+python3 manage.py rebuild_catalog_stats
+NOTE: Like the copy counters, the counts drift if rows are changed with raw SQL
+      (rebuild them then).
+"""
+import datetime
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Author, Book, BookInstance, CatalogStatistics, Genre
+
+STATS_PK = 1
+
+
+def get_max_staleness():
+    """
+    Returns the number of seconds the statistics may lag behind,
+    or None if they have to be exact.
+    """
+    consistency = getattr(settings, 'CATALOG_STATS_CONSISTENCY', 'exact')
+
+    if consistency in (None, 'exact'):
+        return None
+    return int(consistency)
+
+
+def compute_statistics():
+    """
+    Counts the catalog records (the expensive part).
+    """
+    return {
+        'num_books':               Book.objects.count(),
+        'num_instances':           BookInstance.objects.count(),
+        'num_instances_available': BookInstance.objects.filter(status__exact='a').count(),
+        'num_authors':             Author.objects.count(),
+        'num_genres':              Genre.objects.count(),
+        # __icontains (contains, case insensitive)
+        'num_python_books':        Book.objects.filter(title__icontains='Python').count(),
+    }
+
+
+def rebuild_statistics(generation=None):
+    """
+    Recomputes all counts and stores them.
+
+    If 'generation' is given, the counts are only stored if no other change
+    happened in the meantime (i.e. the generation is still the same).
+    Otherwise the next read simply recomputes them again.
+    """
+    counts = compute_statistics()
+    now    = timezone.now()
+
+    if generation is None:
+        stats, created = CatalogStatistics.objects.get_or_create(pk=STATS_PK)
+        generation = stats.generation
+        CatalogStatistics.objects.filter(pk=STATS_PK).update(
+            built_generation=generation, computed_at=now, **counts)
+    else:
+        # Conditional UPDATE: Does nothing if a writer bumped the generation
+        # while we were counting.
+        CatalogStatistics.objects.filter(pk=STATS_PK, generation=generation).update(
+            built_generation=generation, computed_at=now, **counts)
+
+    return CatalogStatistics(
+        pk=STATS_PK, generation=generation, built_generation=generation,
+        computed_at=now, **counts)
+
+
+def is_stale(stats):
+    """
+    Returns True if the given CatalogStatistics object has to be recomputed.
+    """
+    if stats.computed_at is None:
+        return True
+
+    max_staleness = get_max_staleness()
+
+    if max_staleness is None:
+        return stats.built_generation != stats.generation
+
+    return timezone.now() - stats.computed_at > datetime.timedelta(seconds=max_staleness)
+
+
+def get_statistics():
+    """
+    Returns the (possibly recomputed) CatalogStatistics object.
+    """
+    stats = CatalogStatistics.objects.filter(pk=STATS_PK).first()
+
+    if stats is None:
+        return rebuild_statistics()
+    if is_stale(stats):
+        return rebuild_statistics(generation=stats.generation)
+
+    return stats
+
+
+def is_python_book(title):
+    # Same test as the num_python_books count (title__icontains='Python').
+    return 'python' in (title or '').lower()
+
+
+def adjust(**changes):
+    """
+    Adds the changes (e.g. num_books=1, num_instances_available=-1) to the stored counts,
+    with one UPDATE. NOTE: Only does something in 'exact' mode; call it in the transaction
+    of the change.
+    """
+    if get_max_staleness() is not None:
+        return
+    values = dict((name, F(name) + change) for name, change in changes.items() if change)
+    if not values:
+        return
+
+    # Only up to date counts are adjusted. Moving both generations keeps them up to date, and
+    # makes a concurrent rebuild_statistics() (which may not have seen this change) store nothing.
+    adjusted = CatalogStatistics.objects.filter(pk=STATS_PK, built_generation=F('generation')).update(
+        generation=F('generation') + 1, built_generation=F('built_generation') + 1, **values)
+    if not adjusted:
+        mark_changed()
+
+
+def mark_changed():
+    """
+    Tells the statistics store that a counted model has changed in an unknown way
+    (the counts are recomputed on the next read).
+
+    NOTE: Only needed (and only does something) in 'exact' mode.
+          In staleness mode we don't want to write to the statistics row
+          on every change of the catalog.
+    """
+    if get_max_staleness() is not None:
+        return
+
+    CatalogStatistics.objects.filter(pk=STATS_PK).update(generation=F('generation') + 1)
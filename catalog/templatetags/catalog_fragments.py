@@ -0,0 +1,48 @@
+"""
+{% load catalog_fragments %}
+
+{% fragmentcache 'book' book.pk %}
+    ... HTML that only depends on the book ...
+{% endfragmentcache %}
+
+Caches the enclosed HTML until the object gets a new version (see catalog/fragments.py).
+An optional third argument names the fragment, if an object has several fragments of the same kind.
+
+NOTE: Don't put anything user specific (e.g. {% if perms... %}) into a cached fragment:
+      It would be shown to every user.
+"""
+from django import template
+
+from catalog import fragments
+
+register = template.Library()
+
+
+class FragmentCacheNode(template.Node):
+
+    def __init__(self, nodelist, kind, pk, name):
+        self.nodelist = nodelist
+        self.kind     = kind
+        self.pk       = pk
+        self.name     = name
+
+    def render(self, context):
+        kind = self.kind.resolve(context)
+        name = self.name.resolve(context) if self.name is not None else ''
+        return fragments.get_or_render(
+            kind, self.pk.resolve(context), lambda: self.nodelist.render(context), name)
+
+
+@register.tag
+def fragmentcache(parser, token):
+    bits = token.split_contents()
+    if len(bits) not in (3, 4):
+        raise template.TemplateSyntaxError("'%s' takes a kind, a primary key and an optional name." % bits[0])
+
+    nodelist = parser.parse(('endfragmentcache',))
+    parser.delete_first_token()
+
+    kind = parser.compile_filter(bits[1])
+    pk   = parser.compile_filter(bits[2])
+    name = parser.compile_filter(bits[3]) if len(bits) == 4 else None
+    return FragmentCacheNode(nodelist, kind, pk, name)
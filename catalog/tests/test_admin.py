@@ -0,0 +1,291 @@
+import datetime
+from unittest import mock
+
+from django.contrib.admin import ModelAdmin, site
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from catalog import circulation
+from catalog.admin import LargeTableAdminMixin
+from catalog.forms import RenewBookForm
+from catalog.models import Author, Book, BookInstance, Genre, Hold, Language, LoanEvent
+from catalog.pagination import EstimatedCountPaginator
+
+
+class AdminChangelistTest(TestCase):
+    """
+    The Book and BookInstance changelists must run a fixed number of queries per page
+    (no query per row, no COUNT(*) over the whole table).
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', '12345')
+        self.client.login(username='admin', password='12345')
+        self.author = Author.objects.create(first_name='John', last_name='Smith')
+        self.genres = [Genre.objects.create(name=name) for name in ('Fantasy', 'Horror')]
+
+    def add_books(self, number):
+        for book_num in range(number):
+            book = Book.objects.create(
+                title='Book %d' % book_num, summary='Summary', isbn='ISBN%d' % book_num, author=self.author)
+            book.genre.add(*self.genres)
+            BookInstance.objects.create(
+                book=book, imprint='Imprint', status='o', borrower=self.user,
+                due_back=datetime.date.today() + datetime.timedelta(days=book_num))
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in context.captured_queries]
+
+    def assert_constant_queries(self, url):
+        self.add_books(2)
+        few = self.count_queries(url)
+        self.add_books(20)
+        many = self.count_queries(url)
+        self.assertEqual(len(few), len(many), '\n'.join(many))
+        return many
+
+    def test_book_changelist(self):
+        # As if the table was big.
+        with mock.patch.object(EstimatedCountPaginator, 'exact_count_limit', 0):
+            queries = self.assert_constant_queries(reverse('admin:catalog_book_changelist'))
+        # Neither the paginator nor "(... total)" count the whole table.
+        self.assertFalse([sql for sql in queries if 'COUNT(*)' in sql and 'catalog_book"' in sql])
+
+    def test_bookinstance_changelist(self):
+        self.assert_constant_queries(reverse('admin:catalog_bookinstance_changelist'))
+
+    def test_filtered_bookinstance_changelist(self):
+        self.assert_constant_queries(reverse('admin:catalog_bookinstance_changelist') + '?status__exact=o')
+
+    def test_search_by_borrower_and_copy_id(self):
+        self.add_books(2)
+        url = reverse('admin:catalog_bookinstance_changelist')
+
+        response = self.client.get(url, {'q': 'admin'})
+        self.assertEqual(response.context['cl'].result_count, 2)
+
+        copy = BookInstance.objects.first()
+        response = self.client.get(url, {'q': str(copy.pk)})
+        self.assertEqual(list(response.context['cl'].result_list), [copy])
+
+    def test_search_filters_once(self):
+        self.add_books(2)
+        admin_class = site._registry[BookInstance]
+        with CaptureQueriesContext(connection) as context:
+            copies, distinct = admin_class.get_search_results(None, BookInstance.objects.all(), 'admin')
+        # Only the full-text search ran; the copies are filtered by the (lazy) queryset.
+        self.assertFalse([query for query in context.captured_queries if 'catalog_bookinstance' in query['sql']])
+        with self.assertNumQueries(1):
+            self.assertEqual(len(copies), 2)
+
+    def test_search_without_search_indexed(self):
+        class PlainAdmin(LargeTableAdminMixin, ModelAdmin):
+            search_fields = ('name',)
+        Genre.objects.create(name='Science Fiction')
+        genres, distinct = PlainAdmin(Genre, site).get_search_results(None, Genre.objects.all(), 'fiction')
+        self.assertEqual([genre.name for genre in genres], ['Science Fiction'])
+
+    def test_loan_event_changelist(self):
+        copy = BookInstance.objects.create(book=Book.objects.create(title='Book', summary='S', isbn='I'), status='a')
+        circulation.checkout(copy.pk, self.user, datetime.date.today())
+        circulation.return_copy(copy.pk)
+        url = reverse('admin:catalog_loanevent_changelist')
+
+        response = self.client.get(url, {'q': 'admin'})
+        self.assertEqual(response.context['cl'].result_count, 2)
+        response = self.client.get(url, {'q': 'nobody'})
+        self.assertEqual(response.context['cl'].result_count, 0)
+        response = self.client.get(reverse('admin:catalog_loanevent_change', args=[LoanEvent.objects.first().pk]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_renew_action(self):
+        self.add_books(2)
+        url = reverse('admin:catalog_bookinstance_changelist')
+        copy_ids = [str(pk) for pk in BookInstance.objects.values_list('pk', flat=True)]
+        data = {'action': 'renew_for_three_weeks', '_selected_action': copy_ids}
+
+        response = self.client.post(url, data, follow=True)
+        self.assertContains(response, '2 of 2 copies renewed.')
+        due_back = datetime.date.today() + datetime.timedelta(weeks=3)
+        self.assertEqual(set(BookInstance.objects.values_list('due_back', flat=True)), {due_back})
+
+        # A date the renewal rules reject renews nothing.
+        BookInstance.objects.update(due_back=None)
+        with mock.patch.object(RenewBookForm, 'clean_renewal_date', side_effect=ValidationError('Closed.')):
+            response = self.client.post(url, data, follow=True)
+        self.assertContains(response, 'No copies renewed: Closed.')
+        self.assertEqual(set(BookInstance.objects.values_list('due_back', flat=True)), {None})
+
+    def test_search_books(self):
+        self.add_books(2)
+        response = self.client.get(reverse('admin:catalog_book_changelist'), {'q': 'smith'})
+        self.assertEqual(response.context['cl'].result_count, 2)
+
+
+class EstimatedCountPaginatorTest(TestCase):
+
+    def setUp(self):
+        for name in ('Fantasy', 'Horror', 'Poetry'):
+            Genre.objects.create(name=name)
+
+    def test_estimate_of_big_tables(self):
+        paginator = EstimatedCountPaginator(Genre.objects.order_by('pk'), 2)
+        paginator.exact_count_limit = 1
+        # SQLite: The largest rowid.
+        self.assertEqual(paginator.count, Genre.objects.order_by('-pk').values_list('pk', flat=True)[0])
+
+    def test_exact_count_of_small_tables(self):
+        self.assertEqual(EstimatedCountPaginator(Genre.objects.order_by('pk'), 2).count, 3)
+
+    def test_filtered_count_is_capped(self):
+        paginator = EstimatedCountPaginator(Genre.objects.exclude(name='Poetry').order_by('pk'), 1)
+        paginator.max_filtered_count = 1
+        self.assertEqual(paginator.count, 1)
+        self.assertEqual(EstimatedCountPaginator(Genre.objects.exclude(name='Poetry').order_by('pk'), 1).count, 2)
+
+
+class PaginatedInlineTest(TestCase):
+
+    def setUp(self):
+        User.objects.create_superuser('admin', 'admin@example.com', '12345')
+        self.client.login(username='admin', password='12345')
+        self.author   = Author.objects.create(first_name='John', last_name='Smith')
+        self.language = Language.objects.create(name='English')
+        self.book     = Book.objects.create(
+            title='Book', summary='Summary', isbn='ISBN', author=self.author, language=self.language)
+        self.book.genre.add(Genre.objects.create(name='Fantasy'))
+        self.copies = [
+            BookInstance.objects.create(
+                book=self.book, imprint='Imprint %d' % copy_num,
+                due_back=datetime.date.today() + datetime.timedelta(days=copy_num))
+            for copy_num in range(45)]
+        self.url = reverse('admin:catalog_book_change', args=[self.book.pk])
+
+    def test_one_page_of_copies(self):
+        response = self.client.get(self.url)
+        formset = response.context['inline_admin_formsets'][0].formset
+        self.assertEqual(len(formset.initial_forms), 20)
+        self.assertEqual(formset.paginator.count, 45)
+        self.assertContains(response, '1&ndash;20 of 45')
+
+        response = self.client.get(self.url, {'bookinstance_set-page': 3})
+        formset = response.context['inline_admin_formsets'][0].formset
+        self.assertEqual([form.instance for form in formset.initial_forms], self.copies[40:])
+
+    def test_constant_number_of_queries(self):
+        # Warm up (content types etc. are cached after the first request).
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(self.url)
+        for copy_num in range(30):
+            BookInstance.objects.create(book=self.book, imprint='More')
+        with self.assertNumQueries(len(context)):
+            self.client.get(self.url)
+
+    def test_saving_a_page(self):
+        response = self.client.get(self.url, {'bookinstance_set-page': 2})
+        formset  = response.context['inline_admin_formsets'][0].formset
+
+        data = {
+            'title': 'Book', 'summary': 'Summary', 'isbn': 'ISBN', 'author': self.author.pk,
+            'genre': [genre.pk for genre in self.book.genre.all()], 'language': self.language.pk,
+            'bookinstance_set-TOTAL_FORMS': 20, 'bookinstance_set-INITIAL_FORMS': 20,
+            'bookinstance_set-MIN_NUM_FORMS': 0, 'bookinstance_set-MAX_NUM_FORMS': 1000,
+        }
+        for form_num, form in enumerate(formset.initial_forms):
+            prefix = 'bookinstance_set-%d-' % form_num
+            data.update({
+                prefix + 'id': form.instance.pk, prefix + 'book': self.book.pk, prefix + 'imprint': 'Changed',
+                prefix + 'status': 'r', prefix + 'due_back': form.instance.due_back or '', prefix + 'borrower': '',
+            })
+        response = self.client.post(self.url + '?bookinstance_set-page=2', data)
+        self.assertEqual(response.status_code, 302)
+
+        self.assertEqual(BookInstance.objects.count(), 45)
+        self.assertEqual(
+            set(BookInstance.objects.filter(imprint='Changed')),
+            set(form.instance for form in formset.initial_forms))
+
+
+class AutocompleteInlineTest(TestCase):
+
+    def test_script_follows_the_admin_jquery(self):
+        # autocomplete.js sets up the rows added to the inline on the admin's jQuery event
+        # 'formset:added', so django.jQuery has to be defined before it runs.
+        User.objects.create_superuser('admin', 'admin@example.com', '12345')
+        self.client.login(username='admin', password='12345')
+        author = Author.objects.create(first_name='John', last_name='Smith')
+        content = self.client.get(reverse('admin:catalog_author_change', args=[author.pk])).content.decode()
+        self.assertIn('__prefix__-genre', content)
+        self.assertLess(content.index('admin/js/jquery.init.js'), content.index('js/autocomplete.js'))
+
+
+class AdminLoanHistoryTest(TestCase):
+    """
+    Lending, returning and renewing a copy by editing it in the admin is recorded in the loan history.
+    """
+
+    def setUp(self):
+        User.objects.create_superuser('admin', 'admin@example.com', '12345')
+        self.client.login(username='admin', password='12345')
+        self.borrower = User.objects.create_user(username='borrower')
+        self.book     = Book.objects.create(title='Book', summary='Summary', isbn='ISBN')
+        self.copy     = BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+        self.url      = reverse('admin:catalog_bookinstance_change', args=[self.copy.pk])
+
+    def save(self, status, borrower=None, due_back=None):
+        response = self.client.post(self.url, {
+            'book': self.book.pk, 'imprint': 'Imprint', 'id': self.copy.pk, 'status': status,
+            'due_back': due_back or '', 'borrower': borrower.pk if borrower else ''})
+        self.assertEqual(response.status_code, 302)
+
+    def events(self):
+        return list(LoanEvent.objects.order_by('pk').values_list('kind', 'borrower_id', 'due_back'))
+
+    def test_checkout_renew_and_return(self):
+        due_back = datetime.date.today() + datetime.timedelta(weeks=3)
+        self.save('o', self.borrower, due_back)
+        self.save('o', self.borrower, due_back + datetime.timedelta(days=7))
+        self.save('a')
+        self.assertEqual(self.events(), [
+            (LoanEvent.CHECKOUT, self.borrower.pk, due_back),
+            (LoanEvent.RENEW, self.borrower.pk, due_back + datetime.timedelta(days=7)),
+            (LoanEvent.RETURN, self.borrower.pk, None),
+        ])
+
+        # Saving without a change records nothing.
+        self.save('a')
+        self.assertEqual(len(self.events()), 3)
+
+    def test_return_before_reservation(self):
+        BookInstance.objects.filter(pk=self.copy.pk).update(status='o', borrower=self.borrower)
+        patron = User.objects.create_user(username='patron')
+        Hold.objects.create(book=self.book, patron=patron)
+
+        self.save('a')
+        self.assertEqual([kind for kind, borrower_id, due_back in self.events()], [LoanEvent.RETURN, LoanEvent.RESERVE])
+        self.assertEqual(BookInstance.objects.get(pk=self.copy.pk).status, 'r')
+
+    def test_inline_save(self):
+        BookInstance.objects.filter(pk=self.copy.pk).update(status='o', borrower=self.borrower)
+        author   = Author.objects.create(first_name='John', last_name='Smith')
+        genre    = Genre.objects.create(name='Fantasy')
+        language = Language.objects.create(name='English')
+        response = self.client.post(reverse('admin:catalog_book_change', args=[self.book.pk]), {
+            'title': 'Book', 'summary': 'Summary', 'isbn': 'ISBN', 'author': author.pk, 'genre': [genre.pk],
+            'language': language.pk,
+            'bookinstance_set-TOTAL_FORMS': 1, 'bookinstance_set-INITIAL_FORMS': 1,
+            'bookinstance_set-MIN_NUM_FORMS': 0, 'bookinstance_set-MAX_NUM_FORMS': 1000,
+            'bookinstance_set-0-id': self.copy.pk, 'bookinstance_set-0-book': self.book.pk,
+            'bookinstance_set-0-imprint': 'Imprint', 'bookinstance_set-0-status': 'd',
+            'bookinstance_set-0-due_back': '', 'bookinstance_set-0-borrower': '',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.events(), [(LoanEvent.RETURN, self.borrower.pk, None)])
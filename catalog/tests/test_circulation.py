@@ -0,0 +1,107 @@
+import datetime
+import threading
+
+from django.contrib.auth.models import User
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase
+
+from catalog import circulation
+from catalog.models import Book, BookInstance
+
+
+class SingleCopyTest(TestCase):
+
+    def setUp(self):
+        self.borrower = User.objects.create_user(username='borrower', password='12345')
+        self.book     = Book.objects.create(title='Book Title', summary='Summary', isbn='ABCDEF')
+        self.copy     = BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+        self.due_back = datetime.date.today() + datetime.timedelta(weeks=3)
+
+    def test_checkout_and_return(self):
+        copy = circulation.checkout(self.copy.pk, self.borrower, self.due_back)
+        self.assertEqual((copy.status, copy.borrower, copy.due_back), ('o', self.borrower, self.due_back))
+        self.assertEqual(copy.version, 1)
+
+        copy = circulation.return_copy(self.copy.pk, version=1)
+        self.assertEqual((copy.status, copy.borrower, copy.due_back), ('a', None, None))
+        self.assertEqual(copy.version, 2)
+
+    def test_checkout_of_copy_on_loan_conflicts(self):
+        circulation.checkout(self.copy.pk, self.borrower, self.due_back)
+        with self.assertRaises(circulation.CirculationConflict) as context:
+            circulation.checkout(self.copy.pk, self.borrower, self.due_back)
+        self.assertEqual(str(context.exception), 'The copy is on loan.')
+        self.assertEqual(context.exception.copy.version, 1)
+
+    def test_stale_version_conflicts(self):
+        circulation.checkout(self.copy.pk, self.borrower, self.due_back)
+        # Someone else renews the copy.
+        circulation.renew_copy(self.copy.pk, self.due_back + datetime.timedelta(days=1))
+
+        with self.assertRaises(circulation.CirculationConflict):
+            circulation.return_copy(self.copy.pk, version=1)
+        self.assertEqual(BookInstance.objects.get(pk=self.copy.pk).status, 'o')
+
+    def test_save_increments_version(self):
+        self.copy.imprint = 'Changed'
+        self.copy.save()
+        self.assertEqual(BookInstance.objects.get(pk=self.copy.pk).version, 1)
+
+    def test_unknown_copy(self):
+        with self.assertRaises(BookInstance.DoesNotExist):
+            circulation.return_copy(BookInstance(book=self.book).pk)
+
+
+class ConcurrentCheckoutTest(TransactionTestCase):
+    """
+    Many threads check out the same copies at the same time: Each copy is lent exactly once.
+    """
+
+    threads = 8
+    copies  = 10
+
+    def setUp(self):
+        book = Book.objects.create(title='Book Title', summary='Summary', isbn='ABCDEF')
+        self.copy_ids  = [BookInstance.objects.create(book=book, imprint='Imprint', status='a').pk
+                          for copy_num in range(self.copies)]
+        self.borrowers = [User.objects.create_user(username='borrower%d' % user_num)
+                          for user_num in range(self.threads)]
+
+    def checkout(self, copy_id, borrower):
+        # NOTE: SQLite (the test database) allows one writer at a time and fails instead of
+        #       waiting for the others (the failed change is rolled back, so it can be repeated).
+        #       Other databases just run the UPDATEs one after the other.
+        while True:
+            try:
+                return circulation.checkout(copy_id, borrower, datetime.date.today())
+            except OperationalError:
+                continue
+
+    def test_no_double_checkouts(self):
+        successes, conflicts = [], []
+        barrier = threading.Barrier(self.threads)
+
+        def borrow(borrower):
+            try:
+                barrier.wait()
+                for copy_id in self.copy_ids:
+                    try:
+                        self.checkout(copy_id, borrower)
+                        successes.append((copy_id, borrower.pk))
+                    except circulation.CirculationConflict:
+                        conflicts.append((copy_id, borrower.pk))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=borrow, args=(borrower,)) for borrower in self.borrowers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(copy_id for copy_id, borrower_id in successes), sorted(self.copy_ids))
+        self.assertEqual(len(conflicts), self.copies * (self.threads - 1))
+        # The database agrees with the winners.
+        self.assertEqual(
+            dict(BookInstance.objects.values_list('pk', 'borrower_id')), dict(successes))
+        self.assertEqual(set(BookInstance.objects.values_list('version', flat=True)), {1})
@@ -0,0 +1,222 @@
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.management import CommandError, call_command
+from django.test import TestCase, TransactionTestCase
+
+from catalog.models import Author, Book, BookInstance, Genre, Hold, Language
+
+
+class ImportCatalogCommandTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+        # An existing genre: Must be reused, not created again.
+        self.fantasy = Genre.objects.create(name='Fantasy')
+
+    def write_file(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as data_file:
+            data_file.write(content)
+        return path
+
+    def import_catalog(self, *args, **options):
+        out = StringIO()
+        call_command('import_catalog', *args, stdout=out, **options)
+        return out.getvalue()
+
+    def books_csv(self, number_of_books):
+        lines = ['title,summary,isbn,author,language,genre']
+        for book_num in range(number_of_books):
+            lines.append('Book %d,My book summary,ISBN%d,"Smith, John",English,Fantasy|Poetry' % (book_num, book_num))
+        return self.write_file('books.csv', '\n'.join(lines) + '\n')
+
+    def test_import_books(self):
+        output = self.import_catalog('book', self.books_csv(5), batch_size=2)
+
+        self.assertIn('Imported 5 book records', output)
+        self.assertIn('rows/sec', output)
+        self.assertEqual(Book.objects.count(), 5)
+        # Referenced rows are created once and reused.
+        self.assertEqual(Author.objects.count(), 1)
+        self.assertEqual(Language.objects.count(), 1)
+        self.assertEqual(sorted(Genre.objects.values_list('name', flat=True)), ['Fantasy', 'Poetry'])
+
+        for book in Book.objects.all():
+            self.assertEqual(str(book.author), 'Smith, John')
+            self.assertEqual(sorted(genre.name for genre in book.genre.all()), ['Fantasy', 'Poetry'])
+
+    def test_import_copies_from_json_lines(self):
+        self.import_catalog('book', self.books_csv(1))
+        path = self.write_file('copies.jsonl', '\n'.join([
+            json.dumps({'isbn': 'ISBN0', 'imprint': 'Unlikely Imprint 2016', 'status': 'a'}),
+            json.dumps({'isbn': 'ISBN0', 'imprint': 'Unlikely Imprint 2016', 'status': 'o', 'due_back': '2017-05-01'}),
+            json.dumps({'isbn': 'UNKNOWN', 'imprint': 'Unlikely Imprint 2016'}),
+        ]))
+
+        output = self.import_catalog('copy', path)
+
+        self.assertIn('2 rows created, 1 skipped', output)
+        self.assertEqual(BookInstance.objects.filter(book__isbn='ISBN0').count(), 2)
+        self.assertEqual(BookInstance.objects.get(status='o').due_back.isoformat(), '2017-05-01')
+        # The copy counters of the book (see catalog/copycounts.py).
+        self.assertEqual(Book.objects.filter(isbn='ISBN0').values_list('copies_total', 'copies_available').get(),
+                         (2, 1))
+
+    def test_resume_from_checkpoint(self):
+        path       = self.books_csv(5)
+        checkpoint = os.path.join(self.directory, 'books.checkpoint')
+
+        # Pretend an earlier run committed the first 3 records.
+        with open(checkpoint, 'w') as checkpoint_file:
+            json.dump({'source': os.path.abspath(path), 'kind': 'book', 'records': 3}, checkpoint_file)
+
+        output = self.import_catalog('book', path, checkpoint=checkpoint, batch_size=2)
+
+        self.assertIn('Resuming after 3 records.', output)
+        self.assertEqual(sorted(Book.objects.values_list('title', flat=True)), ['Book 3', 'Book 4'])
+        with open(checkpoint) as checkpoint_file:
+            self.assertEqual(json.load(checkpoint_file)['records'], 5)
+
+    def test_importing_again_skips_existing_rows(self):
+        self.import_catalog('book', self.books_csv(3))
+        output = self.import_catalog('book', self.books_csv(5))
+        self.assertIn('2 rows created, 3 skipped', output)
+        self.assertEqual(Book.objects.count(), 5)
+
+        copy_id = '6f1d0c6a-3c1e-4b5e-9d3a-2b1f0e8c7a11'
+        path = self.write_file('copies.jsonl', '\n'.join(
+            [json.dumps({'isbn': 'ISBN0', 'imprint': 'Imprint', 'id': copy_id})] * 2))
+        self.assertIn('1 rows created, 1 skipped', self.import_catalog('copy', path))
+        self.assertIn('0 rows created, 2 skipped', self.import_catalog('copy', path))
+
+    def test_malformed_records(self):
+        self.import_catalog('book', self.books_csv(1))
+        for record, message in [
+                ({'due_back': '2017-02-30'}, 'Record 2: due_back is not a date (YYYY-MM-DD): 2017-02-30'),
+                ({'due_back': 'soon'}, 'Record 2: due_back is not a date (YYYY-MM-DD): soon'),
+                ({'id': '1234'}, 'Record 2: id is not a UUID: 1234'),
+                ({'status': 'x'}, 'Record 2: status is not one of d/o/a/r: x')]:
+            path = self.write_file('copies.jsonl', '\n'.join([
+                json.dumps({'isbn': 'ISBN0', 'imprint': 'Imprint'}),
+                json.dumps(dict({'isbn': 'ISBN0', 'imprint': 'Imprint'}, **record)),
+            ]))
+            with self.assertRaisesMessage(CommandError, message):
+                self.import_catalog('copy', path)
+        # The whole batch was rolled back.
+        self.assertFalse(BookInstance.objects.exists())
+
+    def test_dry_run_writes_nothing(self):
+        output = self.import_catalog('book', self.books_csv(5), dry_run=True)
+
+        self.assertIn('Dry run: Parsed 5 book records', output)
+        self.assertIn('rows/sec', output)
+        self.assertEqual(Book.objects.count(), 0)
+        self.assertEqual(Author.objects.count(), 0)
+
+
+class ExportCatalogCommandTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author   = Author.objects.create(first_name='John', last_name='Smith')
+        language = Language.objects.create(name='English')
+        fantasy  = Genre.objects.create(name='Fantasy')
+        poetry   = Genre.objects.create(name='Poetry')
+        for book_num in range(5):
+            book = Book.objects.create(
+                title='Book %d' % book_num, summary='My book summary', isbn='ISBN%d' % book_num,
+                author=author, language=language)
+            book.genre.set([fantasy, poetry])
+            BookInstance.objects.create(book=book, imprint='Unlikely Imprint 2016', status='a')
+
+    def export_catalog(self, *args, **options):
+        out = StringIO()
+        call_command('export_catalog', *args, stdout=out, **options)
+        return out.getvalue()
+
+    def test_export_books_as_csv(self):
+        # One query per chunk of books plus one (genres) per chunk: 3 chunks of 2 books, then an empty one.
+        with self.assertNumQueries(7):
+            output = self.export_catalog('book', chunk_size=2)
+
+        lines = output.splitlines()
+        self.assertEqual(lines[0], 'id,title,summary,isbn,author,language,genre')
+        self.assertEqual(len(lines), 6)
+        self.assertTrue(lines[1].endswith(',Book 0,My book summary,ISBN0,"Smith, John",English,Fantasy|Poetry'))
+
+    def test_export_copies_as_json_lines(self):
+        output = self.export_catalog('copy', format='jsonl')
+
+        records = [json.loads(line) for line in output.splitlines()]
+        self.assertEqual(len(records), 5)
+        self.assertEqual(sorted(record['isbn'] for record in records), ['ISBN%d' % num for num in range(5)])
+        self.assertEqual(records[0]['status'], 'a')
+
+    def test_export_can_be_imported_again(self):
+        path = os.path.join(tempfile.mkdtemp(), 'authors.csv')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        self.export_catalog('author', output=path)
+
+        Author.objects.all().delete()
+        call_command('import_catalog', 'author', path, stdout=StringIO())
+
+        self.assertEqual([str(author) for author in Author.objects.all()], ['Smith, John'])
+
+
+class BenchmarkHomePageCommandTest(TestCase):
+
+    def test_reports_all_modes(self):
+        out = StringIO()
+        call_command('benchmark_home_page', requests=5, visitors=2, host='testserver', stdout=out)
+        lines = out.getvalue().splitlines()
+
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith('session'))
+        self.assertTrue(lines[1].startswith('cookie'))
+        # Cookie mode: No writes.
+        self.assertIn(' 0.00 writes/request', lines[1])
+        # Nothing the benchmark wrote is kept.
+        self.assertEqual(Session.objects.count(), 0)
+
+
+class BenchmarkSessionsCommandTest(TestCase):
+
+    def test_reports_pages_of_each_engine(self):
+        out = StringIO()
+        call_command('benchmark_sessions', requests=3, users=2, engines=['db', 'signed_cookies'],
+                     host='testserver', stdout=out)
+        lines = out.getvalue().splitlines()
+
+        self.assertEqual(lines[0], 'db')
+        self.assertEqual(lines[4], 'signed_cookies')
+        self.assertEqual([line.split()[0] for line in lines[5:]], ['login', 'my_borrowed', 'borrowed'])
+        # Signed cookies: Loading a page does not write.
+        self.assertIn(' 0.00 writes/request', lines[6])
+        # Nothing the benchmark wrote is kept.
+        self.assertEqual(Session.objects.count(), 0)
+        self.assertFalse(User.objects.filter(username__startswith='benchmark-user-').exists())
+
+
+
+class BenchmarkHoldsCommandTest(TransactionTestCase):
+
+    def test_concurrent_returns(self):
+        out = StringIO()
+        call_command('benchmark_holds', threads=2, copies=2, rounds=2, queue=3, stdout=out)
+        lines = out.getvalue().splitlines()
+
+        self.assertEqual(lines[0], '2 threads, 4 copies, 3 holds waiting after the last return')
+        self.assertTrue(lines[1].startswith('return+allocate'))
+        self.assertEqual(lines[2], 'check: ok (9 holds served once each)')
+        # The benchmark data is deleted.
+        self.assertFalse(Hold.objects.exists())
+        self.assertFalse(Book.objects.exists())
+        self.assertFalse(User.objects.exists())
@@ -0,0 +1,124 @@
+import datetime
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from catalog import circulation, copycounts, facets, holds
+from catalog.models import Author, Book, BookInstance
+
+
+class CopyCountersTest(TestCase):
+
+    def setUp(self):
+        self.book     = Book.objects.create(title='Book Title', summary='Summary', isbn='ABCDEF')
+        self.other    = Book.objects.create(title='Other Title', summary='Summary', isbn='GHIJKL')
+        self.borrower = User.objects.create_user(username='borrower')
+        self.due_back = datetime.date.today() + datetime.timedelta(weeks=3)
+
+    def counters(self, book=None):
+        return Book.objects.filter(pk=(book or self.book).pk).values(*Book.COPY_COUNTERS).get()
+
+    def assertCounters(self, total=0, available=0, on_loan=0, reserved=0, maintenance=0, book=None):
+        self.assertEqual(self.counters(book), {
+            'copies_total': total, 'copies_available': available, 'copies_on_loan': on_loan,
+            'copies_reserved': reserved, 'copies_in_maintenance': maintenance})
+
+    def test_save_and_delete(self):
+        copy = BookInstance.objects.create(book=self.book, imprint='Imprint')
+        BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+        self.assertCounters(total=2, available=1, maintenance=1)
+
+        copy.status = 'a'
+        copy.save()
+        self.assertCounters(total=2, available=2)
+
+        # Moved to the other book, with a new status.
+        copy.book, copy.status = self.other, 'd'
+        copy.save()
+        self.assertCounters(total=1, available=1)
+        self.assertCounters(total=1, maintenance=1, book=self.other)
+
+        copy.delete()
+        self.assertCounters(total=0, book=self.other)
+
+    def test_saving_a_book_keeps_the_counters(self):
+        book = Book.objects.get(pk=self.book.pk)
+        BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+        book.title = 'New Title'
+        book.save()
+        self.assertCounters(total=1, available=1)
+
+    def test_circulation(self):
+        copy = BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+        circulation.checkout(copy.pk, self.borrower, self.due_back)
+        self.assertCounters(total=1, on_loan=1)
+        circulation.renew_copy(copy.pk, self.due_back)
+        self.assertCounters(total=1, on_loan=1)
+        circulation.return_copy(copy.pk)
+        self.assertCounters(total=1, available=1)
+
+        # A conflict changes nothing.
+        with self.assertRaises(circulation.CirculationConflict):
+            circulation.return_copy(copy.pk)
+        self.assertCounters(total=1, available=1)
+
+    def test_bulk_return(self):
+        copies = [BookInstance.objects.create(book=book, imprint='Imprint', status='o', borrower=self.borrower)
+                  for book in (self.book, self.book, self.other)]
+        circulation.mark_returned([copy.pk for copy in copies])
+        self.assertCounters(total=2, available=2)
+        self.assertCounters(total=1, available=1, book=self.other)
+
+    def test_holds(self):
+        copy = BookInstance.objects.create(book=self.book, imprint='Imprint', status='o', borrower=self.borrower)
+        hold = holds.place_hold(self.book, User.objects.create_user(username='patron'))
+        circulation.return_copy(copy.pk)
+        self.assertCounters(total=1, reserved=1)
+
+        holds.cancel_hold(hold.pk)
+        self.assertCounters(total=1, available=1)
+
+        hold = holds.place_hold(self.book, self.borrower)
+        holds.pick_up(hold.pk, self.due_back)
+        self.assertCounters(total=1, on_loan=1)
+
+    def test_available_filter_does_not_read_the_copies(self):
+        BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+        BookInstance.objects.create(book=self.other, imprint='Imprint', status='o')
+
+        with CaptureQueriesContext(connection) as queries:
+            books = list(facets.filter_books(Book.objects.all(), {facets.AVAILABLE: True}))
+        self.assertEqual(books, [self.book])
+        self.assertNotIn('catalog_bookinstance', queries[0]['sql'])
+
+    def test_author_page(self):
+        author = Author.objects.create(first_name='Jane', last_name='Smith')
+        Book.objects.filter(pk=self.book.pk).update(author=author)
+        BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+        response = self.client.get(author.get_absolute_url())
+        self.assertContains(response, '(1 in library)')
+
+    def test_reconcile(self):
+        BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+        BookInstance.objects.create(book=self.other, imprint='Imprint', status='o')
+        # Drift: Changes that bypass the counters.
+        BookInstance.objects.filter(book=self.book).update(status='r')
+        Book.objects.filter(pk=self.other.pk).update(copies_total=5)
+
+        out = StringIO()
+        call_command('reconcile_copy_counts', dry_run=True, stdout=out)
+        self.assertEqual(out.getvalue().splitlines(), [
+            'Book %d: copies_available 1 (counted 0), copies_reserved 0 (counted 1)' % self.book.pk,
+            'Book %d: copies_total 5 (counted 1)' % self.other.pk,
+            '2 books with drifted counters.',
+        ])
+        self.assertCounters(total=1, available=1)
+
+        call_command('reconcile_copy_counts', batch_size=1, stdout=StringIO())
+        self.assertCounters(total=1, reserved=1)
+        self.assertCounters(total=1, on_loan=1, book=self.other)
+        self.assertEqual(list(copycounts.reconcile()), [])
@@ -0,0 +1,135 @@
+import datetime
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from catalog import circulation, history, holds
+from catalog.models import Book, BookInstance, LoanEvent
+
+
+class LoanHistoryTest(TestCase):
+
+    def setUp(self):
+        self.borrower = User.objects.create_user(username='borrower')
+        self.book     = Book.objects.create(title='Book Title', summary='Summary', isbn='ABCDEF')
+        self.copy     = BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+        self.due_back = datetime.date.today() + datetime.timedelta(weeks=3)
+
+    def events(self):
+        return list(LoanEvent.objects.order_by('id').values_list('kind', 'copy_id', 'borrower_id', 'due_back'))
+
+    def test_checkout_renew_return(self):
+        circulation.checkout(self.copy.pk, self.borrower, self.due_back)
+        circulation.renew_copy(self.copy.pk, self.due_back + datetime.timedelta(days=1))
+        circulation.return_copy(self.copy.pk)
+
+        self.assertEqual(self.events(), [
+            (LoanEvent.CHECKOUT, self.copy.pk, self.borrower.pk, self.due_back),
+            (LoanEvent.RENEW,    self.copy.pk, self.borrower.pk, self.due_back + datetime.timedelta(days=1)),
+            # The borrower who returned the copy.
+            (LoanEvent.RETURN,   self.copy.pk, self.borrower.pk, None),
+        ])
+        event = LoanEvent.objects.first()
+        self.assertEqual((event.book_id, event.month), (self.book.pk, history.month_key(event.occurred_at)))
+
+    def test_conflicts_are_not_logged(self):
+        circulation.checkout(self.copy.pk, self.borrower, self.due_back)
+        with self.assertRaises(circulation.CirculationConflict):
+            circulation.checkout(self.copy.pk, self.borrower, self.due_back)
+        self.assertEqual(LoanEvent.objects.count(), 1)
+
+    def test_bulk_changes(self):
+        circulation.checkout(self.copy.pk, self.borrower, self.due_back)
+        other = BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+
+        circulation.renew([self.copy.pk, other.pk], self.due_back)
+        circulation.mark_returned([self.copy.pk, other.pk])
+
+        self.assertEqual(self.events()[1:], [
+            (LoanEvent.RENEW,  self.copy.pk, self.borrower.pk, self.due_back),
+            (LoanEvent.RETURN, self.copy.pk, self.borrower.pk, None),
+        ])
+
+    def test_holds(self):
+        patron = User.objects.create_user(username='patron')
+        hold = holds.place_hold(self.book, patron)
+        holds.pick_up(hold.pk, self.due_back)
+        self.assertEqual(self.events(), [
+            (LoanEvent.RESERVE,  self.copy.pk, patron.pk, None),
+            (LoanEvent.CHECKOUT, self.copy.pk, patron.pk, self.due_back),
+        ])
+
+    def test_time_range(self):
+        circulation.checkout(self.copy.pk, self.borrower, self.due_back)
+        now = timezone.now()
+        self.assertEqual(LoanEvent.objects.between(now - datetime.timedelta(minutes=1), now).count(), 1)
+        self.assertEqual(LoanEvent.objects.between(now, now + datetime.timedelta(minutes=1)).count(), 0)
+
+    def test_month_key(self):
+        self.assertEqual(history.month_key(datetime.date(2026, 10, 18)), 202610)
+        self.assertEqual(history.parse_month('2025-01'), 202501)
+        self.assertEqual(history.format_month(202501), '2025-01')
+        # Aware datetimes are converted to UTC.
+        moment = datetime.datetime(2026, 11, 1, 5, tzinfo=timezone.get_fixed_timezone(8 * 60))
+        self.assertEqual(history.month_key(moment), 202610)
+
+
+class ArchiveLoanEventsCommandTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        copy_id = BookInstance(book=None).pk
+        for month, day in ((202601, 5), (202601, 6), (202603, 1), (202610, 1)):
+            year, month_num = divmod(month, 100)
+            occurred_at = datetime.datetime(year, month_num, day, tzinfo=timezone.utc)
+            LoanEvent.objects.create(month=month, occurred_at=occurred_at, kind=LoanEvent.CHECKOUT,
+                                     copy_id=copy_id, book_id=1, borrower_id=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_archive(self):
+        out = StringIO()
+        call_command('archive_loan_events', before='2026-10', output_dir=self.directory, stdout=out)
+
+        self.assertEqual(out.getvalue().splitlines(), [
+            '2026-01: 2 events written to %s, 2 deleted' % os.path.join(self.directory, 'loan_events_2026-01.jsonl'),
+            '2026-03: 1 events written to %s, 1 deleted' % os.path.join(self.directory, 'loan_events_2026-03.jsonl'),
+        ])
+        self.assertEqual(list(LoanEvent.objects.values_list('month', flat=True)), [202610])
+
+        with open(os.path.join(self.directory, 'loan_events_2026-01.jsonl')) as archive:
+            rows = [json.loads(line) for line in archive]
+        self.assertEqual([row['occurred_at'] for row in rows],
+                         ['2026-01-05T00:00:00+00:00', '2026-01-06T00:00:00+00:00'])
+
+        # A month is never archived twice.
+        LoanEvent.objects.create(month=202601, occurred_at=timezone.now(), kind=LoanEvent.RETURN,
+                                 copy_id=rows[0]['copy_id'])
+        with self.assertRaises(CommandError):
+            call_command('archive_loan_events', before='2026-10', output_dir=self.directory, stdout=StringIO())
+
+    def test_keep(self):
+        call_command('archive_loan_events', before='2026-02', output_dir=self.directory, keep=True,
+                     stdout=StringIO())
+        self.assertTrue(os.path.exists(os.path.join(self.directory, 'loan_events_2026-01.jsonl')))
+        self.assertEqual(LoanEvent.objects.count(), 4)
+
+    def test_prune(self):
+        out = StringIO()
+        with self.assertNumQueries(5):
+            # Per month: Find it, delete it (and one final lookup).
+            call_command('prune_loan_events', before='2026-10', stdout=out)
+        self.assertEqual(out.getvalue().splitlines(), ['2026-01: 2 events deleted', '2026-03: 1 events deleted'])
+        self.assertEqual(LoanEvent.objects.count(), 1)
+
+    def test_invalid_month(self):
+        with self.assertRaises(CommandError):
+            call_command('prune_loan_events', before='October')
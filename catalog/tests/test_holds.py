@@ -0,0 +1,177 @@
+import datetime
+import threading
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from catalog import circulation, holds
+from catalog.models import Book, BookInstance, Hold, LoanEvent
+
+
+class HoldQueueTest(TestCase):
+
+    def setUp(self):
+        self.book     = Book.objects.create(title='Book Title', summary='Summary', isbn='ABCDEF')
+        self.borrower = User.objects.create_user(username='borrower')
+        self.patrons  = [User.objects.create_user(username='patron%d' % num) for num in range(3)]
+        self.due_back = datetime.date.today() + datetime.timedelta(weeks=3)
+        self.copies   = [BookInstance.objects.create(book=self.book, imprint='Imprint', status='o',
+                                                     borrower=self.borrower, due_back=self.due_back)
+                         for copy_num in range(2)]
+
+    def test_returned_copies_go_to_the_oldest_holds(self):
+        placed = [holds.place_hold(self.book, patron) for patron in self.patrons]
+        self.assertEqual([hold.status for hold in placed], [Hold.WAITING] * 3)
+
+        for copy in self.copies:
+            copy = circulation.return_copy(copy.pk)
+            self.assertEqual(copy.status, 'r')
+
+        self.assertEqual(
+            list(Hold.objects.values_list('patron', 'status', 'copy')),
+            [(self.patrons[0].pk, Hold.READY, self.copies[0].pk),
+             (self.patrons[1].pk, Hold.READY, self.copies[1].pk),
+             (self.patrons[2].pk, Hold.WAITING, None)])
+        self.assertEqual(BookInstance.objects.get(pk=self.copies[1].pk).borrower, self.patrons[1])
+
+    def test_hold_on_available_copy_is_ready_at_once(self):
+        circulation.return_copy(self.copies[0].pk)
+        hold = holds.place_hold(self.book, self.patrons[0])
+        self.assertEqual((hold.status, hold.copy_id), (Hold.READY, self.copies[0].pk))
+
+    def test_one_active_hold_per_patron(self):
+        holds.place_hold(self.book, self.patrons[0])
+        with self.assertRaises(holds.HoldError):
+            holds.place_hold(self.book, self.patrons[0])
+
+    def test_pick_up(self):
+        hold = holds.place_hold(self.book, self.patrons[0])
+        circulation.return_copy(self.copies[0].pk)
+
+        copy = holds.pick_up(hold.pk, self.due_back)
+        self.assertEqual((copy.status, copy.borrower, copy.due_back), ('o', self.patrons[0], self.due_back))
+        self.assertEqual(Hold.objects.get(pk=hold.pk).status, Hold.FULFILLED)
+        with self.assertRaises(holds.HoldError):
+            holds.pick_up(hold.pk, self.due_back)
+
+    def test_reserved_copy_cannot_be_checked_out(self):
+        holds.place_hold(self.book, self.patrons[0])
+        circulation.return_copy(self.copies[0].pk)
+        with self.assertRaises(circulation.CirculationConflict) as context:
+            circulation.checkout(self.copies[0].pk, self.patrons[1], self.due_back)
+        self.assertEqual(str(context.exception), 'The copy is reserved.')
+
+    def test_cancelled_ready_hold_passes_the_copy_on(self):
+        first, second = [holds.place_hold(self.book, patron) for patron in self.patrons[:2]]
+        circulation.return_copy(self.copies[0].pk)
+
+        holds.cancel_hold(first.pk)
+        second.refresh_from_db()
+        self.assertEqual((second.status, second.copy_id), (Hold.READY, self.copies[0].pk))
+
+        holds.cancel_hold(second.pk)
+        copy = BookInstance.objects.get(pk=self.copies[0].pk)
+        self.assertEqual((copy.status, copy.borrower), ('a', None))
+        with self.assertRaises(holds.HoldError):
+            holds.cancel_hold(second.pk)
+
+    def test_bulk_return_allocates(self):
+        holds.place_hold(self.book, self.patrons[0])
+        outcomes = circulation.mark_returned([copy.pk for copy in self.copies])
+        self.assertEqual([outcome.copy.status for outcome in outcomes], ['r', 'a'])
+
+    def test_copy_made_available_with_save(self):
+        hold = holds.place_hold(self.book, self.patrons[0])
+        copy = BookInstance.objects.create(book=self.book, imprint='New stock', status='d')
+        copy.status = 'a'
+        copy.save()
+        self.assertEqual(Hold.objects.get(pk=hold.pk).copy_id, copy.pk)
+        # The saved instance is reserved as well, so saving it again keeps the reservation.
+        self.assertEqual((copy.status, copy.borrower), ('r', self.patrons[0]))
+        copy.imprint = 'Changed'
+        copy.save()
+        self.assertEqual(BookInstance.objects.get(pk=copy.pk).status, 'r')
+        self.assertEqual(Book.objects.get(pk=self.book.pk).copies_reserved, 1)
+
+    def test_bulk_return_is_one_transaction(self):
+        holds.place_hold(self.book, self.patrons[0])
+        with mock.patch.object(holds, 'allocate_copy', side_effect=OperationalError('locked')):
+            with self.assertRaises(OperationalError):
+                circulation.mark_returned([copy.pk for copy in self.copies])
+        self.assertEqual(set(BookInstance.objects.values_list('status', flat=True)), {'o'})
+        self.assertFalse(LoanEvent.objects.filter(kind=LoanEvent.RETURN).exists())
+
+    def test_allocation_queries(self):
+        # One query for the next hold and one UPDATE of it (and one of the copy),
+        # instead of reading all holds or copies of the book.
+        for patron in self.patrons:
+            holds.place_hold(self.book, patron)
+        circulation.return_copy(self.copies[0].pk)
+        BookInstance.objects.filter(pk=self.copies[1].pk).update(status='a', borrower=None)
+
+        with CaptureQueriesContext(connection) as context:
+            hold_id = holds.allocate_copy(self.copies[1].pk, self.book.pk)
+        self.assertEqual(Hold.objects.get(pk=hold_id).patron, self.patrons[1])
+
+        hold_queries = [query['sql'] for query in context.captured_queries if 'catalog_hold' in query['sql']]
+        self.assertEqual(len(hold_queries), 2, hold_queries)
+        self.assertIn('LIMIT 1', hold_queries[0])
+
+
+class ConcurrentReturnTest(TransactionTestCase):
+    """
+    Many copies of a book are returned at the same time: Each hold gets exactly one copy.
+    """
+
+    copies = 12
+    holds  = 8
+
+    def setUp(self):
+        self.book = Book.objects.create(title='Book Title', summary='Summary', isbn='ABCDEF')
+        borrower  = User.objects.create_user(username='borrower')
+        self.copy_ids = [
+            BookInstance.objects.create(book=self.book, imprint='Imprint', status='o', borrower=borrower,
+                                        due_back=datetime.date.today()).pk
+            for copy_num in range(self.copies)]
+        for patron_num in range(self.holds):
+            holds.place_hold(self.book, User.objects.create_user(username='patron%d' % patron_num))
+
+    def return_copy(self, copy_id):
+        # NOTE: SQLite allows one writer at a time (see ConcurrentCheckoutTest in test_circulation.py).
+        while True:
+            try:
+                return circulation.return_copy(copy_id)
+            except OperationalError:
+                continue
+
+    def test_no_double_allocation(self):
+        barrier = threading.Barrier(self.copies)
+        errors  = []
+
+        def give_back(copy_id):
+            try:
+                barrier.wait()
+                self.return_copy(copy_id)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=give_back, args=(copy_id,)) for copy_id in self.copy_ids]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        ready = Hold.objects.filter(status=Hold.READY)
+        self.assertEqual(ready.count(), self.holds)
+        self.assertEqual(len(set(ready.values_list('copy', flat=True))), self.holds)
+        # The copies agree with the holds, the others are available.
+        self.assertEqual(
+            dict(BookInstance.objects.filter(status='r').values_list('pk', 'borrower')),
+            dict(ready.values_list('copy', 'patron')))
+        self.assertEqual(BookInstance.objects.filter(status='a').count(), self.copies - self.holds)
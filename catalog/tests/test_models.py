@@ -53,4 +53,28 @@ class AuthorModelTest(TestCase):
     def test_get_absolute_url(self):
         author = Author.objects.get(id=1)
         # This will also fail if the urlconf is not defined.
-        self.assertEquals(author.get_absolute_url(), '/catalog/author/1')
\ No newline at end of file
+        self.assertEquals(author.get_absolute_url(), '/catalog/author/1')
+
+class AuthorNameKeyTest(TestCase):
+
+    def test_name_key_is_normalized_last_name_first(self):
+        author = Author.objects.create(first_name='Emily', last_name='Brontë')
+        self.assertEqual(author.name_key, 'bronte emily')
+
+        author.last_name = 'Smith-Jones'
+        author.save(update_fields=['last_name'])
+        self.assertEqual(Author.objects.get(pk=author.pk).name_key, 'smith jones emily')
+
+    def test_bulk_create_sets_name_key(self):
+        Author.objects.bulk_create([Author(first_name='Ann', last_name='Lee')])
+        self.assertEqual(Author.objects.get().name_key, 'lee ann')
+
+    def test_name_prefix(self):
+        for first_name, last_name in (('John', 'Smith'), ('Jane', 'smithers'), ('Joe', 'Smyth'), ('Al', 'Bront')):
+            Author.objects.create(first_name=first_name, last_name=last_name)
+
+        self.assertEqual(
+            sorted(str(author) for author in Author.objects.name_prefix('SMITH')),
+            ['Smith, John', 'smithers, Jane'])
+        self.assertEqual([str(author) for author in Author.objects.name_prefix('smith, jo')], ['Smith, John'])
+        self.assertFalse(Author.objects.name_prefix('  ,').exists())
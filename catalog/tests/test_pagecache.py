@@ -0,0 +1,88 @@
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.test import TestCase, override_settings
+
+from catalog import pagecache
+from catalog.models import Author, Book, BookInstance
+
+
+@override_settings(CATALOG_PAGE_CACHE_TIMEOUTS=(
+    (r'^/catalog/books/$',     60),
+    (r'^/catalog/book/\d+$',   600),
+    (r'^/catalog/author/\d+$', 600),
+))
+class AnonymousPageCacheTest(TestCase):
+
+    def setUp(self):
+        pagecache.get_cache().clear()
+        self.test_author = Author.objects.create(first_name='John', last_name='Smith')
+        self.test_book   = Book.objects.create(
+            title='Book Title', summary='My book summary', isbn='ABCDEFG', author=self.test_author)
+        self.test_copy   = BookInstance.objects.create(
+            book=self.test_book, imprint='Unlikely Imprint 2016', status='a')
+
+    def is_hit(self, url):
+        return self.client.get(url).get('X-Page-Cache') == 'hit'
+
+    def test_second_request_is_served_from_cache(self):
+        url = self.test_book.get_absolute_url()
+        self.assertFalse(self.is_hit(url))
+
+        # No session, no user, no catalog queries.
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertContains(response, 'Book Title')
+
+    def test_pages_not_configured_are_not_cached(self):
+        self.client.get(reverse('index'))
+        self.assertFalse(self.is_hit(reverse('index')))
+
+    def test_book_change_purges_book_pages(self):
+        book_url, author_url = self.test_book.get_absolute_url(), self.test_author.get_absolute_url()
+        for url in (book_url, author_url, reverse('books')):
+            self.client.get(url)
+
+        self.test_book.title = 'New Title'
+        self.test_book.save()
+
+        self.assertContains(self.client.get(book_url), 'New Title')
+        self.assertContains(self.client.get(reverse('books')), 'New Title')
+        self.assertContains(self.client.get(author_url), 'New Title')
+
+    def test_copy_status_change_purges_only_the_book_page(self):
+        book_url, author_url = self.test_book.get_absolute_url(), self.test_author.get_absolute_url()
+        self.client.get(book_url)
+        self.client.get(author_url)
+
+        self.test_copy.status = 'd'
+        self.test_copy.save()
+
+        self.assertFalse(self.is_hit(book_url))
+        self.assertTrue(self.is_hit(author_url))
+
+    def test_logged_in_users_bypass_cache(self):
+        url = reverse('books')
+        self.client.get(url)
+
+        User.objects.create_user(username='testuser1', password='12345')
+        self.client.login(username='testuser1', password='12345')
+
+        response = self.client.get(url)
+        self.assertFalse(response.has_header('X-Page-Cache'))
+        self.assertContains(response, 'testuser1')
+        # Pages rendered for logged-in users are never stored.
+        self.client.logout()
+        self.assertNotContains(self.client.get(url), 'testuser1')
+
+    @override_settings(CATALOG_VISIT_COUNTER='session')
+    def test_visit_counter_session_does_not_bypass_cache(self):
+        # The home page stores the number of visits in the session.
+        response = self.client.get(reverse('index'))
+        self.assertIn('sessionid', response.cookies)
+
+        url = reverse('books')
+        self.client.get(url)
+        self.assertTrue(self.is_hit(url))
+        # And still counts the visits.
+        self.assertEqual(self.client.get(reverse('index')).context['num_visits'], 1)
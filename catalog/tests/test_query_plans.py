@@ -0,0 +1,152 @@
+import datetime
+import uuid
+from unittest import skipUnless
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Count
+from django.test import TestCase
+from django.utils import timezone
+
+from catalog.models import Book, BookDailyLoans, BookInstance, BookRecommendation, BorrowedPair, Hold, LoanEvent
+
+# Databases whose query plans explain() can read.
+EXPLAIN_VENDORS = ('sqlite', 'postgresql')
+
+
+def explain(queryset):
+    """
+    Returns the query plan of a queryset as a list of lines.
+
+    NOTE: QuerySet.explain() only exists from Django 2.1 on,
+          so we run EXPLAIN on the generated SQL ourselves.
+    NOTE: Only SQLite and PostgreSQL are supported (see EXPLAIN_VENDORS).
+    """
+    sql, params = queryset.query.sql_with_params()
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            # The last column holds the description of each step.
+            return [row[-1] for row in cursor.fetchall()]
+
+        # PostgreSQL: On (small) test tables a sequential scan is always cheaper, so we tell the planner
+        # to avoid it where possible. If it still comes back, no index can be used.
+        cursor.execute('SET LOCAL enable_seqscan = off')
+        cursor.execute('EXPLAIN ' + sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def full_table_scans(plan):
+    """
+    Returns the lines of a query plan that read a whole table (or sort without an index).
+    """
+    scans = []
+    for line in plan:
+        if connection.vendor == 'sqlite':
+            # e.g. 'SCAN TABLE catalog_bookinstance' (or 'SCAN catalog_bookinstance' in newer versions),
+            # but not 'SCAN TABLE catalog_bookinstance USING INDEX ...' (walking an index in order).
+            if line.startswith('SCAN') and 'USING' not in line:
+                scans.append(line)
+            if 'USE TEMP B-TREE FOR ORDER BY' in line:
+                scans.append(line)
+        elif 'Seq Scan' in line:
+            scans.append(line)
+    return scans
+
+
+@skipUnless(connection.vendor in EXPLAIN_VENDORS, 'EXPLAIN output is only checked on SQLite and PostgreSQL.')
+class CirculationQueryPlanTest(TestCase):
+    """
+    Fails if one of the hot catalog queries is answered by a full table scan.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user = User.objects.create_user(username='testuser1', password='12345')
+        test_book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEF')
+
+        for book_copy in range(10):
+            BookInstance.objects.create(
+                book=test_book,
+                imprint='Unlikely Imprint 2016',
+                due_back=datetime.date.today() + datetime.timedelta(days=book_copy),
+                borrower=cls.test_user,
+                status='o' if book_copy % 2 else 'a',
+            )
+
+    def assertUsesIndex(self, queryset):
+        plan = explain(queryset)
+        self.assertEqual(full_table_scans(plan), [], '\n'.join(plan))
+
+    def test_books_on_loan(self):
+        # LoanedBooksListView
+        self.assertUsesIndex(BookInstance.objects.filter(status__exact='o').order_by('due_back'))
+
+    def test_books_on_loan_list_page(self):
+        # LoanedBooksListView, as actually run (joins and overdue filter).
+        queryset = BookInstance.objects.on_loan().for_circulation().with_overdue().order_by('due_back', 'id')
+        self.assertUsesIndex(queryset.overdue()[:20])
+
+    def test_books_on_loan_to_user(self):
+        # LoanedBooksByUserListView
+        self.assertUsesIndex(
+            BookInstance.objects.filter(borrower=self.test_user, status='o').order_by('due_back'))
+
+    def test_next_hold(self):
+        # catalog/holds.py: The oldest waiting hold of a book.
+        book = Book.objects.get()
+        self.assertUsesIndex(Hold.objects.filter(book=book, status=Hold.WAITING)
+                             .order_by('created_at', 'id').values_list('pk', 'patron_id')[:1])
+
+    def test_available_copy_of_book(self):
+        # catalog/holds.py: fill_holds()
+        book = Book.objects.get()
+        self.assertUsesIndex(BookInstance.objects.filter(book=book, status='a').order_by().values('pk')[:1])
+
+    def test_loan_events_in_time_range(self):
+        # catalog/history.py
+        now = timezone.now()
+        self.assertUsesIndex(LoanEvent.objects.between(now - datetime.timedelta(days=1), now))
+
+    def test_loan_history_of_copy(self):
+        self.assertUsesIndex(LoanEvent.objects.of_copy(uuid.uuid4()).order_by('occurred_at'))
+
+    def test_loan_events_of_month(self):
+        # archive_loan_events: A month in chunks, in primary key order.
+        self.assertUsesIndex(LoanEvent.objects.filter(month=202610, id__gt=1000).order_by('id')[:1000])
+
+    def test_rollups_of_day_range(self):
+        # catalog/rollups.py: top() reads the rollup rows of a range of days.
+        today = datetime.date.today()
+        self.assertUsesIndex(BookDailyLoans.objects.filter(day__range=(today - datetime.timedelta(days=30), today)))
+
+    def test_rollups_of_one_book(self):
+        # catalog/rollups.py: series() of one book.
+        today = datetime.date.today()
+        self.assertUsesIndex(BookDailyLoans.objects.filter(
+            book_id=1, day__range=(today - datetime.timedelta(days=30), today)).order_by('day'))
+
+    def test_recommendations_of_book(self):
+        # BookDetailView: "Patrons who borrowed this also borrowed".
+        self.assertUsesIndex(BookRecommendation.objects.filter(book_id=1).select_related('recommended').order_by('rank'))
+
+    def test_pairs_of_borrowers_and_borrowers_of_books(self):
+        # catalog/recommendations.py: An incremental refresh reads the pairs of some borrowers
+        # and counts the borrowers of some books.
+        self.assertUsesIndex(BorrowedPair.objects.filter(borrower_id__in=[1, 2]).values_list('borrower_id', 'book_id'))
+        self.assertUsesIndex(BorrowedPair.objects.filter(book_id__in=[1, 2]).order_by()
+                             .values_list('book_id').annotate(number=Count('pk')))
+
+    def test_default_ordering(self):
+        self.assertUsesIndex(BookInstance.objects.all()[:20])
+
+    def test_book_by_title(self):
+        self.assertUsesIndex(Book.objects.filter(title='Book Title'))
+
+    def test_book_list_page(self):
+        # BookListView (keyset pagination)
+        self.assertUsesIndex(Book.objects.filter(title__gt='Book').order_by('title', 'id')[:21])
+
+    def test_book_by_isbn(self):
+        self.assertUsesIndex(Book.objects.filter(isbn='ABCDEF'))
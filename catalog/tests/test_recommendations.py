@@ -0,0 +1,170 @@
+import datetime
+import random
+from io import StringIO
+from unittest import mock, skipIf
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from catalog import history, recommendations
+from catalog.models import Author, Book, BookInstance, BookRecommendation, LoanEvent, RecommendationState
+
+
+class CoBorrowedTest(TestCase):
+
+    # Borrowers 1 and 2 borrowed books 10 and 20, borrower 3 borrowed 10 and 30,
+    # borrower 4 borrowed 30 only.
+    pairs = [(1, 10), (1, 20), (2, 10), (2, 20), (3, 10), (3, 30), (4, 30)]
+
+    def test_python(self):
+        result = recommendations.co_borrowed_python(self.pairs, {10, 20, 30, 40}, 5)
+        self.assertEqual(result[20], [(10, 2 / 6 ** 0.5, 2)])
+        # 20: 2 / sqrt(3 * 2), 30: 1 / sqrt(3 * 2): More shared borrowers win.
+        self.assertEqual([(other, shared) for other, score, shared in result[10]], [(20, 2), (30, 1)])
+        self.assertEqual(result[40], [])
+
+        self.assertEqual(len(recommendations.co_borrowed_python(self.pairs, {10}, 1)[10]), 1)
+
+    @skipIf(recommendations.sparse is None, 'NumPy and SciPy are not installed.')
+    def test_sparse_gives_the_same_results(self):
+        self.assertEqual(recommendations.co_borrowed_sparse(self.pairs, {10, 20, 30, 40}, 5),
+                         recommendations.co_borrowed_python(self.pairs, {10, 20, 30, 40}, 5))
+
+        generator = random.Random(24)
+        pairs = sorted({(generator.randrange(200), generator.randrange(60)) for i in range(2000)})
+        book_ids = set(range(0, 70, 3))
+        self.assertEqual(recommendations.co_borrowed_sparse(pairs, book_ids, 4, block_size=7),
+                         recommendations.co_borrowed_python(pairs, book_ids, 4))
+
+    def test_fallback_without_scipy(self):
+        with mock.patch.object(recommendations, 'sparse', None):
+            with mock.patch.object(recommendations, 'co_borrowed_python', return_value={}) as fallback:
+                recommendations.co_borrowed(self.pairs, {10}, 5)
+        fallback.assert_called_once_with(self.pairs, {10}, 5, None)
+
+    def test_pairs_of_the_books_borrowers_with_counts(self):
+        # The pairs of the borrowers of book 20 (1 and 2) and the numbers of borrowers of all books
+        # give the same recommendations for 20 as all pairs.
+        pairs  = [(borrower_id, book_id) for borrower_id, book_id in self.pairs if borrower_id in (1, 2)]
+        counts = {10: 3, 20: 2, 30: 2}
+        expected = recommendations.co_borrowed_python(self.pairs, {20}, 5)
+        self.assertEqual(recommendations.co_borrowed_python(pairs, {20}, 5, counts), expected)
+        if recommendations.sparse is not None:
+            self.assertEqual(recommendations.co_borrowed_sparse(pairs, {20}, 5, counts), expected)
+
+
+class RefreshTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        author = Author.objects.create(first_name='First', last_name='Last')
+        self.books = [Book.objects.create(title='Book %d' % number, summary='S', isbn=str(number), author=author)
+                      for number in range(4)]
+
+    def checkout(self, borrower_id, book, minutes_ago=60):
+        occurred_at = timezone.now() - datetime.timedelta(minutes=minutes_ago)
+        return LoanEvent.objects.create(
+            kind=LoanEvent.CHECKOUT, month=history.month_key(occurred_at), occurred_at=occurred_at,
+            copy_id=BookInstance(book=book).pk, book_id=book.pk, borrower_id=borrower_id)
+
+    def recommended(self, book):
+        return list(BookRecommendation.objects.filter(book=book).order_by('rank')
+                    .values_list('recommended__title', flat=True))
+
+    def test_refresh(self):
+        first, second, third, fourth = self.books
+        self.checkout(1, first)
+        self.checkout(1, second)
+        self.checkout(2, third)
+        self.checkout(2, fourth)
+
+        self.assertEqual(recommendations.refresh(), (4, 4))
+        self.assertEqual(self.recommended(first), ['Book 1'])
+        self.assertEqual(self.recommended(third), ['Book 3'])
+
+        # Borrower 2 borrows the first book: Only the books of its borrowers (1 and 2) are recomputed.
+        last = self.checkout(2, first)
+        self.assertEqual(recommendations.refresh(), (4, 4))
+        self.assertEqual(self.recommended(first), ['Book 1', 'Book 2', 'Book 3'])
+        self.assertEqual(RecommendationState.objects.get().last_event_id, last.pk)
+
+        # Nothing new.
+        self.assertEqual(recommendations.refresh(), (0, 0))
+        # Only the changed rows are written.
+        self.assertEqual(recommendations.refresh(full=True), (4, 0))
+
+    def test_incremental_refresh_leaves_other_books_alone(self):
+        first, second, third, fourth = self.books
+        self.checkout(1, first)
+        self.checkout(1, second)
+        self.checkout(2, third)
+        recommendations.refresh()
+
+        self.checkout(2, fourth)
+        with mock.patch.object(recommendations, 'read_pairs', wraps=recommendations.read_pairs) as read_pairs:
+            self.assertEqual(recommendations.refresh(), (2, 2))
+        self.assertEqual(self.recommended(fourth), ['Book 2'])
+        # Only the pairs of borrower 2 are read, not those of all borrowers.
+        self.assertEqual([call[0][0] for call in read_pairs.call_args_list], [{2}, {2}])
+
+        # Borrowing a book again adds no pair: Nothing to compute.
+        self.checkout(2, fourth)
+        self.assertEqual(recommendations.refresh(), (0, 0))
+
+    def test_recent_checkouts_wait_for_the_lag(self):
+        first, second = self.books[:2]
+        self.checkout(1, first)
+        self.checkout(1, second, minutes_ago=0)
+        recommendations.refresh(lag=60)
+        self.assertEqual(self.recommended(first), [])
+
+        recommendations.refresh(lag=0)
+        self.assertEqual(self.recommended(first), ['Book 1'])
+
+    def test_pruned_history_keeps_the_pairs(self):
+        first, second, third = self.books[:3]
+        self.checkout(1, first)
+        self.checkout(1, second)
+        self.checkout(1, third)
+        recommendations.refresh()
+
+        # E.g. prune_loan_events.
+        LoanEvent.objects.all().delete()
+        self.assertEqual(recommendations.refresh(full=True), (3, 0))
+        self.assertEqual(self.recommended(first), ['Book 1', 'Book 2'])
+
+        # The pairs of deleted books are ignored.
+        third.delete()
+        self.assertEqual(recommendations.refresh(full=True), (2, 0))
+        self.assertEqual(self.recommended(first), ['Book 1'])
+
+    def test_detail_page(self):
+        first, second = self.books[:2]
+        self.checkout(1, first)
+        self.checkout(1, second)
+        # Cached before the refresh.
+        response = self.client.get(first.get_absolute_url())
+        self.assertNotContains(response, 'Patrons who borrowed this also borrowed')
+
+        recommendations.refresh()
+        response = self.client.get(first.get_absolute_url())
+        self.assertContains(response, 'Patrons who borrowed this also borrowed')
+        self.assertContains(response, '<a href="%s">Book 1</a>' % second.get_absolute_url(), html=True)
+
+    def test_command(self):
+        self.checkout(1, self.books[0])
+        self.checkout(1, self.books[1])
+        out = StringIO()
+        call_command('refresh_recommendations', size=1, stdout=out)
+        self.assertEqual(out.getvalue(), 'Recommendations of 2 books computed, 2 changed.\n')
+
+        call_command('refresh_recommendations', full=True, stdout=StringIO())
+        self.assertEqual(BookRecommendation.objects.count(), 2)
+
+    def test_command_warns_without_scipy(self):
+        err = StringIO()
+        with mock.patch.object(recommendations, 'sparse', None):
+            call_command('refresh_recommendations', stdout=StringIO(), stderr=err)
+        self.assertIn('computed in pure Python', err.getvalue())
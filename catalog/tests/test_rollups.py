@@ -0,0 +1,147 @@
+import datetime
+from io import StringIO
+
+from django.contrib.auth.models import Permission, User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.utils import timezone
+
+from catalog import history, rollups
+from catalog.models import (Book, BookDailyLoans, BookInstance, Genre, GenreDailyLoans, Language,
+                            LanguageDailyLoans, LoanEvent, LoanRollupState)
+
+
+class RollupTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.english = Language.objects.create(name='English')
+        self.fantasy = Genre.objects.create(name='Fantasy')
+        self.horror  = Genre.objects.create(name='Horror')
+        self.popular = Book.objects.create(title='Popular', summary='S', isbn='1', language=self.english)
+        self.popular.genre.add(self.fantasy, self.horror)
+        self.other   = Book.objects.create(title='Other', summary='S', isbn='2')
+        self.other.genre.add(self.fantasy)
+        self.today   = timezone.localdate()
+
+    def add_event(self, book, kind=LoanEvent.CHECKOUT, days_ago=0, minutes_ago=60):
+        occurred_at = timezone.now() - datetime.timedelta(days=days_ago, minutes=minutes_ago)
+        return LoanEvent.objects.create(
+            kind=kind, month=history.month_key(occurred_at), occurred_at=occurred_at,
+            copy_id=BookInstance(book=book).pk, book_id=book.pk, borrower_id=1)
+
+    def day(self, days_ago=0):
+        return timezone.localdate(timezone.now() - datetime.timedelta(days=days_ago, minutes=60))
+
+    def test_fold_counts_per_day_book_genre_and_language(self):
+        self.add_event(self.popular)
+        self.add_event(self.popular)
+        self.add_event(self.popular, LoanEvent.RENEW)
+        self.add_event(self.popular, days_ago=1)
+        self.add_event(self.other)
+        self.add_event(self.other, LoanEvent.RETURN)  # Not counted.
+
+        self.assertEqual(rollups.fold(), 6)
+
+        self.assertEqual(
+            set(BookDailyLoans.objects.values_list('day', 'book_id', 'checkouts', 'renewals')),
+            {(self.day(), self.popular.pk, 2, 1), (self.day(1), self.popular.pk, 1, 0),
+             (self.day(), self.other.pk, 1, 0)})
+        self.assertEqual(
+            set(GenreDailyLoans.objects.filter(day=self.day()).values_list('genre_id', 'checkouts')),
+            {(self.fantasy.pk, 3), (self.horror.pk, 2)})
+        self.assertEqual(
+            list(LanguageDailyLoans.objects.values_list('language_id', 'checkouts').order_by('day')),
+            [(self.english.pk, 1), (self.english.pk, 2)])
+
+    def test_fold_is_incremental(self):
+        self.add_event(self.popular)
+        rollups.fold()
+        last = self.add_event(self.popular)
+
+        # Only the new event is read and added.
+        self.assertEqual(rollups.fold(chunk_size=1), 1)
+        self.assertEqual(BookDailyLoans.objects.get().checkouts, 2)
+        self.assertEqual(LoanRollupState.objects.get().last_event_id, last.pk)
+        self.assertEqual(rollups.fold(), 0)
+
+    def test_recent_events_wait_for_the_lag(self):
+        self.add_event(self.popular)
+        recent = self.add_event(self.popular, minutes_ago=0)
+        self.add_event(self.popular)
+
+        self.assertEqual(rollups.fold(lag=60), 1)
+        self.assertEqual(LoanRollupState.objects.get().last_event_id, recent.pk - 1)
+        self.assertEqual(rollups.fold(lag=0), 2)
+
+    def test_report(self):
+        for count in range(3):
+            self.add_event(self.popular)
+        self.add_event(self.other, days_ago=2)
+        rollups.fold()
+
+        report = rollups.get_report(rollups.BOOK, 7, 10)
+        self.assertEqual([(ranked.name, ranked.checkouts) for ranked in report.top], [('Popular', 3), ('Other', 1)])
+        self.assertEqual(len(report.series), 7)
+        self.assertEqual(report.series[-1].day, self.today)
+        self.assertEqual(sum(day.checkouts for day in report.series), 4)
+
+        series = rollups.get_report(rollups.GENRE, 7, 1, key=self.horror.pk).series
+        self.assertEqual(sum(day.checkouts for day in series), 3)
+
+        # Cached: Only the watermark is read.
+        with self.assertNumQueries(1):
+            rollups.get_report(rollups.BOOK, 7, 10)
+        # Until the next fold.
+        self.add_event(self.other)
+        rollups.fold()
+        report = rollups.get_report(rollups.BOOK, 7, 10)
+        self.assertEqual([ranked.checkouts for ranked in report.top], [3, 2])
+
+    def test_rebuild_command(self):
+        self.add_event(self.popular)
+        out = StringIO()
+        call_command('rollup_loans', stdout=out)
+        self.assertEqual(out.getvalue(), '1 events folded into the daily rollups.\n')
+
+        call_command('rollup_loans', rebuild=True, stdout=StringIO())
+        self.assertEqual(BookDailyLoans.objects.get().checkouts, 1)
+
+
+class CirculationReportViewTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        librarian = User.objects.create_user(username='librarian', password='12345')
+        librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+        User.objects.create_user(username='patron', password='12345')
+        self.book = Book.objects.create(title='Popular', summary='S', isbn='1')
+        occurred_at = timezone.now() - datetime.timedelta(hours=1)
+        LoanEvent.objects.create(kind=LoanEvent.CHECKOUT, month=history.month_key(occurred_at),
+                                 occurred_at=occurred_at, copy_id=BookInstance(book=self.book).pk,
+                                 book_id=self.book.pk)
+        rollups.fold()
+
+    def test_librarians_only(self):
+        self.client.login(username='patron', password='12345')
+        response = self.client.get(reverse('circulation-report'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_report(self):
+        self.client.login(username='librarian', password='12345')
+        response = self.client.get(reverse('circulation-report'), {'days': 7})
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'catalog/circulation_report.html')
+        self.assertEqual(len(response.context['report'].series), 7)
+        self.assertContains(response, '>Popular</a>')
+
+        response = self.client.get(reverse('circulation-report'), {'by': 'book', 'id': self.book.pk})
+        self.assertEqual(response.context['selected'], 'Popular')
+
+    def test_invalid_options_use_defaults(self):
+        self.client.login(username='librarian', password='12345')
+        response = self.client.get(reverse('circulation-report'), {'by': 'author', 'days': 'many'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.context['report'].kind, response.context['days']), ('book', 30))
@@ -1,14 +1,27 @@
 import datetime
+import uuid
 from typing import *
+from unittest import mock
 
 # Required to grant the permission needed to set a book as returned.
 # Required to assign User as a borrower.
-from django.contrib.auth.models import Permission, User
+from django.contrib.auth.models import Group, Permission, User
 from django.core.urlresolvers import reverse
-from django.test import TestCase
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
-from catalog.models import Author, Book, BookInstance, Genre, Language
+from catalog import circulation, facets, fragments, permissions, stats
+from catalog.models import Author, Book, BookInstance, Genre, Hold, Language
+
+# These tests check how the views render the pages, which a page cached for an anonymous
+# visitor by an earlier test would skip (see catalog/pagecache.py and catalog/tests/test_pagecache.py).
+without_page_cache = override_settings(CATALOG_PAGE_CACHE_TIMEOUTS=())
 
 
 # Create your tests here.
@@ -55,6 +68,113 @@ class YourTestClass(TestCase):
 
 
 
+class IndexViewTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        test_author = Author.objects.create(first_name='John', last_name='Smith')
+        Genre.objects.create(name='Fantasy')
+        test_book = Book.objects.create(
+            title='Learning Python', summary='My book summary', isbn='ABCDEFG', author=test_author)
+        BookInstance.objects.create(book=test_book, imprint='Unlikely Imprint 2016', status='a')
+        BookInstance.objects.create(book=test_book, imprint='Unlikely Imprint 2016', status='d')
+
+    def test_counts(self):
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(response.context['num_books'], 1)
+        self.assertEqual(response.context['num_instances'], 2)
+        self.assertEqual(response.context['num_instances_available'], 1)
+        self.assertEqual(response.context['num_authors'], 1)
+        self.assertEqual(response.context['num_genres'], 1)
+        self.assertEqual(response.context['num_python_books'], 1)
+
+    def test_counts_are_exact_after_change(self):
+        self.client.get(reverse('index'))
+        Book.objects.create(title='Python Cookbook', summary='Recipes', isbn='1234567')
+
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.context['num_books'], 2)
+        self.assertEqual(response.context['num_python_books'], 2)
+
+    def test_changes_adjust_the_counts_without_recounting(self):
+        stats.get_statistics()
+        copy = BookInstance.objects.get(status='a')
+        borrower = User.objects.create_user(username='borrower')
+
+        with CaptureQueriesContext(connection) as context:
+            circulation.checkout(copy.pk, borrower, datetime.date.today())
+            book = Book.objects.get()
+            book.title = 'Learning Ruby'
+            book.save()
+            Genre.objects.create(name='Horror')
+        self.assertEqual(len([query for query in context.captured_queries
+                              if 'catalog_catalogstatistics' in query['sql']]), 3)
+
+        # The counts are up to date: Read with one query (no COUNT).
+        with self.assertNumQueries(1):
+            statistics = stats.get_statistics()
+        self.assertEqual(
+            (statistics.num_instances, statistics.num_instances_available,
+             statistics.num_python_books, statistics.num_genres), (2, 0, 0, 2))
+
+    def test_renewal_does_not_touch_the_statistics(self):
+        stats.get_statistics()
+        copy = BookInstance.objects.get(status='a')
+        circulation.checkout(copy.pk, User.objects.create_user(username='borrower'), datetime.date.today())
+
+        with CaptureQueriesContext(connection) as context:
+            circulation.renew_copy(copy.pk, datetime.date.today() + datetime.timedelta(weeks=1))
+            BookInstance.objects.get(status='d').save()
+        self.assertFalse([query for query in context.captured_queries
+                          if 'catalog_catalogstatistics' in query['sql']])
+
+    @override_settings(CATALOG_VISIT_COUNTER='cookie')
+    def test_visits_counted_without_database_write(self):
+        stats.get_statistics()
+
+        for visit in range(3):
+            # The statistics row only.
+            with self.assertNumQueries(1):
+                response = self.client.get(reverse('index'))
+            self.assertEqual(response.context['num_visits'], visit)
+        self.assertNotIn('sessionid', self.client.cookies)
+
+    @override_settings(CATALOG_VISIT_COUNTER='cookie')
+    def test_forged_visit_cookie_is_ignored(self):
+        self.client.cookies['num_visits'] = '1000'
+        self.assertEqual(self.client.get(reverse('index')).context['num_visits'], 0)
+
+    @override_settings(CATALOG_VISIT_COUNTER='session')
+    def test_visits_counted_in_session(self):
+        self.client.get(reverse('index'))
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.context['num_visits'], 1)
+        self.assertEqual(self.client.session['num_visits'], 2)
+
+    def test_statistics_are_read_with_one_query(self):
+        # Warm up (computes and stores the counts).
+        stats.get_statistics()
+
+        with self.assertNumQueries(1):
+            stats.get_statistics()
+
+    @override_settings(CATALOG_STATS_CONSISTENCY=3600)
+    def test_counts_may_be_stale_in_staleness_mode(self):
+        self.client.get(reverse('index'))
+        Book.objects.create(title='Python Cookbook', summary='Recipes', isbn='1234567')
+
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.context['num_books'], 1)
+
+        # The management command rebuilds the counts from scratch.
+        call_command('rebuild_catalog_stats', stdout=StringIO())
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.context['num_books'], 2)
+
+
+@without_page_cache
 class AuthorListViewTest(TestCase):
 
     @classmethod
@@ -107,6 +227,378 @@ class AuthorListViewTest(TestCase):
         self.assertEqual(len(response.context['author_list']), 3)
 
 
+@without_page_cache
+class BookListViewTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        # Create 25 books for pagination tests (20 per page).
+        for book_num in range(25):
+            Book.objects.create(title='Book %02d' % book_num, summary='My book summary', isbn='ABCDEFG')
+
+    def test_first_page_is_ordered_by_title(self):
+        response = self.client.get(reverse('books'))
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(response.context['is_paginated'], True)
+        titles = [book.title for book in response.context['my_book_list']]
+        self.assertEqual(titles, ['Book %02d' % book_num for book_num in range(20)])
+        self.assertFalse(response.context['page_obj'].has_previous())
+
+    def test_next_and_previous_cursor(self):
+        response = self.client.get(reverse('books'))
+        next_query = response.context['page_obj'].next_query
+
+        response = self.client.get(reverse('books') + '?' + next_query)
+        self.assertEqual(response.status_code, 200)
+        titles = [book.title for book in response.context['my_book_list']]
+        self.assertEqual(titles, ['Book %02d' % book_num for book_num in range(20, 25)])
+        self.assertFalse(response.context['page_obj'].has_next())
+
+        # Go back to the first page.
+        previous_query = response.context['page_obj'].previous_query
+        response = self.client.get(reverse('books') + '?' + previous_query)
+        self.assertEqual(len(response.context['my_book_list']), 20)
+        self.assertEqual(response.context['my_book_list'][0].title, 'Book 00')
+
+    def test_pages_do_not_count_rows(self):
+        response = self.client.get(reverse('books'))
+        next_query = response.context['page_obj'].next_query
+
+        # One query for the page rows (no COUNT(*), no OFFSET).
+        with self.assertNumQueries(1):
+            self.client.get(reverse('books') + '?' + next_query)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('books') + '?cursor=invalid')
+        self.assertEqual(response.status_code, 404)
+
+
+@without_page_cache
+class BookListFacetTest(TestCase):
+
+    def setUp(self):
+        self.fantasy = Genre.objects.create(name='Fantasy')
+        self.poetry  = Genre.objects.create(name='Poetry')
+        self.english = Language.objects.create(name='English')
+        self.author  = Author.objects.create(first_name='John', last_name='Smith')
+
+        self.book1 = Book.objects.create(
+            title='Book 1', summary='My book summary', isbn='ABCDEFG', author=self.author, language=self.english)
+        self.book1.genre = [self.fantasy, self.poetry]
+        self.book2 = Book.objects.create(title='Book 2', summary='My book summary', isbn='ABCDEFG')
+        self.book2.genre = [self.fantasy]
+
+        self.copy = BookInstance.objects.create(book=self.book1, imprint='Unlikely Imprint 2016', status='d')
+
+    def get_counts(self, response):
+        return dict(
+            ((facet.name, value.label), value.count)
+            for facet in response.context['facets'] for value in facet.values)
+
+    def test_facet_counts(self):
+        counts = self.get_counts(self.client.get(reverse('books')))
+
+        self.assertEqual(counts[('genre', 'Fantasy')], 2)
+        self.assertEqual(counts[('genre', 'Poetry')], 1)
+        self.assertEqual(counts[('language', 'English')], 1)
+        self.assertEqual(counts[('author', 'Smith, John')], 1)
+        self.assertEqual(counts[('available', 'Available now')], 0)
+
+    def test_filter_by_genre(self):
+        response = self.client.get(reverse('books'), {'genre': self.poetry.pk})
+        self.assertEqual(list(response.context['my_book_list']), [self.book1])
+
+        # Counts of the other facets are restricted to the selected genre.
+        counts = self.get_counts(response)
+        self.assertEqual(counts[('genre', 'Fantasy')], 2)
+        self.assertEqual(counts[('language', 'English')], 1)
+
+    def test_counts_are_cached(self):
+        self.client.get(reverse('books'))
+        with CaptureQueriesContext(connection) as cold:
+            facets.compute_counts({})
+        with CaptureQueriesContext(connection) as warm:
+            self.client.get(reverse('books'))
+        # Only the page itself is loaded, none of the facet queries is run.
+        self.assertEqual(len(warm), 1)
+        self.assertGreater(len(cold), 1)
+
+    def test_counts_invalidated_on_copy_status_change(self):
+        self.client.get(reverse('books'))
+
+        self.copy.status = 'a'
+        self.copy.save()
+
+        response = self.client.get(reverse('books'), {'available': 1})
+        self.assertEqual(list(response.context['my_book_list']), [self.book1])
+        self.assertEqual(self.get_counts(response)[('available', 'Available now')], 1)
+
+    def test_counts_invalidated_on_genre_change(self):
+        self.client.get(reverse('books'))
+        self.book2.genre.add(self.poetry)
+
+        counts = self.get_counts(self.client.get(reverse('books')))
+        self.assertEqual(counts[('genre', 'Poetry')], 2)
+
+
+@without_page_cache
+class CatalogPagesQueryCountTest(TestCase):
+    """
+    The list and detail pages must run a constant number of queries,
+    no matter how many books, genres and copies they show.
+    """
+
+    def setUp(self):
+        self.test_author   = Author.objects.create(first_name='John', last_name='Smith')
+        self.test_language = Language.objects.create(name='English')
+        Genre.objects.create(name='Fantasy')
+        Genre.objects.create(name='Poetry')
+
+    def add_books(self, number_of_books):
+        for book_num in range(number_of_books):
+            book = Book.objects.create(
+                title='Book Title', summary='My book summary', isbn='ABCDEFG',
+                author=self.test_author, language=self.test_language)
+            book.genre = Genre.objects.all()
+            for copy_num in range(2):
+                BookInstance.objects.create(book=book, imprint='Unlikely Imprint 2016', status='a')
+        return book
+
+    def count_queries(self, url):
+        # Measure with empty caches (cached fragments would save queries, see FragmentCacheTest).
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    def test_book_list(self):
+        self.add_books(2)
+        few = self.count_queries(reverse('books'))
+        self.add_books(10)
+        self.assertEqual(self.count_queries(reverse('books')), few)
+
+    def test_book_detail(self):
+        book = self.add_books(1)
+        few = self.count_queries(book.get_absolute_url())
+        for copy_num in range(10):
+            BookInstance.objects.create(book=book, imprint='Unlikely Imprint 2016', status='o')
+        self.assertEqual(self.count_queries(book.get_absolute_url()), few)
+
+    def test_author_detail(self):
+        self.add_books(2)
+        few = self.count_queries(self.test_author.get_absolute_url())
+        self.add_books(10)
+        self.assertEqual(self.count_queries(self.test_author.get_absolute_url()), few)
+
+    def test_author_detail_shows_copy_count(self):
+        self.add_books(1)
+        response = self.client.get(self.test_author.get_absolute_url())
+        self.assertContains(response, '(2 in library)')
+
+
+@without_page_cache
+class FragmentCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.test_author = Author.objects.create(first_name='John', last_name='Smith')
+        self.test_genre  = Genre.objects.create(name='Fantasy')
+        self.test_book   = Book.objects.create(
+            title='Book Title', summary='My book summary', isbn='ABCDEFG', author=self.test_author)
+        self.test_book.genre.add(self.test_genre)
+        self.test_copy = BookInstance.objects.create(
+            book=self.test_book, imprint='Unlikely Imprint 2016', status='a')
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    def test_cached_fragments_save_queries(self):
+        url  = self.test_book.get_absolute_url()
+        cold = self.count_queries(url)
+        # Genres and copies are not loaded again.
+        self.assertEqual(self.count_queries(url), cold - 2)
+
+        counters = fragments.get_counters()
+        self.assertEqual(counters[fragments.BOOK], {'hits': 1, 'misses': 1})
+        self.assertEqual(counters[fragments.COPIES], {'hits': 1, 'misses': 1})
+
+    def test_copy_change_only_invalidates_copies(self):
+        url = self.test_book.get_absolute_url()
+        self.client.get(url)
+
+        self.test_copy.status = 'o'
+        self.test_copy.due_back = datetime.date.today()
+        self.test_copy.save()
+
+        response = self.client.get(url)
+        self.assertContains(response, 'On loan')
+        counters = fragments.get_counters()
+        self.assertEqual(counters[fragments.BOOK]['hits'], 1)
+        self.assertEqual(counters[fragments.COPIES]['misses'], 2)
+
+    def test_changes_show_up_on_detail_pages(self):
+        book_url, author_url = self.test_book.get_absolute_url(), self.test_author.get_absolute_url()
+        self.client.get(book_url)
+        self.client.get(author_url)
+
+        # Changes of the book, the genre (m2m and name) and the author's name.
+        self.test_book.title = 'New Title'
+        self.test_book.save()
+        self.test_genre.name = 'Science Fiction'
+        self.test_genre.save()
+        self.test_book.genre.add(Genre.objects.create(name='Poetry'))
+        self.test_author.first_name = 'Jane'
+        self.test_author.save()
+        BookInstance.objects.create(book=self.test_book, imprint='Unlikely Imprint 2016', status='a')
+
+        response = self.client.get(book_url)
+        self.assertContains(response, 'New Title')
+        self.assertContains(response, 'Science Fiction')
+        self.assertContains(response, 'Poetry')
+        self.assertContains(response, 'Smith, Jane')
+
+        response = self.client.get(author_url)
+        self.assertContains(response, 'New Title')
+        self.assertContains(response, 'Science Fiction, Poetry')
+        self.assertContains(response, '(2 in library)')
+
+    def test_moving_book_to_other_author(self):
+        other_author = Author.objects.create(first_name='Mark', last_name='Lutz')
+        self.client.get(self.test_author.get_absolute_url())
+        self.client.get(other_author.get_absolute_url())
+
+        book = Book.objects.get(pk=self.test_book.pk)
+        book.author = other_author
+        book.save()
+
+        self.assertNotContains(self.client.get(self.test_author.get_absolute_url()), 'Book Title')
+        self.assertContains(self.client.get(other_author.get_absolute_url()), 'Book Title')
+
+    def test_stats_view(self):
+        self.client.get(self.test_book.get_absolute_url())
+        User.objects.create_user(username='staff', password='12345', is_staff=True)
+        self.client.login(username='staff', password='12345')
+
+        response = self.client.get(reverse('fragment-stats'))
+        self.assertEqual(response.json()['book'], {'hits': 0, 'misses': 1, 'hit_rate': 0.0})
+
+
+@without_page_cache
+class ConditionalGetTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.test_author = Author.objects.create(first_name='John', last_name='Smith')
+        self.test_book   = Book.objects.create(
+            title='Book Title', summary='My book summary', isbn='ABCDEFG', author=self.test_author)
+        self.test_copy   = BookInstance.objects.create(
+            book=self.test_book, imprint='Unlikely Imprint 2016', status='a')
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_unchanged_detail_page_is_not_rendered(self):
+        url = self.test_book.get_absolute_url()
+        response = self.client.get(url)
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        # Only the updated_at lookup, no template.
+        with self.assertNumQueries(1):
+            revalidated = self.revalidate(url, response)
+        self.assertEqual(revalidated.status_code, 304)
+
+    def test_related_changes_update_detail_pages(self):
+        book_url, author_url = self.test_book.get_absolute_url(), self.test_author.get_absolute_url()
+        book_page, author_page = self.client.get(book_url), self.client.get(author_url)
+
+        # A copy is lent: The book page changes, the author page (copy count) does not.
+        self.test_copy.status = 'o'
+        self.test_copy.save()
+        self.assertEqual(self.revalidate(book_url, book_page).status_code, 200)
+        self.assertEqual(self.revalidate(author_url, author_page).status_code, 304)
+
+        # The author is renamed: Both pages change.
+        book_page = self.client.get(book_url)
+        self.test_author.first_name = 'Jane'
+        self.test_author.save()
+        self.assertEqual(self.revalidate(book_url, book_page).status_code, 200)
+        self.assertEqual(self.revalidate(author_url, author_page).status_code, 200)
+
+    def test_list_page(self):
+        url = reverse('books')
+        response = self.client.get(url)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.revalidate(url, response).status_code, 304)
+
+        Book.objects.create(title='Another Book', summary='My book summary', isbn='ABCDEFH')
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_etag_depends_on_user(self):
+        url = self.test_book.get_absolute_url()
+        response = self.client.get(url)
+
+        User.objects.create_user(username='testuser1', password='12345')
+        self.client.login(username='testuser1', password='12345')
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+
+@without_page_cache
+class SearchViewTest(TestCase):
+
+    def setUp(self):
+        self.test_author = Author.objects.create(first_name='Mark', last_name='Lutz')
+        self.python_book = Book.objects.create(
+            title='Learning Python', summary='A beginner book.', isbn='9781449355739', author=self.test_author)
+        self.other_book = Book.objects.create(
+            title='Programming', summary='Covers Python and other languages.', isbn='1234567890123')
+
+    def search(self, query):
+        response = self.client.get(reverse('search'), {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [(result.kind, result.object.pk) for result in response.context['results']]
+
+    def test_view_uses_correct_template(self):
+        response = self.client.get(reverse('search'), {'q': 'python'})
+        self.assertTemplateUsed(response, 'catalog/search_results.html')
+
+    def test_title_matches_rank_first(self):
+        self.assertEqual(self.search('python'), [('book', self.python_book.pk), ('book', self.other_book.pk)])
+
+    def test_search_isbn_and_prefix(self):
+        self.assertEqual(self.search('9781449355739'), [('book', self.python_book.pk)])
+        self.assertEqual(self.search('begin'), [('book', self.python_book.pk)])
+
+    def test_search_author(self):
+        self.assertIn(('author', self.test_author.pk), self.search('lutz'))
+        # The author's name is part of the book's document.
+        self.assertIn(('book', self.python_book.pk), self.search('lutz'))
+
+    def test_special_characters_are_ignored(self):
+        self.assertEqual(self.search('"python* OR'), [])
+        self.assertEqual(self.search('!!!'), [])
+
+    def test_index_follows_changes(self):
+        self.test_author.last_name = 'Smith'
+        self.test_author.save()
+        self.assertEqual(self.search('lutz'), [])
+        self.assertIn(('book', self.python_book.pk), self.search('smith'))
+
+        self.python_book.delete()
+        self.assertEqual(self.search('learning'), [])
+
+    def test_rebuild_command(self):
+        # Bulk changes bypass the signals, the command brings the index up to date.
+        Book.objects.filter(pk=self.other_book.pk).update(title='Cooking')
+        call_command('rebuild_search_index', batch_size=1, stdout=StringIO())
+        self.assertEqual(self.search('cooking'), [('book', self.other_book.pk)])
+
+
 # Views that are restricted to logged in users
 # ======================================================
 class LoanedBookInstancesByUserListViewTest(TestCase):
@@ -249,6 +741,187 @@ class LoanedBookInstancesByUserListViewTest(TestCase):
 
 
 
+class LoanedBooksListViewTest(TestCase):
+
+    def setUp(self):
+        self.librarian = User.objects.create_user(username='librarian', password='12345')
+        permission = Permission.objects.get(codename='can_mark_returned')
+        self.librarian.user_permissions.add(permission)
+
+        test_user1 = User.objects.create_user(username='testuser1', password='12345')
+        test_user2 = User.objects.create_user(username='testuser2', password='12345')
+
+        test_book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEF')
+
+        # Create 30 loans: Due back between 5 days ago and 24 days from now.
+        for book_copy in range(30):
+            BookInstance.objects.create(
+                book=test_book,
+                imprint='Unlikely Imprint 2016',
+                due_back=datetime.date.today() + datetime.timedelta(days=book_copy - 5),
+                borrower=test_user1 if book_copy % 2 else test_user2,
+                status='o',
+            )
+        # A copy that is not on loan.
+        BookInstance.objects.create(book=test_book, imprint='Unlikely Imprint 2016', status='a')
+
+        self.client.login(username='librarian', password='12345')
+
+    def test_pagination_is_twenty(self):
+        response = self.client.get(reverse('borrowed'))
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(response.context['is_paginated'], True)
+        self.assertEqual(len(response.context['bookinstance_list']), 20)
+
+        response = self.client.get(reverse('borrowed') + '?page=2')
+        self.assertEqual(len(response.context['bookinstance_list']), 10)
+
+    def test_overdue_flag_is_computed_by_database(self):
+        response = self.client.get(reverse('borrowed'))
+
+        for copy in response.context['bookinstance_list']:
+            self.assertEqual(copy.overdue, copy.due_back < datetime.date.today())
+
+    def test_filter_overdue(self):
+        response = self.client.get(reverse('borrowed') + '?overdue=on')
+        self.assertEqual(len(response.context['bookinstance_list']), 5)
+
+    def test_filter_due_within(self):
+        response = self.client.get(reverse('borrowed') + '?due_within=3')
+        # Due today, and 1, 2 or 3 days from now.
+        self.assertEqual(len(response.context['bookinstance_list']), 4)
+
+    def test_filter_borrower(self):
+        response = self.client.get(reverse('borrowed') + '?borrower=testuser1')
+        self.assertEqual(response.context['page_obj'].paginator.count, 15)
+        for copy in response.context['bookinstance_list']:
+            self.assertEqual(copy.borrower.username, 'testuser1')
+
+    def test_page_links_keep_filters(self):
+        response = self.client.get(reverse('borrowed') + '?due_within=30')
+        self.assertIn('due_within=30', response.context['page_obj'].next_query)
+
+    def test_constant_number_of_queries(self):
+        # Both requests with empty caches (the second would not load the cached permissions again).
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(reverse('borrowed'))
+        few = len(context)
+
+        test_book = Book.objects.get()
+        for book_copy in range(10):
+            BookInstance.objects.create(
+                book=test_book, imprint='Unlikely Imprint 2016', due_back=datetime.date.today(),
+                borrower=User.objects.create_user(username='borrower%d' % book_copy), status='o')
+
+        cache.clear()
+        with self.assertNumQueries(few):
+            self.client.get(reverse('borrowed'))
+
+
+class BulkCirculationViewTest(TestCase):
+
+    def setUp(self):
+        librarian = User.objects.create_user(username='librarian', password='12345')
+        librarian.user_permissions.add(
+            Permission.objects.get(codename='can_mark_returned'), Permission.objects.get(codename='can_renew'))
+        self.borrower = User.objects.create_user(username='testuser1', password='12345')
+
+        test_book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEF')
+        self.loans = [
+            BookInstance.objects.create(
+                book=test_book, imprint='Unlikely Imprint 2016', due_back=datetime.date.today(),
+                borrower=self.borrower, status='o')
+            for book_copy in range(30)
+        ]
+        self.available = BookInstance.objects.create(book=test_book, imprint='Unlikely Imprint 2016', status='a')
+
+        self.client.login(username='librarian', password='12345')
+
+    def post(self, copies, **data):
+        data.setdefault('action', 'renew')
+        return self.client.post(reverse('bulk-circulation'), dict(data, copies=[str(pk) for pk in copies]))
+
+    def test_renew_many_copies_with_one_update(self):
+        renewal_date = datetime.date.today() + datetime.timedelta(weeks=2)
+        copies = [copy.pk for copy in self.loans]
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.post(copies, renewal_date=renewal_date)
+        updates = [query for query in context.captured_queries
+                   if query['sql'].startswith('UPDATE "catalog_bookinstance"')]
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(BookInstance.objects.filter(due_back=renewal_date).count(), 30)
+        self.assertEqual([result.outcome for result in response.context['outcomes']], ['renewed'] * 30)
+
+    def test_reports_outcome_per_copy(self):
+        unknown = uuid.uuid4()
+        response = self.post([self.loans[0].pk, self.available.pk, unknown], action='return')
+
+        self.assertEqual(
+            [(result.id, result.outcome) for result in response.context['outcomes']],
+            [(self.loans[0].pk, 'returned'), (self.available.pk, 'not on loan'), (unknown, 'not found')])
+        returned = BookInstance.objects.get(pk=self.loans[0].pk)
+        self.assertEqual((returned.status, returned.borrower, returned.due_back), ('a', None, None))
+
+    def test_renewal_date_is_validated_once(self):
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        response  = self.post([copy.pk for copy in self.loans], renewal_date=yesterday)
+
+        self.assertFormError(response, 'form', 'renewal_date', 'Invalid date - Renewal in the past')
+        self.assertIsNone(response.context['outcomes'])
+        self.assertEqual(BookInstance.objects.filter(due_back=datetime.date.today()).count(), 30)
+
+    def test_renewal_date_required_for_renewal_only(self):
+        response = self.post([self.loans[0].pk])
+        self.assertFormError(response, 'form', 'renewal_date', 'Enter the renewal date.')
+
+        response = self.post([self.loans[0].pk], action='return')
+        self.assertEqual(response.context['outcomes'][0].outcome, 'returned')
+
+    def test_copy_ids_from_text_area(self):
+        response = self.client.post(reverse('bulk-circulation'), {
+            'action': 'return', 'copies': '%s\n%s\n' % (self.loans[0].pk, self.loans[1].pk)})
+        self.assertEqual(len(response.context['outcomes']), 2)
+
+        response = self.client.post(reverse('bulk-circulation'), {'action': 'return', 'copies': 'not-a-uuid'})
+        self.assertFormError(response, 'form', 'copies', 'Invalid copy id: not-a-uuid')
+
+
+class ExportViewTest(TestCase):
+
+    def setUp(self):
+        librarian = User.objects.create_user(username='librarian', password='12345')
+        librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+        User.objects.create_user(username='testuser1', password='12345')
+
+        test_author = Author.objects.create(first_name='John', last_name='Smith')
+        Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEF', author=test_author)
+
+    def test_redirect_if_not_permitted(self):
+        self.client.login(username='testuser1', password='12345')
+        response = self.client.get(reverse('export', kwargs={'kind': 'book', 'format': 'csv'}))
+        self.assertEqual(response.status_code, 302)
+
+    def test_streams_export(self):
+        self.client.login(username='librarian', password='12345')
+        response = self.client.get(reverse('export', kwargs={'kind': 'book', 'format': 'jsonl'}))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="book.jsonl"')
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertIn('"author": "Smith, John"', content)
+
+    def test_unknown_export(self):
+        self.client.login(username='librarian', password='12345')
+        response = self.client.get(reverse('export', kwargs={'kind': 'user', 'format': 'csv'}))
+        self.assertEqual(response.status_code, 404)
+
+
 class RenewBookInstanceViewTest(TestCase):
 
     # We create two users and two book instances,
@@ -558,3 +1231,240 @@ class AuthorCreateViewTest(TestCase):
 
 
 
+
+
+class PermissionCacheTest(TestCase):
+    """
+    The permissions of a user are cached between requests (catalog/backends.py, catalog/permissions.py).
+    """
+
+    PERMISSION_TABLES = ('"auth_permission"', '"auth_group"', '"auth_user_groups"', '"auth_user_user_permissions"')
+
+    def setUp(self):
+        cache.clear()
+        self.librarians = Group.objects.create(name='Librarians')
+        self.librarians.permissions.add(Permission.objects.get(codename='can_mark_returned'))
+        self.user = User.objects.create_user(username='librarian', password='12345')
+        self.user.groups.add(self.librarians)
+        self.user.user_permissions.add(Permission.objects.get(codename='can_renew'))
+        self.client.login(username='librarian', password='12345')
+
+    def get_index(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('index'))
+        permission_queries = [query['sql'] for query in context.captured_queries
+                              if any(table in query['sql'] for table in self.PERMISSION_TABLES)]
+        return response, permission_queries
+
+    def test_sidebar_without_permission_queries_on_warm_cache(self):
+        response, permission_queries = self.get_index()
+        self.assertContains(response, 'Books on loan')
+        self.assertTrue(permission_queries)
+
+        response, permission_queries = self.get_index()
+        self.assertContains(response, 'Books on loan')
+        self.assertEqual(permission_queries, [])
+
+    def test_group_permission_change_invalidates(self):
+        self.get_index()
+        self.librarians.permissions.clear()
+
+        response, permission_queries = self.get_index()
+        self.assertNotContains(response, 'Books on loan')
+        self.assertTrue(permission_queries)
+
+    def test_user_group_change_invalidates(self):
+        self.get_index()
+        self.user.groups.remove(self.librarians)
+        self.assertNotContains(self.client.get(reverse('index')), 'Books on loan')
+
+        self.librarians.user_set.add(self.user)
+        self.assertContains(self.client.get(reverse('index')), 'Books on loan')
+
+    def test_user_permission_change_invalidates(self):
+        self.assertTrue(User.objects.get(pk=self.user.pk).has_perm('catalog.can_renew'))
+        self.user.user_permissions.clear()
+        self.assertFalse(User.objects.get(pk=self.user.pk).has_perm('catalog.can_renew'))
+
+    def test_rolled_back_user_does_not_pass_its_permissions_on(self):
+        try:
+            with transaction.atomic():
+                user = User.objects.create_user(username='temporary')
+                user.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+                self.assertTrue(User.objects.get(pk=user.pk).has_perm('catalog.can_mark_returned'))
+                raise DatabaseError('Rolled back.')
+        except DatabaseError:
+            pass
+        # NOTE: On SQLite, the new user gets the same pk.
+        new_user = User.objects.create_user(username='new')
+        self.assertFalse(User.objects.get(pk=new_user.pk).has_perm('catalog.can_mark_returned'))
+
+    def test_bumped_again_on_commit(self):
+        with mock.patch.object(transaction, 'on_commit') as on_commit:
+            self.user.user_permissions.clear()
+        bump = on_commit.call_args[0][0]
+        self.assertTrue(User.objects.get(pk=self.user.pk).has_perm('catalog.can_mark_returned'))
+        key = permissions.permissions_key(self.user.pk)
+        bump()
+        self.assertNotEqual(permissions.permissions_key(self.user.pk), key)
+
+
+class AutocompleteTest(TestCase):
+
+    def setUp(self):
+        self.smith  = Author.objects.create(first_name='John', last_name='Smith')
+        self.other  = Author.objects.create(first_name='Jane', last_name='Austen')
+        self.genres = [Genre.objects.create(name=name) for name in ('Fantasy', 'Fairy tales', 'Horror')]
+        self.book   = Book.objects.create(title='Book Title', summary='Summary', isbn='ABCDEF', author=self.smith)
+        self.book.genre.add(self.genres[0])
+
+        user = User.objects.create_user(username='librarian', password='12345')
+        user.user_permissions.add(Permission.objects.get(codename='can_renew'))
+        self.client.login(username='librarian', password='12345')
+
+    def complete(self, kind, query):
+        response = self.client.get(reverse('autocomplete', args=[kind]), {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [result['text'] for result in response.json()['results']]
+
+    def test_authors_by_name_prefix(self):
+        self.assertEqual(self.complete('author', 'smi'), ['Smith, John'])
+        self.assertEqual(self.complete('author', ''), [])
+
+    def test_genres_by_name_prefix(self):
+        self.assertEqual(self.complete('genre', 'fa'), ['Fairy tales', 'Fantasy'])
+
+    def test_books(self):
+        self.assertEqual(self.complete('book', 'Book'), ['Book Title'])
+
+    def test_unknown_kind(self):
+        self.assertEqual(self.client.get(reverse('autocomplete', args=['user'])).status_code, 404)
+
+    def test_book_form_renders_only_selected_values(self):
+        response = self.client.get(reverse('book_update', args=[self.book.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'data-autocomplete-url="%s"' % reverse('autocomplete', args=['author']))
+        self.assertContains(response, 'js/autocomplete.js')
+        # Only the book's author and genre are options.
+        self.assertContains(response, '<option value="%d" selected>Smith, John</option>' % self.smith.pk, html=True)
+        self.assertNotContains(response, 'Austen')
+        self.assertContains(response, 'Fantasy')
+        self.assertNotContains(response, 'Horror')
+
+    def test_book_form_saves_selected_values(self):
+        response = self.client.post(reverse('book_update', args=[self.book.pk]), {
+            'title': 'New Title', 'summary': 'Summary', 'isbn': 'ABCDEF',
+            'author': self.other.pk, 'genre': [self.genres[1].pk, self.genres[2].pk],
+            'language': Language.objects.create(name='English').pk,
+        })
+        self.assertRedirects(response, self.book.get_absolute_url())
+
+        book = Book.objects.get(pk=self.book.pk)
+        self.assertEqual(book.author, self.other)
+        self.assertEqual(set(book.genre.all()), set(self.genres[1:]))
+
+
+class CopyCirculationApiTest(TestCase):
+
+    def setUp(self):
+        librarian = User.objects.create_user(username='librarian', password='12345')
+        librarian.user_permissions.add(
+            Permission.objects.get(codename='can_mark_returned'), Permission.objects.get(codename='can_renew'))
+        self.borrower = User.objects.create_user(username='borrower', password='12345')
+        book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEF')
+        self.copy = BookInstance.objects.create(book=book, imprint='Imprint', status='a')
+        self.client.login(username='librarian', password='12345')
+
+    def post(self, action, data=None):
+        return self.client.post(reverse('copy-' + action, args=[self.copy.pk]), data or {})
+
+    def test_checkout_renew_return(self):
+        response = self.post('checkout', {'borrower': 'borrower', 'version': 0})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'o')
+        self.assertEqual(response.json()['borrower'], 'borrower')
+        self.assertEqual(response.json()['due_back'],
+                         (datetime.date.today() + datetime.timedelta(weeks=3)).isoformat())
+
+        renewal_date = datetime.date.today() + datetime.timedelta(weeks=4)
+        response = self.post('renew', {'renewal_date': renewal_date, 'version': 1})
+        self.assertEqual(response.json()['due_back'], renewal_date.isoformat())
+
+        response = self.post('return', {'version': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()['status'], response.json()['version']), ('a', 3))
+
+    def test_conflicts(self):
+        self.post('checkout', {'borrower': 'borrower'})
+
+        response = self.post('checkout', {'borrower': 'borrower'})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['copy']['version'], 1)
+
+        response = self.post('return', {'version': 0})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(BookInstance.objects.get(pk=self.copy.pk).status, 'o')
+
+    def test_invalid_and_unknown(self):
+        response = self.post('checkout', {'borrower': 'nobody'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('borrower', response.json()['errors'])
+
+        response = self.client.post(reverse('copy-return', args=[uuid.uuid4()]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_permission_and_method(self):
+        self.assertEqual(self.client.get(reverse('copy-return', args=[self.copy.pk])).status_code, 405)
+        self.client.login(username='borrower', password='12345')
+        self.assertEqual(self.post('return').status_code, 403)
+
+    def test_renewal_form_reports_conflict(self):
+        self.post('checkout', {'borrower': 'borrower'})
+        response = self.client.post(reverse('renew-book-librarian', args=[self.copy.pk]), {
+            'renewal_date': datetime.date.today() + datetime.timedelta(weeks=2), 'version': 0})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('The copy was changed by someone else (version 1).', response.context['form'].non_field_errors())
+        self.assertEqual(response.context['form']['version'].value(), 1)
+
+
+class HoldViewsTest(TestCase):
+
+    def setUp(self):
+        librarian = User.objects.create_user(username='librarian', password='12345')
+        librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+        self.patron = User.objects.create_user(username='patron', password='12345')
+        self.book   = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEF')
+        self.copy   = BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+        self.client.login(username='patron', password='12345')
+
+    def test_place_and_cancel_hold(self):
+        response = self.client.post(reverse('place-hold', args=[self.book.pk]), follow=True)
+        self.assertRedirects(response, reverse('my_borrowed'))
+        self.assertContains(response, 'A copy of &quot;Book Title&quot; is reserved for you.')
+        hold = response.context['holds'][0]
+        self.assertEqual((hold.status, hold.copy_id), (Hold.READY, self.copy.pk))
+
+        response = self.client.post(reverse('place-hold', args=[self.book.pk]), follow=True)
+        self.assertContains(response, 'You already have a hold on this book.')
+
+        self.client.post(reverse('cancel-hold', args=[hold.pk]))
+        self.assertEqual(Hold.objects.get(pk=hold.pk).status, Hold.CANCELLED)
+        self.assertEqual(BookInstance.objects.get(pk=self.copy.pk).status, 'a')
+
+    def test_only_own_holds_can_be_cancelled(self):
+        hold = Hold.objects.create(book=self.book, patron=User.objects.create_user(username='other'))
+        response = self.client.post(reverse('cancel-hold', args=[hold.pk]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_pick_up(self):
+        self.client.post(reverse('place-hold', args=[self.book.pk]))
+        hold = Hold.objects.get()
+        self.assertEqual(self.client.post(reverse('pick-up-hold', args=[hold.pk])).status_code, 403)
+
+        self.client.login(username='librarian', password='12345')
+        response = self.client.post(reverse('pick-up-hold', args=[hold.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()['status'], response.json()['borrower']), ('o', 'patron'))
+
+        response = self.client.post(reverse('pick-up-hold', args=[hold.pk]))
+        self.assertEqual(response.status_code, 409)
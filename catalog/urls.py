@@ -27,6 +27,9 @@ urlpatterns = [
     url(r'^authors/$', views.AuthorListView.as_view(), name='authors'),
     url(r'^author/(?P<pk>\d+)$', views.AuthorDetailView.as_view(), name='author-detail'),
 
+    # /catalog/search/?q=<words>
+    url(r'^search/$', views.search, name='search'),
+
 ]
 
 urlpatterns += [
@@ -40,6 +43,42 @@ urlpatterns += [
 # Uses our form
 urlpatterns += [
     url(r'^book/(?P<pk>[-\w]+)/renew/$', views.renew_book_librarian, name='renew-book-librarian'),
+    # Renew or return many copies at once.
+    url(r'^borrowed/bulk/$', views.bulk_circulation, name='bulk-circulation'),
+]
+
+# JSON endpoints for checking out, returning and renewing one copy (POST).
+urlpatterns += [
+    url(r'^copy/(?P<pk>[0-9a-f-]{36})/checkout/$', views.checkout_copy, name='copy-checkout'),
+    url(r'^copy/(?P<pk>[0-9a-f-]{36})/return/$',   views.return_copy,   name='copy-return'),
+    url(r'^copy/(?P<pk>[0-9a-f-]{36})/renew/$',    views.renew_copy,    name='copy-renew'),
+]
+
+# Holds (POST): Place a hold on a book, cancel it, lend the reserved copy (JSON).
+urlpatterns += [
+    url(r'^book/(?P<pk>\d+)/hold/$',        views.place_hold,   name='place-hold'),
+    url(r'^hold/(?P<pk>\d+)/cancel/$',      views.cancel_hold,  name='cancel-hold'),
+    url(r'^hold/(?P<pk>\d+)/pickup/$',      views.pick_up_hold, name='pick-up-hold'),
+]
+
+# Most borrowed books, genres, languages (librarians): /catalog/reports/circulation/?by=genre&days=90
+urlpatterns += [
+    url(r'^reports/circulation/$', views.circulation_report, name='circulation-report'),
+]
+
+# Hit/miss counts of the cached page fragments (JSON, staff only).
+urlpatterns += [
+    url(r'^fragments/stats/$', views.fragment_stats, name='fragment-stats'),
+]
+
+# Autocomplete widgets (JSON): /catalog/autocomplete/author/?q=smi
+urlpatterns += [
+    url(r'^autocomplete/(?P<kind>\w+)/$', views.autocomplete, name='autocomplete'),
+]
+
+# Streaming export: /catalog/export/book.csv, /catalog/export/copy.jsonl, ...
+urlpatterns += [
+    url(r'^export/(?P<kind>\w+)\.(?P<format>\w+)$', views.export, name='export'),
 ]
 
 urlpatterns += [
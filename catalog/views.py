@@ -5,51 +5,53 @@ from django.contrib.auth.mixins import PermissionRequiredMixin
 from django.contrib.auth.decorators import permission_required
 
 # Create your views here.
-from .models import Book, Author, BookInstance, Genre 
+from .models import Book, Author, BookInstance, BookRecommendation, Genre, Hold
+from . import stats, visits
 
 def index(request):
     """
     View function for home page of site. 
     """
-    # Generate counts of some of the main objects. 
-    num_books = Book.objects.all().count()
-    num_instances = BookInstance.objects.all().count()
-    # Available books (status = 'a')
-    # TODO: Test if we can use num_instances.filter(status__exact='a').count() below.
-    num_instances_available = BookInstance.objects.filter(status__exact='a').count()
-    num_authors = Author.objects.count() # NOTE: The 'all()' is implied by default.
-    
-    # "Challenge yourself"
-    num_genres = Genre.objects.all().count()
-    # __icontains (contains, case insensitive)
-    num_python_books = Book.objects.filter(title__icontains='Python').count()
-
-    # Number of visits to this view, as counted in the session variable.
-    # get(key, 'default value if key is not present')
-    # NOTE: By default, Django only saves to the session database and sends the session cookie to the client
-    #       when the session has been modified (assigned) or deleted.
-    num_visits = request.session.get('num_visits', 0)
-    request.session['num_visits'] = num_visits + 1
+    # Record counts of the main objects.
+    # NOTE: The counts are precomputed (see catalog/stats.py),
+    #       so this is a single lookup instead of one COUNT(*) query per number.
+    statistics = stats.get_statistics()
+
+    # Number of visits to this view, counted in the session or in a signed cookie
+    # (settings.CATALOG_VISIT_COUNTER, see catalog/visits.py).
+    # NOTE: The cookie mode avoids a session write (a database write with the default
+    #       session engine) on every view of the home page.
+    num_visits = visits.get_visits(request)
 
 
     # Render the HTML template index.html with the data in the context variable. 
-    return render(
+    response = render(
         request,
         'index.html', # /locallibrary/catalog/templates/index.html
-        context={'num_books': num_books,
-                 'num_instances': num_instances,
-                 'num_instances_available': num_instances_available,
-                 'num_authors': num_authors,
-                 'num_genres': num_genres,
-                 'num_python_books': num_python_books,
+        context={'num_books': statistics.num_books,
+                 'num_instances': statistics.num_instances,
+                 'num_instances_available': statistics.num_instances_available,
+                 'num_authors': statistics.num_authors,
+                 'num_genres': statistics.num_genres,
+                 'num_python_books': statistics.num_python_books,
                  'num_visits': num_visits,
         },
     ) 
+    visits.record_visit(request, response, num_visits)
+    return response
 
 from django.views import generic 
 
-class BookListView(generic.ListView):
+from .pagination import KeysetPaginationMixin, QueryPreservingPaginationMixin
+# Answer 304 Not Modified for unchanged pages (see catalog/conditional.py).
+from .conditional import DetailConditionalGetMixin, ListConditionalGetMixin
+from .forms import BookFacetForm
+from . import facets
+
+class BookListView(ListConditionalGetMixin, KeysetPaginationMixin, generic.ListView):
     model = Book # NOTE: Shorthand for queryset = Book.objects.all()
+    # Join the author shown next to each book (no extra query per row).
+    queryset = Book.objects.for_listing()
 
     # Variable accessible in template: model_name_list (here: book_list)
     # NOTE: According to the documentation at: https://docs.djangoproject.com/en/1.10/topics/class-based-views/generic-display/
@@ -61,6 +63,10 @@ class BookListView(generic.ListView):
     paginate_by = 20
     # Next: Add support for pagination to the base HTML template.
 
+    # Keyset pagination (see catalog/pagination.py): The next page is requested with
+    # /catalog/books/?cursor=<token> and found through the (title, id) index.
+    keyset_ordering = ('title', 'id')
+
     # Looks for the template /locallibrary/catalog/templates/catalog/book_list.html
     # /project_name/application_name/templates/application_name/model_name_list.html   #  (but did not work anymore with a custom context_object_name.)
 
@@ -84,19 +90,39 @@ class BookListView(generic.ListView):
     # NOTE: But here we still use the default name (book_list).
     # template_name = 'books/my_arbitrary_template_name_list.html'
 
+    # Facets: ?genre=<id>&language=<id>&author=<id>&available=1 (see catalog/facets.py)
+    def get_queryset(self):
+        queryset = super(BookListView, self).get_queryset()
+
+        self.filters = BookFacetForm(self.request.GET).get_filters()
+        return facets.filter_books(queryset, self.filters)
+
+    def get_etag_parts(self):
+        parts = super(BookListView, self).get_etag_parts()
+        if parts is not None:
+            # The facet counts (shown next to the list) change with any book.
+            parts.append(facets.get_version())
+        return parts
+
     # Override get_context_data() in order to pass additional context variables to the template:
     def get_context_data(self, **kwargs):
         # Call the base implementation first to get a context.
         context = super(BookListView, self).get_context_data(**kwargs)
         # Add new/altered context as a key/value pair:
         context['some_data'] = 'This is just some data.'
+        # Facet values with their (cached) book counts.
+        context['facets'] = facets.get_facets(
+            self.filters, self.request.GET, self.cursor_kwarg, self.page_kwarg)
+        context['facets_selected'] = bool(self.filters)
 
         # Return altered context.
         return context
 
 
-class BookDetailView(generic.DetailView):
+class BookDetailView(DetailConditionalGetMixin, generic.DetailView):
     model = Book
+    # Joins author and language (see BookQuerySet).
+    queryset = Book.objects.for_detail()
 
     # By default looks for the following template:
     # /locallibrary/catalog/templates/catalog/book_detail.html
@@ -105,6 +131,13 @@ class BookDetailView(generic.DetailView):
     # - object
     # - book (= Model name)
 
+    def get_context_data(self, **kwargs):
+        context = super(BookDetailView, self).get_context_data(**kwargs)
+        # "Patrons who borrowed this also borrowed" (see catalog/recommendations.py):
+        # ONE query on the index (book, rank), joined with the recommended books.
+        context['recommendations'] = (BookRecommendation.objects.filter(book=self.object)
+                                      .select_related('recommended').order_by('rank'))
+        return context
 
 
 # NOTE: The DetailView class automatically raises an Http404 exception,
@@ -127,13 +160,23 @@ def book_detail_view(request, pk):
     )
 '''
 
-class AuthorListView(generic.ListView):
+class AuthorListView(ListConditionalGetMixin, KeysetPaginationMixin, generic.ListView):
     model = Author
     paginate_by = 10
+    # NOTE: Also gives the list a stable order (there was none before).
+    keyset_ordering = ('last_name', 'first_name', 'id')
 
-class AuthorDetailView(generic.DetailView):
+class AuthorDetailView(DetailConditionalGetMixin, generic.DetailView):
     model = Author
 
+    def get_context_data(self, **kwargs):
+        context = super(AuthorDetailView, self).get_context_data(**kwargs)
+        # Books with their genres and copy counts (see BookQuerySet).
+        # NOTE: A queryset is lazy: It is only evaluated if the cached fragment
+        #       of the template has to be rendered again.
+        context['books'] = Book.objects.filter(author=self.object).for_bibliography()
+        return context
+
 
 # LoginRequiredMixin: Restrict access to logged-in users
 from django.contrib.auth.mixins import LoginRequiredMixin
@@ -162,20 +205,49 @@ class LoanedBooksByUserListView(LoginRequiredMixin, generic.ListView):
     paginate_by = 10
 
     def get_queryset(self):
-        return BookInstance.objects.filter(borrower=self.request.user).filter(status__exact='o').order_by('due_back')
+        # Join the book and let the database compute the overdue flag
+        # (instead of one query and one Python check per row in the template).
+        return (BookInstance.objects.filter(borrower=self.request.user).on_loan()
+                .for_circulation().with_overdue().order_by('due_back'))
+
+    def get_context_data(self, **kwargs):
+        context = super(LoanedBooksByUserListView, self).get_context_data(**kwargs)
+        # The user's holds that are waiting or ready for pickup (see catalog/holds.py).
+        context['holds'] = (Hold.objects.filter(patron=self.request.user, status__in=Hold.ACTIVE)
+                            .select_related('book').order_by('created_at', 'id'))
+        return context
+
+from .forms import LoanFilterForm
 
 # See top of page:
 # from django.contrib.auth.mixins import PermissionRequiredMixin
 # NOTE: Testing for a permission also tests for authentication.
 # For more details on permissions, see comments with Meta class of Bookinstance model.
-class LoanedBooksListView(PermissionRequiredMixin, generic.ListView):
+class LoanedBooksListView(PermissionRequiredMixin, QueryPreservingPaginationMixin, generic.ListView):
     model         = BookInstance
     template_name = 'catalog/bookinstance_list_borrowed.html'
-    paginate      = 20
+    # NOTE: The attribute is called paginate_by (it was 'paginate' before, which did nothing
+    #       and loaded all loans on one page).
+    paginate_by   = 20
 
     permission_required = ('catalog.can_mark_returned')
 
-    queryset = BookInstance.objects.filter(status__exact='o').order_by('due_back')
+    def get_queryset(self):
+        # Book and borrower are joined in the same query, the overdue flag is computed by the database.
+        # (id as tie-breaker, so the pages are stable for equal due dates.)
+        queryset = (BookInstance.objects.on_loan().for_circulation().with_overdue()
+                    .order_by('due_back', 'id'))
+
+        # Server-side filters: ?overdue=on, ?due_within=<days>, ?borrower=<username>
+        self.filter_form = LoanFilterForm(self.request.GET)
+        return self.filter_form.filter(queryset)
+
+    def get_context_data(self, **kwargs):
+        context = super(LoanedBooksListView, self).get_context_data(**kwargs)
+        context['filter_form'] = self.filter_form
+        # Default date for renewing the selected copies.
+        context['proposed_renewal_date'] = datetime.date.today() + datetime.timedelta(weeks=3)
+        return context
 
 
 # from django.contrib.auth.decorators import permission_required # Moved to top of page.
@@ -184,7 +256,8 @@ from django.http import HttpResponseRedirect
 from django.core.urlresolvers import reverse
 import datetime
 
-from .forms import RenewBookForm
+from .forms import RenewCopyForm
+from . import circulation
 
 @permission_required("catalog.can_renew")
 def renew_book_librarian(request, pk):
@@ -195,32 +268,40 @@ def renew_book_librarian(request, pk):
     if request.method == 'POST':
 
         # Create a form instance and populate it with the data from the request:
-        form = RenewBookForm(request.POST)
+        form = RenewCopyForm(request.POST)
         
         # NOTE: If the form data is not valid, render() will be called at the bottom
         #       with the form object in the context containing all the error messages. 
         if form.is_valid():
             # Process the data in form.cleaned_data as required 
-            # (Here we just write it to the model due_back field).
+            # (Here we write it to the model due_back field).
             # NOTE: The data returned by form.cleaned_data is
             # sanitised, validated, and converted into Python-friendly types.
             # (The data in request.POST[...] is not.)
-            book_inst.due_back = form.cleaned_data['renewal_date']
-            book_inst.save()
-
-            # Redirect to a new URL:
-            # Creates a status code 302 redirect to a specified URL.
-            # NOTE: 
-            # reverse: Generates a URL from 
-            # -- a URL configuration name and 
-            # -- a set of arguments. 
-            # It is the Python equivalent of the 'url' tag that we've been using in our templates.
-            return HttpResponseRedirect(reverse('borrowed'))
+            # NOTE: One conditional UPDATE (see catalog/circulation.py) instead of save(), so a change
+            #       made by someone else since the form was shown is not overwritten.
+            try:
+                circulation.renew_copy(book_inst.pk, form.cleaned_data['renewal_date'], form.cleaned_data['version'])
+            except circulation.CirculationConflict as conflict:
+                form.add_error(None, str(conflict))
+                book_inst = conflict.copy
+                # Submitting again renews the copy as it is now.
+                form.data = form.data.copy()
+                form.data['version'] = book_inst.version
+            else:
+                # Redirect to a new URL:
+                # Creates a status code 302 redirect to a specified URL.
+                # NOTE: 
+                # reverse: Generates a URL from 
+                # -- a URL configuration name and 
+                # -- a set of arguments. 
+                # It is the Python equivalent of the 'url' tag that we've been using in our templates.
+                return HttpResponseRedirect(reverse('borrowed'))
 
     # If this is a GET (or any other method) request, create the default form.
     else:
         proposed_renewal_date = datetime.date.today() + datetime.timedelta(weeks=3)
-        form = RenewBookForm(initial={'renewal_date': proposed_renewal_date,})
+        form = RenewCopyForm(initial={'renewal_date': proposed_renewal_date, 'version': book_inst.version})
 
     return render(
         request,
@@ -229,6 +310,245 @@ def renew_book_librarian(request, pk):
     )
 
 
+from django.core.exceptions import PermissionDenied
+from .forms import BulkCirculationForm
+
+@permission_required("catalog.can_mark_returned")
+def bulk_circulation(request):
+    """
+    Renews or returns many copies with one POST (e.g. the copies selected on the 'borrowed' page).
+
+    NOTE: The date is validated once (BulkCirculationForm), and all copies are changed
+          with a single UPDATE (see catalog/circulation.py), instead of one form and one save() per copy.
+    """
+    outcomes = None
+
+    if request.method == 'POST':
+        form = BulkCirculationForm(request.POST)
+        if form.is_valid():
+            copy_ids = form.cleaned_data['copies']
+            if form.cleaned_data['action'] == BulkCirculationForm.RENEW:
+                if not request.user.has_perm('catalog.can_renew'):
+                    raise PermissionDenied
+                outcomes = circulation.renew(copy_ids, form.cleaned_data['renewal_date'])
+            else:
+                outcomes = circulation.mark_returned(copy_ids)
+    else:
+        proposed_renewal_date = datetime.date.today() + datetime.timedelta(weeks=3)
+        form = BulkCirculationForm(initial={'renewal_date': proposed_renewal_date,})
+
+    return render(
+        request,
+        'catalog/bookinstance_bulk_circulation.html',
+        {'form': form, 'outcomes': outcomes}
+    )
+
+
+from django.http import JsonResponse
+from django.views.decorators.http import require_POST
+from .forms import CheckoutForm, CopyVersionForm
+
+# JSON endpoints for single copies: POST /catalog/copy/<id>/checkout/ (borrower, due_back), .../return/, .../renew/
+# (renewal_date). All accept 'version' (optimistic locking) and answer with the copy as it is afterwards:
+# -- 200: Changed.
+# -- 400: Invalid parameters ({"errors": {...}}).
+# -- 404: No such copy.
+# -- 409: Conflict: The copy is not in the right status, or has changed since 'version' ({"error": ..., "copy": ...}).
+
+def copy_data(copy):
+    return {
+        'id':       str(copy.pk),
+        'book':     copy.book_id,
+        'status':   copy.status,
+        'borrower': copy.borrower.username if copy.borrower else None,
+        'due_back': copy.due_back.isoformat() if copy.due_back else None,
+        'version':  copy.version,
+    }
+
+
+def change_copy_json(form, change):
+    """
+    Validates the form and calls change(cleaned_data), which returns the changed copy.
+    """
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    try:
+        copy = change(form.cleaned_data)
+    except BookInstance.DoesNotExist:
+        return JsonResponse({'error': 'No such copy.'}, status=404)
+    except circulation.CirculationConflict as conflict:
+        return JsonResponse({'error': str(conflict), 'copy': copy_data(conflict.copy)}, status=409)
+    return JsonResponse(copy_data(copy))
+
+
+@require_POST
+@permission_required('catalog.can_mark_returned', raise_exception=True)
+def checkout_copy(request, pk):
+    return change_copy_json(CheckoutForm(request.POST), lambda data: circulation.checkout(
+        pk, data['borrower'], data['due_back'], data['version']))
+
+
+@require_POST
+@permission_required('catalog.can_mark_returned', raise_exception=True)
+def return_copy(request, pk):
+    return change_copy_json(CopyVersionForm(request.POST), lambda data: circulation.return_copy(
+        pk, data['version']))
+
+
+@require_POST
+@permission_required('catalog.can_renew', raise_exception=True)
+def renew_copy(request, pk):
+    return change_copy_json(RenewCopyForm(request.POST), lambda data: circulation.renew_copy(
+        pk, data['renewal_date'], data['version']))
+
+
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from .forms import PickUpForm
+from . import holds
+
+# Holds (catalog/holds.py): Patrons place holds on the book page and cancel them on "My Borrowed".
+# Librarians lend the reserved copies: POST /catalog/hold/<id>/pickup/ (due_back), answered like the
+# copy endpoints above (200 with the copy, 400, 404 or 409 with {"error": ...}).
+
+@require_POST
+@login_required
+def place_hold(request, pk):
+    book = get_object_or_404(Book, pk=pk)
+    try:
+        hold = holds.place_hold(book, request.user)
+    except holds.HoldError as error:
+        messages.error(request, str(error))
+    else:
+        if hold.status == Hold.READY:
+            messages.success(request, 'A copy of "%s" is reserved for you.' % book.title)
+        else:
+            messages.success(request, 'You are on the waiting list for "%s".' % book.title)
+    return HttpResponseRedirect(reverse('my_borrowed'))
+
+
+@require_POST
+@login_required
+def cancel_hold(request, pk):
+    hold = get_object_or_404(Hold, pk=pk, patron=request.user)
+    try:
+        holds.cancel_hold(hold.pk)
+    except holds.HoldError as error:
+        messages.error(request, str(error))
+    return HttpResponseRedirect(reverse('my_borrowed'))
+
+
+@require_POST
+@permission_required('catalog.can_mark_returned', raise_exception=True)
+def pick_up_hold(request, pk):
+    form = PickUpForm(request.POST)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    try:
+        copy = holds.pick_up(pk, form.cleaned_data['due_back'])
+    except Hold.DoesNotExist:
+        return JsonResponse({'error': 'No such hold.'}, status=404)
+    except holds.HoldError as error:
+        return JsonResponse({'error': str(error)}, status=409)
+    return JsonResponse(copy_data(copy))
+
+
+from . import search as catalog_search
+
+def search(request):
+    """
+    View function for the full-text search over books and authors (/catalog/search/?q=...).
+    """
+    query = request.GET.get('q', '').strip()
+
+    # Ranked results, best match first (see catalog/search.py).
+    results = catalog_search.search(query) if query else []
+
+    return render(
+        request,
+        'catalog/search_results.html',
+        context={'query': query, 'results': results},
+    )
+
+
+from django.http import Http404, StreamingHttpResponse
+from . import exporter
+
+@permission_required('catalog.can_mark_returned')
+def export(request, kind, format):
+    """
+    Streams the export of all books, authors or copies (/catalog/export/<kind>.<csv|jsonl>).
+
+    NOTE: StreamingHttpResponse sends each line as soon as it is produced,
+          so the whole export is never held in memory (see catalog/exporter.py).
+    """
+    if kind not in exporter.KINDS or format not in exporter.FORMATS:
+        raise Http404("Unknown export")
+
+    response = StreamingHttpResponse(
+        exporter.iter_lines(kind, format),
+        content_type=exporter.CONTENT_TYPES[format],
+    )
+    response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (kind, format)
+    return response
+
+
+from django.contrib.admin.views.decorators import staff_member_required
+from . import fragments
+
+@staff_member_required
+def fragment_stats(request):
+    """
+    Hit and miss counts of the cached template fragments, per kind (see catalog/fragments.py), as JSON.
+    """
+    counters = fragments.get_counters()
+    for kind, counts in counters.items():
+        total = counts[fragments.HIT] + counts[fragments.MISS]
+        counts['hit_rate'] = round(counts[fragments.HIT] / total, 3) if total else None
+    return JsonResponse(counters)
+
+
+from django.utils.http import urlencode
+from .forms import CirculationReportForm
+from . import rollups
+
+@permission_required('catalog.can_mark_returned')
+def circulation_report(request):
+    """
+    Most borrowed books, genres or languages and checkouts per day, over the last ?days=30 days.
+    NOTE: Read from the daily rollups (and cached), never from the loan history (see catalog/rollups.py).
+    """
+    form = CirculationReportForm(request.GET)
+    by, days, top, key = form.get_options()
+    report = rollups.get_report(by, days, top, key)
+
+    selected = None
+    if key is not None:
+        # The name of the selected item, if it is in the ranking.
+        selected = next((ranked.name for ranked in report.top if ranked.id == key), str(key))
+
+    return render(request, 'catalog/circulation_report.html', context={
+        'form': form, 'report': report, 'days': days, 'selected': selected,
+        # Links to the daily checkouts of one item of the ranking: ?<query>&id=<id>
+        'query': urlencode({'by': by, 'days': days, 'top': top}),
+        'max_checkouts': max([day.checkouts for day in report.series] + [1]),
+    })
+
+
+from . import autocomplete as catalog_autocomplete
+
+def autocomplete(request, kind):
+    """
+    Matches for the autocomplete widgets (/catalog/autocomplete/<author|genre|book>/?q=...), as JSON:
+    {"results": [{"id": ..., "text": ...}, ...]} (see catalog/autocomplete.py).
+    """
+    if kind not in catalog_autocomplete.KINDS:
+        raise Http404("Unknown autocomplete")
+
+    matches = catalog_autocomplete.complete(kind, request.GET.get('q', ''))
+    return JsonResponse({'results': [{'id': pk, 'text': text} for pk, text in matches]})
+
+
 # Generic Editing Views
 # ==================================
 # Generic editing views avoid boilerplate by:
@@ -282,15 +602,19 @@ class AuthorDelete(PermissionRequiredMixin, DeleteView):
 # Challenge Youself:
 # Create views, templates, and urls to update Book entry.
 
+from .forms import BookForm
+
+# NOTE: BookForm renders the author and genres with autocomplete widgets
+#       (instead of a <select> of all authors and all genres).
 class BookCreate(PermissionRequiredMixin, CreateView):
     model = Book
-    fields = '__all__'
+    form_class = BookForm
     permission_required = ('catalog.can_renew')
     # Default template: book_form.html
 
 class BookUpdate(PermissionRequiredMixin, UpdateView):
     model = Book
-    fields = '__all__'
+    form_class = BookForm
     permission_required = ('catalog.can_renew')
     # Default template: book_form.html
 
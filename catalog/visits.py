@@ -0,0 +1,62 @@
+"""
+Counting a visitor's visits to the home page.
+
+The mode is selected with settings.CATALOG_VISIT_COUNTER:
+
+-- 'session': The count is stored in the session. Every visit changes the session,
+              so (with the default database session engine) every home page view
+              writes to the django_session table.
+-- 'cookie':  The count is stored in a signed cookie (the visitor can't change it).
+              No database access at all.
+
+Usage in a view:
+
+    num_visits = visits.get_visits(request)
+    response   = render(...)
+    visits.record_visit(request, response, num_visits)
+
+See the benchmark_home_page command to compare the modes.
+"""
+from django.conf import settings
+
+SESSION = 'session'
+COOKIE  = 'cookie'
+MODES   = (SESSION, COOKIE)
+
+KEY         = 'num_visits'
+COOKIE_SALT = 'catalog.visits'
+# One year.
+COOKIE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def get_mode():
+    mode = getattr(settings, 'CATALOG_VISIT_COUNTER', SESSION)
+    if mode not in MODES:
+        raise ValueError('Unknown CATALOG_VISIT_COUNTER: %s' % mode)
+    return mode
+
+
+def get_visits(request):
+    """
+    Returns the number of earlier visits of the visitor.
+    """
+    if get_mode() == COOKIE:
+        try:
+            return int(request.get_signed_cookie(KEY, default=0, salt=COOKIE_SALT, max_age=COOKIE_MAX_AGE))
+        except ValueError:
+            return 0
+    return request.session.get(KEY, 0)
+
+
+def record_visit(request, response, num_visits):
+    """
+    Stores the new number of visits (num_visits as returned by get_visits(), plus one).
+    """
+    if get_mode() == COOKIE:
+        response.set_signed_cookie(
+            KEY, num_visits + 1, salt=COOKIE_SALT, max_age=COOKIE_MAX_AGE, httponly=True,
+            secure=settings.SESSION_COOKIE_SECURE or None)
+    else:
+        # NOTE: By default, Django only saves to the session database and sends the session cookie to the client
+        #       when the session has been modified (assigned) or deleted.
+        request.session[KEY] = num_visits + 1
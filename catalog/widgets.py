@@ -0,0 +1,65 @@
+"""
+Form widgets of the catalog app.
+
+AutocompleteSelect / AutocompleteSelectMultiple replace the <select> of a
+ModelChoiceField / ModelMultipleChoiceField with large tables (e.g. all
+authors): Only the currently selected objects are rendered as <option>s, the
+others are searched as the user types (static/js/autocomplete.js asks
+the 'autocomplete' view, see catalog/views.py).
+
+    widgets = {'author': AutocompleteSelect('author')}
+
+The kind ('author', 'genre' or 'book') selects what the view searches.
+"""
+from django import forms
+from django.core.exceptions import ValidationError
+from django.core.urlresolvers import reverse
+from django.utils.encoding import force_text
+
+
+class AutocompleteMixin(object):
+
+    class Media:
+        js = ('js/autocomplete.js',)
+
+    def __init__(self, kind, attrs=None, choices=()):
+        self.kind = kind
+        super(AutocompleteMixin, self).__init__(attrs, choices)
+
+    def build_attrs(self, base_attrs, extra_attrs=None):
+        attrs = super(AutocompleteMixin, self).build_attrs(base_attrs, extra_attrs)
+        attrs['data-autocomplete-url'] = reverse('autocomplete', args=[self.kind])
+        return attrs
+
+    def selected_choices(self, value):
+        """
+        Returns (value, label) of the selected objects, loaded with one query.
+        """
+        values = [force_text(item) for item in value if item not in (None, '')]
+        if not values:
+            return []
+
+        field = self.choices.field
+        try:
+            objects = list(self.choices.queryset.filter(pk__in=values))
+        except (ValueError, ValidationError):
+            # Invalid input (e.g. not a number); the form reports it.
+            return []
+        return [(force_text(field.prepare_value(obj)), field.label_from_instance(obj)) for obj in objects]
+
+    def optgroups(self, name, value, attrs=None):
+        # NOTE: The base class iterates over self.choices, which loads the whole table.
+        options = []
+        if not self.allow_multiple_selected and not self.is_required:
+            options.append(self.create_option(name, '', self.choices.field.empty_label or '', False, 0, attrs=attrs))
+        for option_value, option_label in self.selected_choices(value):
+            options.append(self.create_option(name, option_value, option_label, True, len(options), attrs=attrs))
+        return [(None, options, 0)]
+
+
+class AutocompleteSelect(AutocompleteMixin, forms.Select):
+    pass
+
+
+class AutocompleteSelectMultiple(AutocompleteMixin, forms.SelectMultiple):
+    pass
@@ -50,6 +50,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # Before the session and authentication middleware, so cached pages are served without them.
+    'catalog.middleware.AnonymousPageCacheMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -108,6 +110,12 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Authentication backends
+# https://docs.djangoproject.com/en/1.11/topics/auth/customizing/#specifying-authentication-backends
+# Like the default ModelBackend, but the permissions of each user are cached between requests
+# (see catalog/backends.py and catalog/permissions.py).
+AUTHENTICATION_BACKENDS = ['catalog.backends.CachedPermissionBackend']
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/1.10/topics/i18n/
@@ -128,6 +136,148 @@ USE_TZ = True
 # http://stackoverflow.com/questions/23772001/redirect-after-login-simply-appends-login-redirect-url
 LOGIN_REDIRECT_URL = '/'
 
+# Consistency of the home page statistics (see catalog/stats.py):
+# -- 'exact': Counts are always up to date.
+# -- <N>:     Counts may be up to N seconds old (no writes to the statistics row on catalog changes).
+CATALOG_STATS_CONSISTENCY = os.environ.get('CATALOG_STATS_CONSISTENCY', 'exact')
+
+# Where the home page counts a visitor's visits (see catalog/visits.py):
+# -- 'cookie':  In a signed cookie (no database write per visit).
+# -- 'session': In the session (one session write per visit).
+CATALOG_VISIT_COUNTER = os.environ.get('CATALOG_VISIT_COUNTER', 'cookie')
+
+# Number of seconds the facet counts of the book list are cached (see catalog/facets.py).
+# NOTE: Changes invalidate the cached counts immediately, but only in caches shared by all
+#       worker processes (the default local memory cache is per process).
+CATALOG_FACETS_TIMEOUT = 600
+
+# Number of seconds the fragments of the book and author pages are cached (see catalog/fragments.py).
+# NOTE: Changes invalidate the fragments immediately (same caveat as for the facet counts above).
+CATALOG_FRAGMENTS_TIMEOUT = 3600
+
+# Number of seconds the permissions of a user are cached (see catalog/permissions.py).
+# NOTE: Changes invalidate them immediately, but only in caches shared by all worker processes.
+#       With the per process 'locmem' default cache (see CATALOG_CACHE below), the other workers
+#       keep using e.g. a revoked permission until their cached copy expires, so the timeout is
+#       short: Fewer permission queries are traded for a bounded delay. Configure a shared cache
+#       in production.
+CATALOG_PERMISSIONS_TIMEOUT = 3600 if os.environ.get('CATALOG_CACHE', 'locmem') != 'locmem' else 60
+
+# Loan history events are folded into the daily rollups of the circulation report once they are
+# this many seconds old (see catalog/rollups.py and the rollup_loans command).
+CATALOG_ROLLUP_LAG = 300
+
+# Number of seconds a circulation report is cached (see catalog/rollups.py).
+# NOTE: The next run of rollup_loans invalidates it.
+CATALOG_REPORTS_TIMEOUT = 600
+
+# Number of "Patrons who borrowed this also borrowed" recommendations kept per book
+# (see catalog/recommendations.py and the refresh_recommendations command).
+CATALOG_RECOMMENDATIONS_SIZE = 5
+
+# Caches
+# https://docs.djangoproject.com/en/1.11/topics/cache/
+# 'default':  Facet counts, template fragments, permissions and reports (see the CATALOG_*_TIMEOUT
+#             settings above). Backend selected with the environment variable CATALOG_CACHE (same
+#             choices as for 'pages' below) and CATALOG_CACHE_LOCATION.
+#             NOTE: Their invalidation only reaches all worker processes with a shared cache
+#                   ('file' on one machine, 'memcached' or 'redis').
+# 'pages':    Full pages for anonymous visitors (see catalog/pagecache.py). Backend selected with the
+#             environment variable CATALOG_PAGE_CACHE:
+# -- 'locmem':    Per process memory (default).
+# -- 'file':      Files in CATALOG_PAGE_CACHE_LOCATION, shared by all processes on one machine.
+# -- 'memcached': Memcached server(s) at CATALOG_PAGE_CACHE_LOCATION (needs python-memcached).
+# -- 'redis':     Redis server at CATALOG_PAGE_CACHE_LOCATION (needs the django-redis package).
+# 'sessions': Sessions of the 'cache' and 'cached_db' session engines (see Sessions below).
+#             Same choices, selected with CATALOG_SESSION_CACHE and CATALOG_SESSION_CACHE_LOCATION.
+CACHE_BACKENDS = {
+    'locmem':    'django.core.cache.backends.locmem.LocMemCache',
+    'file':      'django.core.cache.backends.filebased.FileBasedCache',
+    'memcached': 'django.core.cache.backends.memcached.MemcachedCache',
+    'redis':     'django_redis.cache.RedisCache',
+}
+DEFAULT_CACHE_LOCATIONS = {
+    'locmem':    'catalog-default',
+    'file':      os.path.join(BASE_DIR, 'default_cache'),
+    'memcached': '127.0.0.1:11211',
+    'redis':     'redis://127.0.0.1:6379/0',
+}
+DEFAULT_CACHE = os.environ.get('CATALOG_CACHE', 'locmem')
+PAGE_CACHE_LOCATIONS = {
+    'locmem':    'catalog-pages',
+    'file':      os.path.join(BASE_DIR, 'page_cache'),
+    'memcached': '127.0.0.1:11211',
+    'redis':     'redis://127.0.0.1:6379/1',
+}
+PAGE_CACHE = os.environ.get('CATALOG_PAGE_CACHE', 'locmem')
+SESSION_CACHE_LOCATIONS = {
+    'locmem':    'catalog-sessions',
+    'file':      os.path.join(BASE_DIR, 'session_cache'),
+    'memcached': '127.0.0.1:11211',
+    'redis':     'redis://127.0.0.1:6379/2',
+}
+SESSION_CACHE = os.environ.get('CATALOG_SESSION_CACHE', 'locmem')
+
+CACHES = {
+    'default': {
+        'BACKEND':  CACHE_BACKENDS[DEFAULT_CACHE],
+        'LOCATION': os.environ.get('CATALOG_CACHE_LOCATION', DEFAULT_CACHE_LOCATIONS[DEFAULT_CACHE]),
+    },
+    'pages': {
+        'BACKEND':  CACHE_BACKENDS[PAGE_CACHE],
+        'LOCATION': os.environ.get('CATALOG_PAGE_CACHE_LOCATION', PAGE_CACHE_LOCATIONS[PAGE_CACHE]),
+    },
+    'sessions': {
+        'BACKEND':  CACHE_BACKENDS[SESSION_CACHE],
+        'LOCATION': os.environ.get('CATALOG_SESSION_CACHE_LOCATION', SESSION_CACHE_LOCATIONS[SESSION_CACHE]),
+    },
+}
+
+# Sessions
+# https://docs.djangoproject.com/en/1.11/topics/http/sessions/
+# Session engine selected with the environment variable CATALOG_SESSION_ENGINE
+# (see the benchmark_sessions command to compare them), and what cleans up expired sessions:
+# -- 'db':             The django_session table (default). Every request of a logged in user reads it.
+#                      Cleanup: Run "python3 manage.py clearsessions" regularly (e.g. daily from cron).
+# -- 'cached_db':      Read from the 'sessions' cache, written to the cache AND the database (so sessions
+#                      survive a cache restart). Cleanup: clearsessions for the table; the cache entries
+#                      expire with the session.
+# -- 'cache':          Only in the 'sessions' cache. Use a shared, persistent cache (memcached, redis) in
+#                      production: with 'locmem' every worker process has its own sessions, and a cache
+#                      restart or eviction logs users out. Cleanup: None needed, entries expire with the session.
+# -- 'file':           Files in CATALOG_SESSION_FILE_PATH (default: the system temporary directory).
+#                      Cleanup: clearsessions deletes the expired files.
+# -- 'signed_cookies': The session data is in the (signed, not encrypted) cookie itself, no server storage.
+#                      Cleanup: None needed. NOTE: A session can't be revoked on the server (logging out
+#                      only clears the cookie of that browser), the data must stay small (cookie size
+#                      limit), and anyone knowing SECRET_KEY can forge sessions.
+SESSION_ENGINES = {
+    'db':             'django.contrib.sessions.backends.db',
+    'cached_db':      'django.contrib.sessions.backends.cached_db',
+    'cache':          'django.contrib.sessions.backends.cache',
+    'file':           'django.contrib.sessions.backends.file',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+SESSION_ENGINE      = SESSION_ENGINES[os.environ.get('CATALOG_SESSION_ENGINE', 'db')]
+SESSION_CACHE_ALIAS = 'sessions'
+SESSION_FILE_PATH   = os.environ.get('CATALOG_SESSION_FILE_PATH') or None
+
+# Full-page cache for anonymous visitors (see catalog/pagecache.py).
+CATALOG_PAGE_CACHE_ALIAS = 'pages'
+# (Regular expression matched against the URL path, seconds): The first match wins.
+# NOTE: The catalog signal handlers purge changed pages right away, the timeouts only limit
+#       how long unchanged pages are kept. The home page (visit counter) is never cached.
+# NOTE: Purges only reach all worker processes with a shared 'pages' cache (CATALOG_PAGE_CACHE
+#       'file', 'memcached' or 'redis'). With the per process 'locmem' default, a purge only clears
+#       the process that handled the change, and the other workers serve the outdated book, author
+#       and list pages for up to the timeouts below. Use 'locmem' with one worker process only.
+CATALOG_PAGE_CACHE_TIMEOUTS = (
+    (r'^/catalog/books/$',       60),
+    (r'^/catalog/authors/$',     300),
+    (r'^/catalog/book/\d+$',     600),
+    (r'^/catalog/author/\d+$',   600),
+)
+
 # Sends email to console for testing purposes.
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 